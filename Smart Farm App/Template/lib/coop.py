@@ -0,0 +1,53 @@
+"""
+    coop
+
+    Cooperative scheduler for the firmware, in the style of uasyncio
+    but without needing it on the board
+
+    A task is a generator: `yield seconds` suspends it for that long
+    (`yield` or `yield 0`: until the other due tasks had a turn).
+    Nothing else may block for long, so a task starts a sensor
+    conversion, yields for the conversion time and collects the result.
+"""
+
+import time
+
+
+class Scheduler:
+    '''Runs generator tasks, each when its delay is up, in turn'''
+
+    def __init__(self):
+        self.tasks = []  # [due (ticks_ms), generator]
+
+    def create_task(self, task, delay=0):
+        '''Adds a generator, first run after delay seconds'''
+        self.tasks.append([time.ticks_add(time.ticks_ms(), int(delay * 1000)), task])
+        return task
+
+    def call_later(self, delay, func, *args):
+        '''Runs func(*args) once after delay seconds'''
+        def call():
+            yield delay
+            func(*args)
+        self.create_task(call())
+
+    def run_once(self):
+        '''Sleeps until the next task is due and runs it up to its next yield'''
+        now = time.ticks_ms()
+        entry = min(self.tasks, key=lambda task: time.ticks_diff(task[0], now))
+        wait = time.ticks_diff(entry[0], now)
+        if wait > 0:
+            time.sleep_ms(wait)
+        # Runs go to the back of the list, so tasks due at the same time take turns
+        self.tasks.remove(entry)
+        try:
+            delay = next(entry[1])
+        except StopIteration:
+            return
+        entry[0] = time.ticks_add(time.ticks_ms(), int((delay or 0) * 1000))
+        self.tasks.append(entry)
+
+    def run_forever(self):
+        '''Runs tasks until none are left; an exception in a task stops the scheduler'''
+        while self.tasks:
+            self.run_once()
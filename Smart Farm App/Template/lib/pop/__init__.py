@@ -333,6 +333,9 @@ class I2c():
 
 ##################################################################
 class Light(PopThread):
+    # One-time H-resolution mode 2 conversion, at most 180 ms
+    CONVERSION_TIME = 0.180
+
     def __init__(self, addr):
         super().__init__()
         self.i2c = I2c(addr)
@@ -347,13 +350,18 @@ class Light(PopThread):
         #self.i2c.write(0x11)
         time.sleep(0.180)
     
-    def read(self):
+    def start(self):
         self.i2c.write(0x21)
-        time.sleep(0.180)
-        
+
+    def collect(self):
         data = self.i2c.reads(2)
 
         return round((data[0] << 8 | data[1]) / (1.2 * 2)) 
+
+    def read(self):
+        self.start()
+        time.sleep(self.CONVERSION_TIME)
+        return self.collect()
   
 ##################################################################
 class PwmController():
@@ -516,6 +524,8 @@ class RgbLedBar():
 
 ##################################################################
 class Window():
+    # Time the servo takes to reach a new angle
+    SETTLE_TIME = 1
 
     def __init__(self, addr=0x40):
         self.pwmcontroller = PwmController(addr)
@@ -527,31 +537,37 @@ class Window():
         self.pwmcontroller.setDuty(0, 4095)
         self.close()
     
-    def open(self, step = None):
+    def open(self, step = None, wait=True):
         self.power.on()
         if step == 1:
-            self._angle(15)
+            self._angle(15, wait)
         elif step == 2:
-            self._angle(30)
+            self._angle(30, wait)
         elif step == 3:
-            self._angle(45)
+            self._angle(45, wait)
         elif step == 4:
-            self._angle(60)
+            self._angle(60, wait)
         elif step == 5:
-            self._angle(75)
+            self._angle(75, wait)
         else:
-            self._angle(90)
+            self._angle(90, wait)
 
-    def close(self):        
-        self._angle(0)        
-        self.power.off()        
+    def close(self, wait=True):
+        # Without wait, the caller cuts the power (self.power.off()) once SETTLE_TIME has passed
+        self._angle(0, wait)        
+        if wait:
+            self.power.off()        
     
-    def _angle(self, angle):
+    def _angle(self, angle, wait=True):
         self.pwmcontroller.setDuty(int(497-(angle*2.38)), 4095)  
-        time.sleep(1)      
+        if wait:
+            time.sleep(self.SETTLE_TIME)      
 
 ##################################################################
 class Tphg(PopThread):
+    # A forced-mode cycle with the settings below: osrs_t x8, osrs_p x4, osrs_h x2 (~33 ms) and the 148 ms heater wait
+    MEASUREMENT_TIME = 0.181
+
     def __init__(self, addr):
         super().__init__()
         self.i2c = I2c(addr)
@@ -587,6 +603,7 @@ class Tphg(PopThread):
         self._adc_hum = None
         self._adc_gas = None
         self._gas_range = None
+        self._data = None
         
     def _temperature(self):
         calc_temp = ((self._t_fine * 5) + 128) / 256
@@ -637,17 +654,31 @@ class Tphg(PopThread):
         calc_gas_res = (var3 + (var2 / 2)) / var2
         return int(calc_gas_res)
     
-    def _perform_reading(self):        
+    def start(self):
+        # Forced mode: one TPH + gas cycle, about MEASUREMENT_TIME
         ctrl = self.i2c.readBlock(0x74,1)[0] #ctrl_meas
         ctrl = (ctrl & 0xFC) | 0x01  # ctrl_meas, mode<1:0>
         self.i2c.writeByte(0x74, ctrl) #ctrl_temp
-                
-        new_data = False
-        while not new_data:
-            data = self.i2c.readBlock(0x1D, 15) #meas_status_0
-            new_data = data[0] & 0x80 != 0
+
+    def ready(self):
+        data = self.i2c.readBlock(0x1D, 15) #meas_status_0
+        if data[0] & 0x80 == 0:
+            return False
+        self._data = data
+        return True
+
+    def collect(self):
+        # After ready() returned True
+        self._parse(self._data)
+        return round(self._temperature(), 2), round(self._pressure(), 2), round(self._humidity(), 2), self._gas() 
+
+    def _perform_reading(self):        
+        self.start()
+        while not self.ready():
             time.sleep(0.005)
-        
+        self._parse(self._data)
+
+    def _parse(self, data):
         self._adc_pres = ((data[2] * 4096) + (data[3] * 16) + (data[4] / 16))
         _adc_temp = ((data[5] * 4096) + (data[6] * 16) + (data[7] / 16))
         self._adc_hum = struct.unpack(">H", bytes(data[8:10]))[0]
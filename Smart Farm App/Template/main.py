@@ -4,9 +4,12 @@ from mqtt.mqtt import MQTTClient
 import pop
 import json
 import machine
+import ubinascii
+import coop
 
 file_path_wifi = "/flash/wifi.json"
 file_path_data = "/flash/sfdata.json"
+file_path_boot = "/flash/boot.json"
 
 # def load_wifi_demo():
 #     wifi_data = None
@@ -46,15 +49,17 @@ def connect_to_wifi(wifi_name, password):
         # print("Try to connect again...")
         time.sleep(1)
         wlan.connect(wifi_name, auth=(WLAN.WPA2, password), timeout=5000)
+    return wlan
 
     # print("Connected to WiFi")
     # print("Network Config: {}".format(wlan.ifconfig()))
 
 wifi_name, password = load_wifi(file_path_wifi)
-connect_to_wifi(wifi_name, password)
+wlan = connect_to_wifi(wifi_name, password)
 
 
 # Print IP to LCD
+textlcd = pop.Textlcd()
 my_ip = str(wlan.ifconfig()[0])
 textlcd.print(my_ip)
 
@@ -64,13 +69,33 @@ ADAFRUIT_AIO_KEY      = ""
 OUT_CHANNEL = "SmartFarmUSTH/feeds/sfout"
 IN_CHANNEL = "SmartFarmUSTH/feeds/sfinp"
 WIFI_OUT = "SmartFarmUSTH/feeds/wfout"
+STATE_OUT = "SmartFarmUSTH/feeds/stout"
 
 client = MQTTClient("id1", "io.adafruit.com",user=ADAFRUIT_AIO_USERNAME, password=ADAFRUIT_AIO_KEY, port=1883)
 
+# Identity and sequence numbers, so the server can drop readings it has already stored
+DEVICE_ID = ubinascii.hexlify(machine.unique_id()).decode()
+
+
+def next_boot_count(file_path_boot):
+    # Persist a boot counter, so sequence numbers keep increasing across resets
+    try:
+        with open(file_path_boot, 'r') as file:
+            boot = json.load(file).get("boot", 0) + 1
+    except (OSError, ValueError):
+        boot = 1
+    with open(file_path_boot, 'w') as file:
+        file.write(json.dumps({"boot": boot}))
+    return boot
+
+
+# seq = boot count in the high 32 bits, reading counter in the low 32 bits
+seq = next_boot_count(file_path_boot) << 32
+
 # sensors
 co2 = pop.CO2()
 light = pop.Light(0x5C)
-# tphg = pop.Tphg(0x76)
+tphg = pop.Tphg(0x76)
 
 # def save_data_sf(co2, light):
 #     config = {"co2": co2, "ligth": light}
@@ -82,15 +107,66 @@ light = pop.Light(0x5C)
 win_var = pop.Window()
 fan = pop.Fan()
 rgb = pop.RgbLedBar()
-    
+
+# Sensors are read every SENSOR_PERIOD seconds; MQTT is polled in between, so commands don't wait for the readings
+SENSOR_PERIOD = 5
+MQTT_POLL_INTERVAL = 0.02
+
+scheduler = coop.Scheduler()
+
+# Actuator states as last set by this device; the server only trusts what the device reports
+actuator_state = {"fan": "off", "window": "closed", "light": "off"}
+
+# Command -> (actuator, new state)
+ACTUATOR_COMMANDS = {
+    "win_open": ("window", "open"),
+    "win_close": ("window", "closed"),
+    "light_open": ("light", "on"),
+    "light_close": ("light", "off"),
+    "fan_open": ("fan", "on"),
+    "fan_close": ("fan", "off"),
+}
+
+
+def publish_state(cause):
+    global seq
+    # Full snapshot, so the server never depends on seeing every change; Seq orders it against the readings
+    report = {"Device": DEVICE_ID, "State": actuator_state, "Seq": seq, "Time": time.time(), "Cause": cause}
+    seq += 1
+    client.publish(STATE_OUT, json.dumps(report))
+
+
+# Window moves so far; a pending power off is skipped if the window was moved again meanwhile
+window_moves = 0
+
+
+def open_window():
+    global window_moves
+    window_moves += 1
+    win_var.open(wait=False)
+
+
+def close_window():
+    global window_moves
+    window_moves += 1
+    win_var.close(wait=False)
+    scheduler.call_later(win_var.SETTLE_TIME, window_power_off, window_moves)
+
+
+def window_power_off(move):
+    # The servo has reached the closed position
+    if move == window_moves:
+        win_var.power.off()
+
+
 def sub_cb(topic, msg):
     topic = topic.decode()
     msg = msg.decode()
     if topic == IN_CHANNEL:
         if msg == "win_close":
-            win_var.close()
+            close_window()
         elif msg == "win_open":
-            win_var.open()
+            open_window()
         elif msg == "light_open":
             rgb.on()
             rgb.setColor([255, 255, 255])
@@ -99,7 +175,9 @@ def sub_cb(topic, msg):
         elif msg == "fan_open":
             fan.on()
         elif msg == "fan_close":
-            fan.off()         
+            fan.off()
+        elif msg == "check":
+            publish_state("check")
         elif msg == "/flash/wifi.json":
             with open(msg, 'r') as file:
                 data = json.load(file)
@@ -116,23 +194,57 @@ def sub_cb(topic, msg):
                 for wifi in data:
                     if wifi["wifi_name"] == wname:
                         wifi["activate"] = 1
-                with open(file_path_wifi, "w2") as f:
+                with open(file_path_wifi, "w") as f:
                     f.write(json.dumps(data))
             machine.reset()
 
+        if msg in ACTUATOR_COMMANDS:
+            actuator, state = ACTUATOR_COMMANDS[msg]
+            actuator_state[actuator] = state
+            publish_state(msg)
+
+
+# Start from a known state, and tell the server about it
+win_var.close()
+fan.off()
+rgb.off()
 
 client.set_callback(sub_cb)
 client.connect()
 client.subscribe(topic=IN_CHANNEL)
+publish_state("boot")
+
+def read_sensors():
+    global seq
+    while True:
+        started = time.ticks_ms()
+        # Both conversions run at once; collect them when done instead of sleeping through each
+        light.start()
+        tphg.start()
+        yield max(light.CONVERSION_TIME, tphg.MEASUREMENT_TIME)
+        while not tphg.ready():
+            yield 0.005
+
+        payload = { "CO2":0, "Light_0x5C":0, "Temperature":0, "Humidity":0}
+        payload['CO2'] = int(co2.read())
+        payload['Light_0x5C'] = int(light.collect())
+        payload['Temperature'], _, payload['Humidity'], _ = tphg.collect()
+        payload['Device'] = DEVICE_ID
+        payload['Seq'] = seq
+        payload['Time'] = time.time()
+        payload['State'] = actuator_state
+        seq += 1
+        client.publish(OUT_CHANNEL, json.dumps(payload))
+        yield max(SENSOR_PERIOD - time.ticks_diff(time.ticks_ms(), started) / 1000, 0)
+
+
+def service_mqtt():
+    while True:
+        client.check_msg()
+        yield MQTT_POLL_INTERVAL
 
-# print("Ready to connect MQTT...")
-while True:
-    # payload = {"co2": co2.read(), "light": light.read()}
-    payload = { "CO2":0, "Light_0x5C":0, "Temperature":0, "Humidity":0}
-    payload['CO2'] = int(co2.read())
-    payload['Light_0x5C'] = int(light_in.read())
-    payload['Temperature'], _, b1['Humidity'], _ = tphg_in.read()
-    client.publish(OUT_CHANNEL, json.dumps(payload))
-    client.check_msg()
-    time.sleep(5)
 
+# print("Ready to connect MQTT...")
+scheduler.create_task(read_sensors())
+scheduler.create_task(service_mqtt())
+scheduler.run_forever()
@@ -1,34 +1,444 @@
 import json
+import os
 import requests
+import threading
 import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from datetime import datetime, timezone
 
 # Key MB
 ADAFRUIT_AIO_USERNAME = 'SmartFarmUSTH'
 ADAFRUIT_AIO_KEY = ''
+# REST API root; point it at a local stand-in (benchmarks/fake_aio_server.py) to work offline
+AIO_BASE_URL = os.environ.get('AIO_BASE_URL', 'https://io.adafruit.com/api/v2').rstrip('/')
 
 # CHANNEL
 OUT_CHANNEL = "sfout"
 IN_CHANNEL = "sfinp"
 WIFI_CHANNEL = "wfout"
+STATE_CHANNEL = "stout"  # Actuator state reports published by the device
+# Feeds the device answers commands on: cached reads of them are stale once a command is sent
+REPLY_CHANNELS = (WIFI_CHANNEL, STATE_CHANNEL)
+
+# Request budget: Adafruit IO throttles each account (30 requests per minute on free accounts,
+# whichever client makes them). Every call takes a token from a bucket refilled at that rate;
+# control commands may empty it, telemetry reads leave CONTROL_RESERVE tokens for them.
+AIO_REQUESTS_PER_MINUTE = float(os.environ.get('AIO_REQUESTS_PER_MINUTE', '30'))
+AIO_BURST = float(os.environ.get('AIO_BURST', '10'))
+CONTROL_RESERVE = float(os.environ.get('AIO_CONTROL_RESERVE', '3'))
+# Seconds a control command may wait for a token before failing
+CONTROL_MAX_WAIT = float(os.environ.get('AIO_CONTROL_MAX_WAIT', '5'))
+# Out of budget, a telemetry read returns the feed's last value instead if it is at most this old
+MERGE_MAX_AGE = float(os.environ.get('AIO_MERGE_MAX_AGE', '60'))
+
+CONTROL = "control"
+TELEMETRY = "telemetry"
+
+# Seconds an Adafruit IO request may take to connect, and then between bytes of the answer
+AIO_TIMEOUT = float(os.environ.get('AIO_TIMEOUT', '10'))
+
+# Data points per page of a feed's history (Adafruit IO allows up to 1000)
+HISTORY_PAGE_SIZE = int(os.environ.get('AIO_HISTORY_PAGE_SIZE', '1000'))
+
+# Seconds a feed's last value is reused by later reads (0 disables caching, not request sharing),
+# e.g. AIO_FEED_TTLS='{"sfout": 2, "wfout": 5}'; other feeds use AIO_DEFAULT_FEED_TTL
+FEED_TTLS = dict({OUT_CHANNEL: 2.0, WIFI_CHANNEL: 5.0, STATE_CHANNEL: 1.0}, **json.loads(os.environ.get('AIO_FEED_TTLS', '{}')))
+DEFAULT_FEED_TTL = float(os.environ.get('AIO_DEFAULT_FEED_TTL', '2'))
+
+
+class BudgetExceeded(Exception):
+    """No request budget left for the call, or Adafruit IO answered 429."""
+
+
+class TokenBucket:
+    """Token bucket of Adafruit IO requests.
+
+    The bucket state lives in store(fn), which must atomically replace the state with fn(state) and
+    return the new state. The default store is this process only; pass one backed by shared memory
+    so that every worker of the account draws from the same budget. on_event(event, priority,
+    wait) is called for every decision: "granted", "rejected", "merged" and "throttled".
+    """
+
+    def __init__(self, per_minute, burst, reserve=0.0, store=None, clock=time.time):
+        self.per_minute = per_minute
+        self.burst = burst
+        self.reserve = reserve
+        self.store = store or self._local_store
+        self.clock = clock
+        self.on_event = None
+        self._lock = threading.Lock()
+        self._state = None
+
+    def _local_store(self, fn):
+        with self._lock:
+            self._state = fn(self._state)
+            return self._state
+
+    def _refill(self, state, now):
+        if state is None:
+            return self.burst, 0.0
+        elapsed = max(now - state["time"], 0.0)
+        return min(self.burst, state["tokens"] + elapsed * self.per_minute / 60.0), state["blocked_until"]
+
+    def try_take(self, priority):
+        """Take a token if the priority allows it; returns 0, or the seconds until it could."""
+        now = self.clock()
+        floor = 0.0 if priority == CONTROL else self.reserve
+
+        def take(state):
+            tokens, blocked_until = self._refill(state, now)
+            if now >= blocked_until and tokens - 1 >= floor:
+                return {"tokens": tokens - 1, "time": now, "blocked_until": blocked_until, "wait": 0.0}
+            wait = max(blocked_until - now, (floor + 1 - tokens) * 60.0 / self.per_minute)
+            return {"tokens": tokens, "time": now, "blocked_until": blocked_until, "wait": wait}
+
+        return self.store(take)["wait"]
+
+    def _event(self, event, priority, wait=0.0):
+        if self.on_event is not None:
+            self.on_event(event, priority, wait)
+
+    def _wait_or_raise(self, priority, started, wait, max_wait):
+        if self.clock() - started + wait > max_wait:
+            self._event("rejected", priority)
+            raise BudgetExceeded(f"Adafruit IO request budget exhausted, next {priority} request in {wait:.1f} s")
+
+    def acquire(self, priority, max_wait=0.0):
+        """Take a token, waiting up to max_wait seconds for one; raises BudgetExceeded otherwise."""
+        started = self.clock()
+        while True:
+            wait = self.try_take(priority)
+            if wait == 0:
+                self._event("granted", priority, self.clock() - started)
+                return
+            self._wait_or_raise(priority, started, wait, max_wait)
+            time.sleep(wait)
+
+    async def acquire_async(self, priority, max_wait=0.0):
+        import asyncio
+        started = self.clock()
+        while True:
+            wait = self.try_take(priority)
+            if wait == 0:
+                self._event("granted", priority, self.clock() - started)
+                return
+            self._wait_or_raise(priority, started, wait, max_wait)
+            await asyncio.sleep(wait)
+
+    def throttled(self, retry_after):
+        """Adafruit IO answered 429: empty the bucket and make no call for retry_after seconds."""
+        now = self.clock()
+        self.store(lambda state: {"tokens": 0.0, "time": now, "blocked_until": now + retry_after, "wait": retry_after})
+        self._event("throttled", None, retry_after)
+
+    def status(self):
+        now = self.clock()
+        state = self.store(lambda state: state)
+        tokens, blocked_until = self._refill(state, now)
+        return {
+            "requests_per_minute": self.per_minute,
+            "burst": self.burst,
+            "control_reserve": self.reserve,
+            "tokens": tokens,
+            "blocked_for": max(blocked_until - now, 0.0),
+        }
+
+
+class FeedCache:
+    """Read-through cache of feed reads, with a TTL per feed and single-flight fetches.
+
+    A read within the feed's TTL of the last fetch returns its value ("hit"). Otherwise one caller
+    fetches ("miss") while concurrent callers of the same feed wait for its result ("shared"),
+    so a burst of reads costs one request. Errors are passed to every waiting caller, never cached;
+    a caller waits at most wait_timeout seconds (None: no limit) for another's fetch, then raises
+    TimeoutError, so a hung fetch can't hold every reader of its feed.
+    invalidate() drops the cached value and detaches fetches already in flight: reads after it
+    start a new fetch, and an older fetch that completes later does not store its value.
+    on_event(event, feed) is called for each read.
+    """
+
+    def __init__(self, ttls, default_ttl, clock=time.monotonic, wait_timeout=None):
+        self.ttls = ttls
+        self.default_ttl = default_ttl
+        self.wait_timeout = wait_timeout
+        self.clock = clock
+        self.on_event = None
+        self._lock = threading.Lock()
+        self._values = {}          # feed -> (expiry, value)
+        self._in_flight = {}       # feed -> Future, for threads
+        self._in_flight_async = {}  # feed -> asyncio task, for the event loop
+        self._generations = {}     # feed -> count of invalidations, to spot fetches they overtook
+
+    def _event(self, event, feed):
+        if self.on_event is not None:
+            self.on_event(event, feed)
+
+    def _cached(self, feed):
+        cached = self._values.get(feed)
+        if cached is not None and cached[0] > self.clock():
+            return cached
+        return None
+
+    def _store(self, feed, value, generation):
+        ttl = self.ttls.get(feed, self.default_ttl)
+        if ttl > 0 and self._generations.get(feed, 0) == generation:
+            self._values[feed] = (self.clock() + ttl, value)
+
+    def get(self, feed, fetch):
+        with self._lock:
+            cached = self._cached(feed)
+            future = None if cached is not None else self._in_flight.get(feed)
+            leader = cached is None and future is None
+            if leader:
+                future = self._in_flight[feed] = Future()
+                generation = self._generations.get(feed, 0)
+        if cached is not None:
+            self._event("hit", feed)
+            return cached[1]
+        if not leader:
+            self._event("shared", feed)
+            try:
+                return future.result(self.wait_timeout)
+            except FutureTimeoutError:
+                raise TimeoutError(f"Read of feed {feed} timed out waiting for the shared fetch") from None
+
+        self._event("miss", feed)
+        try:
+            value = fetch()
+        except BaseException as e:
+            with self._lock:
+                self._finish(self._in_flight, feed, future)
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._store(feed, value, generation)
+            self._finish(self._in_flight, feed, future)
+        future.set_result(value)
+        return value
+
+    @staticmethod
+    def _finish(in_flight, feed, fetch):
+        # invalidate() may have detached this fetch, and a newer one taken its place
+        if in_flight.get(feed) is fetch:
+            del in_flight[feed]
+
+    async def get_async(self, feed, fetch):
+        """get() for coroutines: fetch() returns an awaitable, shared by the callers of one event loop."""
+        import asyncio
+        with self._lock:
+            cached = self._cached(feed)
+            generation = self._generations.get(feed, 0)
+        if cached is not None:
+            self._event("hit", feed)
+            return cached[1]
+
+        task = self._in_flight_async.get(feed)
+        if task is not None:
+            self._event("shared", feed)
+        else:
+            self._event("miss", feed)
+
+            async def fetch_and_store():
+                try:
+                    value = await fetch()
+                    with self._lock:
+                        self._store(feed, value, generation)
+                    return value
+                finally:
+                    with self._lock:
+                        self._finish(self._in_flight_async, feed, task)
+
+            task = self._in_flight_async[feed] = asyncio.ensure_future(fetch_and_store())
+        # A cancelled (or timed out) caller must not cancel the fetch the others are waiting for
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), self.wait_timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"Read of feed {feed} timed out waiting for the shared fetch") from None
+
+    def invalidate(self, feed=None):
+        with self._lock:
+            feeds = set(self._values) | set(self._in_flight) | set(self._in_flight_async) if feed is None else {feed}
+            for stale in feeds:
+                self._values.pop(stale, None)
+                self._in_flight.pop(stale, None)
+                self._in_flight_async.pop(stale, None)
+                self._generations[stale] = self._generations.get(stale, 0) + 1
+
+
+budget = TokenBucket(AIO_REQUESTS_PER_MINUTE, AIO_BURST, CONTROL_RESERVE)
+# A read is one request, whose connect and read phases may each take AIO_TIMEOUT
+feed_cache = FeedCache(FEED_TTLS, DEFAULT_FEED_TTL, wait_timeout=2 * AIO_TIMEOUT)
+
+# Last value read from each feed, (time, value), for merging telemetry reads when out of budget
+last_values = {}
+# Last data point read from each feed, (value, time it was published)
+last_points = {}
+
+
+def feed_url(feed, path):
+    return f"{AIO_BASE_URL}/{ADAFRUIT_AIO_USERNAME}/feeds/{feed}/{path}"
+
+
+def headers():
+    return {"X-AIO-Key": ADAFRUIT_AIO_KEY, "Content-Type": "application/json"}
+
+
+def check_throttled(response):
+    if response.status_code == 429:
+        retry_after = float(response.headers.get("Retry-After", 60))
+        budget.throttled(retry_after)
+        raise BudgetExceeded(f"Adafruit IO throttled this account for {retry_after:.0f} s")
+
+
+def merged_value(feed, error):
+    """The feed's last value, for a telemetry read that ran out of budget (re-raises if it is too old)."""
+    last = last_values.get(feed)
+    if last is None or time.time() - last[0] > MERGE_MAX_AGE:
+        raise error
+    budget._event("merged", TELEMETRY)
+    return last[1]
+
+
+def remember_point(feed, point):
+    """Keep the last data point read from a feed; returns its value."""
+    value = point['value']
+    last_values[feed] = (time.time(), value)
+    try:
+        last_points[feed] = (value, point_time(point))
+    except (KeyError, TypeError, ValueError):
+        last_points.pop(feed, None)
+    return value
+
+
+def published_time(feed, value):
+    """Unix seconds at which the last data point read from feed was published, if it holds value."""
+    last = last_points.get(feed)
+    if last is None or last[0] != value:
+        return None
+    return last[1]
+
+
+def recv_last(feed):
+    try:
+        budget.acquire(TELEMETRY)
+    except BudgetExceeded as e:
+        return merged_value(feed, e)
+    response = requests.get(feed_url(feed, "data/last"), headers=headers(), timeout=AIO_TIMEOUT)
+    check_throttled(response)
+    response.raise_for_status()
+    return remember_point(feed, response.json())
+
+
+def point_time(point):
+    """Unix seconds at which a feed data point was created."""
+    if point.get("created_epoch") is not None:
+        return float(point["created_epoch"])
+    return datetime.fromisoformat(point["created_at"].replace("Z", "+00:00")).timestamp()
+
+
+def recv_history(feed, start_time=None, limit=HISTORY_PAGE_SIZE, max_pages=None):
+    """Data points of a feed created at or after start_time (Unix seconds; None: any), oldest first.
+
+    Adafruit IO returns history newest first, limit points per page: each further page ends where
+    the previous one started, until a short page (or max_pages). Every page costs a telemetry token.
+    """
+    points = []
+    params = {"limit": limit}
+    if start_time is not None:
+        params["start_time"] = datetime.fromtimestamp(start_time, timezone.utc).isoformat()
+    while max_pages is None or max_pages > 0:
+        budget.acquire(TELEMETRY)
+        response = requests.get(feed_url(feed, "data"), params=params, headers=headers(), timeout=AIO_TIMEOUT)
+        check_throttled(response)
+        response.raise_for_status()
+        page = response.json()
+        points.extend(page)
+        if len(page) < limit:
+            break
+        params["end_time"] = page[-1]["created_at"]
+        max_pages = None if max_pages is None else max_pages - 1
+    return points[::-1]
+
+
+def invalidate_after_send(feed):
+    """Drop the cached values a publish to feed makes stale, so the next reads fetch again."""
+    for stale in (feed,) + REPLY_CHANNELS:
+        feed_cache.invalidate(stale)
 
 
 def sf_send(topic, msg):
-    cmd = f"https://io.adafruit.com/api/v2/{ADAFRUIT_AIO_USERNAME}/feeds/{IN_CHANNEL}/data"
-    requests.post(cmd, data=json.dumps({"value": str(msg)}), headers={"X-AIO-Key": ADAFRUIT_AIO_KEY, "Content-Type": "application/json"})
+    budget.acquire(CONTROL, CONTROL_MAX_WAIT)
+    response = requests.post(feed_url(IN_CHANNEL, "data"), data=json.dumps({"value": str(msg)}), headers=headers(), timeout=AIO_TIMEOUT)
+    check_throttled(response)
+    response.raise_for_status()
+    invalidate_after_send(IN_CHANNEL)
 
 
-def sf_recv_from_sfout(topic):
-    cmd = f"https://io.adafruit.com/api/v2/{ADAFRUIT_AIO_USERNAME}/feeds/{OUT_CHANNEL}/data/last"
-    return requests.get(cmd, headers={"X-AIO-Key": ADAFRUIT_AIO_KEY, "Content-Type": "application/json"}).json()['value']
+def sf_recv_from_sfout(topic=OUT_CHANNEL):
+    return feed_cache.get(topic, lambda: recv_last(topic))
 
 def sf_recv_from_wfout(topic):
-    cmd = f"https://io.adafruit.com/api/v2/{ADAFRUIT_AIO_USERNAME}/feeds/{WIFI_CHANNEL}/data/last"
-    return requests.get(cmd, headers={"X-AIO-Key": ADAFRUIT_AIO_KEY, "Content-Type": "application/json"}).json()['value']
+    return feed_cache.get(WIFI_CHANNEL, lambda: recv_last(WIFI_CHANNEL))
+
+def sf_recv_from_stout(topic=STATE_CHANNEL):
+    return feed_cache.get(topic, lambda: recv_last(topic))
+
+
+# Async variants for the ASGI server: they await the round trip instead of blocking a worker thread.
+# One pooled client per process keeps the connections to Adafruit IO open between calls.
+_async_client = None
+
+
+def get_async_client():
+    global _async_client
+    if _async_client is None:
+        import httpx  # Only needed by the ASGI server
+        _async_client = httpx.AsyncClient(timeout=AIO_TIMEOUT, limits=httpx.Limits(max_connections=100, max_keepalive_connections=20))
+    return _async_client
+
+
+async def close_async_client():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+
+async def recv_last_async(feed):
+    try:
+        await budget.acquire_async(TELEMETRY)
+    except BudgetExceeded as e:
+        return merged_value(feed, e)
+    response = await get_async_client().get(feed_url(feed, "data/last"), headers=headers())
+    check_throttled(response)
+    response.raise_for_status()
+    return remember_point(feed, response.json())
+
+
+async def sf_send_async(topic, msg):
+    await budget.acquire_async(CONTROL, CONTROL_MAX_WAIT)
+    response = await get_async_client().post(feed_url(IN_CHANNEL, "data"), content=json.dumps({"value": str(msg)}), headers=headers())
+    check_throttled(response)
+    response.raise_for_status()
+    invalidate_after_send(IN_CHANNEL)
+
+
+async def sf_recv_from_sfout_async(topic=OUT_CHANNEL):
+    return await feed_cache.get_async(topic, lambda: recv_last_async(topic))
+
+
+async def sf_recv_from_wfout_async(topic):
+    return await feed_cache.get_async(WIFI_CHANNEL, lambda: recv_last_async(WIFI_CHANNEL))
+
+
+async def sf_recv_from_stout_async(topic=STATE_CHANNEL):
+    return await feed_cache.get_async(topic, lambda: recv_last_async(topic))
 
-# control
-sf_send(IN_CHANNEL, "win_close")
+if __name__ == "__main__":
+    # control
+    sf_send(IN_CHANNEL, "win_close")
 
-# sensor
-# while True:
-#     print(sf_recv(OUT_CHANNEL))
-#     time.sleep(5)
\ No newline at end of file
+    # sensor
+    # while True:
+    #     print(sf_recv(OUT_CHANNEL))
+    #     time.sleep(5)
@@ -0,0 +1,84 @@
+"""Run the Smart Farm firmware (main.py and lib/pop) on a workstation, against simulated hardware.
+
+    import sim
+    board = sim.install()      # before importing pop, main.py or lib/mqtt
+    import pop
+    pop.Light(0x5C).read()
+
+install() registers stand-ins for the MicroPython-only modules (machine, network, _thread,
+usocket and the u* aliases of standard modules) and adds MicroPython's time.sleep_us / ticks_*
+helpers to the time module. The board models the I2C devices at register level with their real
+timing (see sim.devices), and an in-memory MQTT broker replaces io.adafruit.com (sim.mqtt).
+To run and profile main.py itself: python -m sim --help (from the Template directory).
+"""
+import binascii
+import json
+import os
+import struct
+import sys
+import time
+
+from sim.board import Board, Greenhouse, StopSimulation
+
+
+_board = None
+
+MODULE_ALIASES = {
+    "ubinascii": binascii,
+    "ustruct": struct,
+    "ujson": json,
+    "utime": time,
+    "uos": os,
+}
+
+
+def board():
+    """The installed Board."""
+    if _board is None:
+        raise RuntimeError("sim.install() has not been called")
+    return _board
+
+
+def _add_micropython_time():
+    def ticks_ms():
+        return int(time.monotonic() * 1000) & 0x3FFFFFFF
+
+    def ticks_us():
+        return int(time.monotonic() * 1000000) & 0x3FFFFFFF
+
+    def ticks_add(ticks, delta):
+        return (ticks + delta) & 0x3FFFFFFF
+
+    def ticks_diff(end, start):
+        return ((end - start + 0x20000000) & 0x3FFFFFFF) - 0x20000000
+
+    helpers = {
+        "sleep_ms": lambda ms: time.sleep(ms / 1000),
+        "sleep_us": lambda us: time.sleep(us / 1000000),
+        "ticks_ms": ticks_ms,
+        "ticks_us": ticks_us,
+        "ticks_add": ticks_add,
+        "ticks_diff": ticks_diff,
+    }
+    for name, helper in helpers.items():
+        if not hasattr(time, name):
+            setattr(time, name, helper)
+
+
+def install(board=None, **options):
+    """Make the simulated board the one the firmware runs on; returns it.
+
+    Takes a Board, or Board(**options) is made. Installing again swaps the board, but modules
+    that already ran their import-time probes (pop) keep what they found.
+    """
+    global _board
+    from sim import _thread, machine, network, usocket
+
+    _board = board if board is not None else Board(**options)
+    _add_micropython_time()
+    sys.modules.update(MODULE_ALIASES)
+    sys.modules.update({"machine": machine, "network": network, "_thread": _thread, "usocket": usocket})
+    return _board
+
+
+__all__ = ["Board", "Greenhouse", "StopSimulation", "board", "install"]
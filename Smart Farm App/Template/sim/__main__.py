@@ -0,0 +1,183 @@
+"""Run main.py against the simulated board and report where its loop spends its time.
+
+    cd Template
+    python -m sim --duration 60
+    python -m sim --duration 30 --command 12:fan_open --command 20:win_open --profile 25
+
+The firmware runs unchanged: /flash is a temporary directory (seeded with a wifi.json for the
+board's access point), MQTT goes to the in-memory broker, and the run ends at --duration with
+StopSimulation raised at the firmware's next I2C or socket call. The report lists the intervals
+between publishes per topic (for the main loop, its period), how long each --command took to be
+answered, and the I2C bus time per device; --profile adds the top functions of a cProfile run.
+"""
+import argparse
+import builtins
+import cProfile
+import io
+import json
+import os
+import pstats
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+import sim
+
+
+TEMPLATE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values, share):
+    ordered = sorted(values)
+    return ordered[min(int(share * len(ordered)), len(ordered) - 1)]
+
+
+def flash_open(flash_dir):
+    """open() for the firmware, with /flash/... mapped into flash_dir."""
+    def open(path, mode="r", *args, **kwargs):
+        if isinstance(path, str) and path.startswith("/flash/"):
+            path = os.path.join(flash_dir, path[len("/flash/"):])
+        return builtins.open(path, mode, *args, **kwargs)
+    return open
+
+
+def seed_flash(flash_dir, board):
+    ssid, password = next(iter(board.access_points.items()))
+    with builtins.open(os.path.join(flash_dir, "wifi.json"), "w") as file:
+        json.dump([{"wifi_name": ssid, "password": password, "activate": 1}], file)
+
+
+def schedule_commands(board, commands, started):
+    """Publish each (seconds, message) to the topics the device subscribed to; returns the send log."""
+    sent = []
+
+    def send(message):
+        sent.append((time.time(), message))
+        for topic in board.broker.subscriptions():
+            board.broker.publish(topic, message)
+
+    for seconds, message in commands:
+        timer = threading.Timer(max(started + seconds - time.time(), 0), send, [message])
+        timer.daemon = True
+        timer.start()
+    return sent
+
+
+def run_firmware(script, flash_dir, profiler):
+    """Exec the firmware; returns how the run ended."""
+    with builtins.open(script) as file:
+        code = compile(file.read(), script, "exec")
+    namespace = {"__name__": "__main__", "__file__": script, "open": flash_open(flash_dir)}
+    if profiler is not None:
+        profiler.enable()
+    try:
+        exec(code, namespace)
+        return "script returned"
+    except sim.StopSimulation:
+        return "machine.reset()" if sim.board().reset_requested else "deadline"
+    except KeyboardInterrupt:
+        return "interrupted"
+    except Exception:
+        traceback.print_exc()
+        return "error"
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        sim.board().deadline = None  # Let the drivers' __del__ still reach the hardware
+
+
+def report(board, started, ended, outcome, sent):
+    print("\nRan for {:.1f} s, ended by: {}".format(ended - started, outcome))
+
+    published = list(board.broker.published)
+    if published:
+        print("First publish {:.2f} s after start".format(published[0][0] - started))
+    by_topic = {}
+    for at, topic, _ in published:
+        by_topic.setdefault(topic, []).append(at)
+    print("\nPublishes          count   interval s: min    mean    p95     max")
+    for topic, times in sorted(by_topic.items()):
+        intervals = [b - a for a, b in zip(times, times[1:])]
+        if intervals:
+            print("  {:<18} {:>5}   {:>14.3f} {:>7.3f} {:>7.3f} {:>7.3f}".format(
+                topic[-18:], len(times), min(intervals), sum(intervals) / len(intervals),
+                percentile(intervals, 0.95), max(intervals)))
+        else:
+            print("  {:<18} {:>5}".format(topic[-18:], len(times)))
+
+    if sent:
+        print("\nCommands (answered = first publish mentioning the command)")
+        for at, message in sent:
+            answer = next((t for t, _, payload in published if t >= at and message.encode() in payload), None)
+            answered = "{:.3f} s".format(answer - at) if answer is not None else "not answered"
+            print("  {:>7.2f} s  {:<14} {}".format(at - started, message, answered))
+
+    print("\nI2C device          transactions   bytes   bus time ms")
+    for bus in sorted(board.buses):
+        for address, device in sorted(board.buses[bus].items()):
+            stats = board.stats.get(address, {"transactions": 0, "bytes": 0, "bus_time": 0.0})
+            print("  {:#04x} {:<14} {:>12} {:>7} {:>13.1f}".format(
+                address, type(device).__name__, stats["transactions"], stats["bytes"], stats["bus_time"] * 1000))
+
+    lcd = board.buses[0][0x27]
+    print("\nLCD{}:".format(" ({} latches while busy)".format(lcd.busy_violations) if lcd.busy_violations else ""))
+    for line in board.lcd_lines():
+        print("  |{}|".format(line))
+    print("Fan {}, window {}, LED bar {}".format(
+        "on" if board.greenhouse.fan_on else "off", board.window_angle(), board.rgb()))
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m sim", description="Run the firmware against the simulated Smart Farm board.")
+    parser.add_argument("script", nargs="?", default=os.path.join(TEMPLATE_DIR, "main.py"))
+    parser.add_argument("--duration", type=float, default=60.0, help="Seconds to run (default 60)")
+    parser.add_argument("--time-scale", type=float, default=1.0,
+                        help="Factor on simulated hardware latency; 0 makes devices and network instant")
+    parser.add_argument("--co2", choices=["scd4x", "module"], default="scd4x", help="CO2 sensor fitted (SCD4x at 0x62 or the module at 0x31)")
+    parser.add_argument("--rtt", type=float, default=0.08, help="Network round trip to the broker, seconds")
+    parser.add_argument("--wifi-delay", type=float, default=1.5, help="Seconds for the WLAN to associate")
+    parser.add_argument("--seed", type=int, help="Random seed for the greenhouse")
+    parser.add_argument("--command", action="append", default=[], metavar="SECONDS:MESSAGE",
+                        help="Send MESSAGE to the device's subscribed topics at SECONDS, e.g. 12:fan_open (repeatable)")
+    parser.add_argument("--profile", type=int, metavar="N", help="Profile the firmware's main thread and print the top N functions")
+    parser.add_argument("--profile-out", help="Also write the cProfile stats to this file")
+    args = parser.parse_args()
+
+    commands = []
+    for command in args.command:
+        seconds, message = command.split(":", 1)
+        commands.append((float(seconds), message))
+
+    board = sim.install(time_scale=args.time_scale, co2_sensor=args.co2, network_rtt=args.rtt,
+                        wifi_delay=args.wifi_delay, seed=args.seed)
+    script = os.path.abspath(args.script)
+    sys.path[:0] = [os.path.join(os.path.dirname(script), "lib"), os.path.dirname(script)]
+    flash_dir = tempfile.mkdtemp(prefix="sim-flash-")
+    seed_flash(flash_dir, board)
+    profiler = cProfile.Profile() if args.profile or args.profile_out else None
+
+    started = time.time()
+    board.deadline = started + args.duration
+    sent = schedule_commands(board, commands, started)
+    try:
+        outcome = run_firmware(script, flash_dir, profiler)
+        ended = time.time()
+        report(board, started, ended, outcome, sent)
+    finally:
+        shutil.rmtree(flash_dir, ignore_errors=True)
+
+    if profiler is not None:
+        if args.profile_out:
+            profiler.dump_stats(args.profile_out)
+        if args.profile:
+            output = io.StringIO()
+            pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(args.profile)
+            print("\n" + output.getvalue())
+    return 1 if outcome == "error" else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,49 @@
+"""Host stand-in for MicroPython's `_thread`: daemon threads, so a simulation can end while drivers still poll.
+
+Unlike CPython's _thread, start_new_thread takes a list as well as a tuple of arguments, and an
+exception ends only its own thread after being printed, as on the device.
+"""
+import _thread as host_thread
+import sys
+import threading
+import traceback
+
+from sim.board import StopSimulation
+
+LockType = type(threading.Lock())
+
+
+def start_new_thread(function, args, kwargs=None):
+    def run():
+        try:
+            function(*args, **(kwargs or {}))
+        except (SystemExit, StopSimulation):
+            pass
+        except BaseException:
+            print("Unhandled exception in thread started by {!r}".format(function), file=sys.stderr)
+            traceback.print_exc()
+
+    thread = threading.Thread(target=run, name=getattr(function, "__qualname__", "thread"), daemon=True)
+    thread.start()
+    return thread.ident
+
+
+def allocate_lock():
+    return threading.Lock()
+
+
+def get_ident():
+    return threading.get_ident()
+
+
+def stack_size(size=None):
+    return 0
+
+
+def exit():
+    raise SystemExit
+
+
+def __getattr__(name):
+    # Whatever else the standard library imports from _thread once this module replaced it
+    return getattr(host_thread, name)
@@ -0,0 +1,187 @@
+"""The simulated board: I2C buses with their devices, GPIO pins, ADC inputs, Wi-Fi and the greenhouse.
+
+Device models sleep for the time the real hardware takes (bus transfers, conversions), scaled by
+time_scale: 1.0 is real time, 0 makes the hardware instant. Sleeps in the drivers themselves
+(pop's own time.sleep calls) are not scaled.
+"""
+import errno
+import math
+import random
+import threading
+import time
+
+
+class StopSimulation(BaseException):
+    """Raised into the firmware to end a simulation run (a BaseException, so `except Exception` won't catch it)."""
+
+
+class Greenhouse:
+    """Slowly drifting climate, pushed around by the actuators.
+
+    Values follow a daily-ish sine wave plus noise; the fan cools and dries, an open window
+    vents CO2 and humidity, and the LED bar adds light.
+    """
+
+    def __init__(self, temperature=27.0, humidity=62.0, pressure=1008.0, co2=650.0, lux=320.0, seed=None):
+        self.base = {"temperature": temperature, "humidity": humidity, "pressure": pressure, "co2": co2, "lux": lux}
+        self.fan_on = False
+        self.window_open = False
+        self.led_level = 0.0  # 0..1, mean duty of the LED bar
+        self._rng = random.Random(seed)
+        self._started = time.time()
+        self._lock = threading.Lock()
+
+    def read(self, name):
+        with self._lock:
+            phase = math.sin((time.time() - self._started) / 600.0 * 2 * math.pi)
+            noise = self._rng.gauss(0, 1)
+        value = self.base[name]
+        if name == "temperature":
+            value += 1.5 * phase + 0.05 * noise - (1.5 if self.fan_on else 0.0)
+        elif name == "humidity":
+            value += -4 * phase + 0.3 * noise - (5.0 if self.fan_on else 0.0) - (8.0 if self.window_open else 0.0)
+        elif name == "pressure":
+            value += 0.02 * noise
+        elif name == "co2":
+            value += 40 * phase + 5 * noise - (200.0 if self.window_open else 0.0)
+        elif name == "lux":
+            value += 80 * phase + 3 * noise + 900.0 * self.led_level
+        return max(value, 0.0)
+
+
+class SimPin:
+    def __init__(self, board, pin_id):
+        self.board = board
+        self.id = pin_id
+        self.value = 0
+        self.mode = None
+        self.callbacks = []  # (trigger, handler, arg, pin object)
+
+    def set(self, value):
+        """Drive the level from outside (an input changing); fires the edge callbacks."""
+        value = 1 if value else 0
+        previous, self.value = self.value, value
+        for trigger, handler, arg, pin in list(self.callbacks):
+            rising = previous == 0 and value == 1
+            falling = previous == 1 and value == 0
+            if (trigger & self.board.IRQ_RISING and rising) or (trigger & self.board.IRQ_FALLING and falling) \
+                    or (trigger & self.board.IRQ_HIGH_LEVEL and value) or (trigger & self.board.IRQ_LOW_LEVEL and not value):
+                handler(arg if arg is not None else pin)
+
+
+class Board:
+    """Everything the fake machine/network modules talk to; see sim.install()."""
+
+    IRQ_FALLING = 1
+    IRQ_RISING = 2
+    IRQ_LOW_LEVEL = 4
+    IRQ_HIGH_LEVEL = 8
+
+    # Wiring of the Smart Farm kit
+    FAN_PIN = "P3"
+    WINDOW_POWER_PIN = "P21"
+
+    def __init__(self, time_scale=1.0, i2c_baudrate=100000, co2_sensor="scd4x", greenhouse=None,
+                 unique_id=b"\x24\x0a\xc4\x00\x51\x2e", access_points=None, wifi_delay=1.5, network_rtt=0.08, seed=None):
+        from sim import devices
+        from sim.mqtt import MQTTBroker
+
+        self.time_scale = time_scale
+        self.i2c_baudrate = i2c_baudrate
+        self.greenhouse = greenhouse or Greenhouse(seed=seed)
+        self.unique_id = unique_id
+        self.access_points = {"SmartFarm": "smartfarm123"} if access_points is None else access_points
+        self.wifi_delay = wifi_delay
+        self.network_rtt = network_rtt
+        self.wifi_ssid = None  # Set once the WLAN is associated
+        self.broker = MQTTBroker(self)
+        self.pins = {}
+        self.adc_values = {"P15": 2300}  # Soil moisture, raw 12-bit
+        self.deadline = None  # time.time() after which the firmware gets StopSimulation
+        self.reset_requested = False
+        self.stats = {}  # I2C address -> {"transactions", "bytes", "bus_time"}
+        self._bus_lock = threading.Lock()
+
+        # Bus 0: the kit's sensors and actuators; bus 1: the (absent) option board with the ADS7828 at 0x4B
+        co2 = devices.SCD4x(self) if co2_sensor == "scd4x" else devices.CO2Module(self)
+        self.buses = {
+            0: {device.address: device for device in (
+                devices.BH1750(self, 0x5C),
+                devices.BME680(self, 0x76),
+                co2,
+                devices.PCA9685(self, 0x5E),
+                devices.PCA9685(self, 0x40),
+                devices.LcdBackpack(self, 0x27),
+            )},
+            1: {},
+        }
+
+    # Time
+
+    def sleep(self, seconds):
+        """Hardware latency, scaled by time_scale."""
+        if seconds > 0 and self.time_scale > 0:
+            time.sleep(seconds * self.time_scale)
+
+    def check_deadline(self):
+        if self.deadline is not None and time.time() >= self.deadline:
+            raise StopSimulation()
+
+    # GPIO and ADC
+
+    def pin(self, pin_id):
+        if pin_id not in self.pins:
+            self.pins[pin_id] = SimPin(self, pin_id)
+        return self.pins[pin_id]
+
+    def pin_written(self, pin):
+        """Couple the actuator pins to the greenhouse."""
+        if pin.id == self.FAN_PIN:
+            self.greenhouse.fan_on = bool(pin.value)
+
+    def pwm_written(self, pwm):
+        if pwm.address == 0x40:
+            # The servo holds its position when its power (P21) is switched off
+            angle = self.window_angle()
+            if angle is not None:
+                self.greenhouse.window_open = angle > 10
+        elif pwm.address == 0x5E:
+            self.greenhouse.led_level = sum(self.rgb()) / (3 * 255)
+
+    def adc_read(self, pin_id):
+        value = self.adc_values.get(pin_id, 0)
+        return int(value() if callable(value) else value)
+
+    # I2C
+
+    def device(self, bus, address):
+        device = self.buses.get(bus, {}).get(address)
+        if device is None:
+            self.sleep(9 / self.i2c_baudrate)  # The address byte goes out, nobody acknowledges
+            raise OSError(errno.EIO, "I2C bus error")
+        return device
+
+    def transfer(self, address, nbytes):
+        """Account for (and wait out) one bus transaction of nbytes after the address byte."""
+        bus_time = (nbytes + 1) * 9 / self.i2c_baudrate
+        with self._bus_lock:
+            stats = self.stats.setdefault(address, {"transactions": 0, "bytes": 0, "bus_time": 0.0})
+            stats["transactions"] += 1
+            stats["bytes"] += nbytes
+            stats["bus_time"] += bus_time
+        self.sleep(bus_time)
+
+    # Views of the actuators, for tests and the runner's report
+
+    def window_angle(self):
+        """Servo angle of the window, from the pulse the PCA9685 at 0x40 sends on channel 0 (pop.Window's mapping)."""
+        counts = self.buses[0][0x40].off_counts(0)
+        return None if counts is None else round((497 - counts) / 2.38, 1)
+
+    def rgb(self):
+        """(r, g, b) 0-255 of the LED bar on the PCA9685 at 0x5E (channels 2, 1, 0)."""
+        pwm = self.buses[0][0x5E]
+        return tuple(round(pwm.duty(channel) * 255) for channel in (2, 1, 0))
+
+    def lcd_lines(self):
+        return self.buses[0][0x27].lines()
@@ -0,0 +1,594 @@
+"""Register-level models of the I2C devices on the Smart Farm kit.
+
+Each model answers the bytes a driver writes and reads (sim.machine.I2C does the bus timing) and
+keeps the device's own timing: conversions finish some milliseconds after they are started, and
+reading early returns what the real part would (stale data, a cleared "new data" flag or a NACK).
+Measured values come from the board's Greenhouse.
+"""
+import errno
+import struct
+import time
+
+
+class I2CDevice:
+    """A device behind one address: raw writes and reads, the first written byte picking a register."""
+
+    def __init__(self, board, address):
+        self.board = board
+        self.address = address
+        self.pointer = 0
+
+    def now(self):
+        return time.time()
+
+    def later(self, seconds):
+        """time.time() when a device operation taking `seconds` (scaled) is done."""
+        return self.now() + seconds * self.board.time_scale
+
+    def nack(self):
+        raise OSError(errno.EIO, "I2C bus error")
+
+    def write(self, data):
+        if not data:
+            return
+        self.pointer = data[0]
+        for offset, value in enumerate(data[1:]):
+            self.write_register((self.pointer + offset) & 0xFF, value)
+
+    def read(self, nbytes):
+        return bytes(self.read_register((self.pointer + offset) & 0xFF) for offset in range(nbytes))
+
+    def write_register(self, register, value):
+        pass
+
+    def read_register(self, register):
+        return 0
+
+
+class RegisterFile(I2CDevice):
+    def __init__(self, board, address):
+        super().__init__(board, address)
+        self.registers = bytearray(256)
+
+    def write_register(self, register, value):
+        self.registers[register] = value
+
+    def read_register(self, register):
+        return self.registers[register]
+
+
+##################################################################
+class BH1750(I2CDevice):
+    """Ambient light sensor (0x5C with ADDR high): opcodes, no registers; one- and continuous-shot modes."""
+
+    POWER_DOWN = 0x00
+    POWER_ON = 0x01
+    RESET = 0x07
+    # opcode -> (counts per lux, conversion time max)
+    MODES = {
+        0x10: (1.2, 0.180), 0x11: (2.4, 0.180), 0x13: (1.2 / 4, 0.024),
+        0x20: (1.2, 0.180), 0x21: (2.4, 0.180), 0x23: (1.2 / 4, 0.024),
+    }
+    TYPICAL_CONVERSION = {0.180: 0.120, 0.024: 0.016}
+
+    def __init__(self, board, address=0x5C):
+        super().__init__(board, address)
+        self.powered = False
+        self.mode = None
+        self.started = None
+        self.ready_at = 0.0
+        self.count = 0
+
+    def write(self, data):
+        for opcode in data:
+            if opcode == self.POWER_DOWN:
+                self.powered = False
+            elif opcode == self.POWER_ON:
+                self.powered = True
+            elif opcode == self.RESET:
+                if self.powered:  # Reset only works while powered on
+                    self.count = 0
+            elif opcode in self.MODES:
+                self.powered = True
+                self.mode = opcode
+                self.started = self.now()
+                self.ready_at = self.later(self.TYPICAL_CONVERSION[self.MODES[opcode][1]])
+
+    def _update(self):
+        # A finished conversion updates the data register; one-time modes then power down
+        if self.mode is None or self.now() < self.ready_at:
+            return
+        counts_per_lux, _ = self.MODES[self.mode]
+        self.count = min(int(self.board.greenhouse.read("lux") * counts_per_lux), 0xFFFF)
+        if self.mode & 0x20:
+            self.mode = None
+            self.powered = False
+        else:
+            self.ready_at = self.later(self.TYPICAL_CONVERSION[self.MODES[self.mode][1]])
+
+    def read(self, nbytes):
+        self._update()
+        return bytes([self.count >> 8, self.count & 0xFF] * ((nbytes + 1) // 2))[:nbytes]
+
+
+##################################################################
+class BME680(RegisterFile):
+    """Gas, pressure, temperature and humidity sensor (0x76), in forced mode as pop.Tphg uses it.
+
+    The calibration words are those of a typical part; measured values are turned into raw ADC counts
+    by inverting pop's own compensation formulas, so the driver reads back what the greenhouse has.
+    """
+
+    CHIP_ID = 0x61
+    # struct fields pop.Tphg unpacks from registers 0x8A-0xA1 + 0xE1-0xEE
+    CALIBRATION_FORMAT = "<hbBHhbBhhbbHhhBBBHbbbBbHhbb"
+    CALIBRATION = (
+        26203,  # 0 par_t2
+        3,  # 1 par_t3
+        0,  # 2
+        37026,  # 3 par_p1
+        -10396,  # 4 par_p2
+        88,  # 5 par_p3
+        0,  # 6
+        6941,  # 7 par_p4
+        -62,  # 8 par_p5
+        34,  # 9 par_p7
+        30,  # 10 par_p6
+        0,  # 11
+        -2423,  # 12 par_p8
+        -2833,  # 13 par_p9
+        30,  # 14 par_p10
+        0,  # 15
+        63,  # 16 par_h2 (msb)
+        12006,  # 17 par_h1 << 4 | par_h2 lsb nibble
+        0,  # 18 par_h3
+        45,  # 19 par_h4
+        20,  # 20 par_h5
+        120,  # 21 par_h6
+        -100,  # 22 par_h7
+        26036,  # 23 par_t1
+        -8700,  # 24 par_gh2
+        -54,  # 25 par_gh1
+        18,  # 26 par_gh3
+    )
+    OVERSAMPLING = (0, 1, 2, 4, 8, 16, 16, 16)
+    GAS_RANGE = 4
+    GAS_ADC = 512
+
+    def __init__(self, board, address=0x76):
+        super().__init__(board, address)
+        self.ready_at = None
+        self._calibrate()
+        self.reset()
+
+    def _calibrate(self):
+        fields = struct.pack(self.CALIBRATION_FORMAT, *self.CALIBRATION)
+        # pop reads 25 bytes from 0x89 and 16 from 0xE1, and unpacks bytes 1-38 of the two
+        self.calibration_bytes = bytearray(41)
+        self.calibration_bytes[1:39] = fields
+        c = [float(value) for value in self.CALIBRATION]
+        self.t_cal = [c[23], c[0], c[1]]
+        self.p_cal = [c[x] for x in (3, 4, 5, 7, 8, 10, 9, 12, 13, 14)]
+        self.h_cal = [c[x] for x in (17, 16, 18, 19, 20, 21, 22)]
+        self.h_cal[0] /= 16
+        self.h_cal[1] *= 16
+        self.h_cal[1] += self.h_cal[0] % 16
+
+    def reset(self):
+        self.registers = bytearray(256)
+        for offset, value in enumerate(self.calibration_bytes):
+            self.registers[0x89 + offset if offset < 25 else 0xE1 + offset - 25] = value
+        self.registers[0xD0] = self.CHIP_ID
+        self.registers[0x04] = 0x10  # range_switching_error
+        self.ready_at = None
+
+    # pop.Tphg's compensation, forwards
+
+    def t_fine(self, adc_temp):
+        var1 = (adc_temp / 8) - (self.t_cal[0] * 2)
+        var2 = (var1 * self.t_cal[1]) / 2048
+        var3 = ((var1 / 2) * (var1 / 2)) / 4096
+        var3 = (var3 * self.t_cal[2] * 16) / 16384
+        return int(var2 + var3)
+
+    def temperature(self, t_fine):
+        return ((t_fine * 5) + 128) / 256 / 100
+
+    def pressure(self, t_fine, adc_pres):
+        p = self.p_cal
+        var1 = (t_fine / 2) - 64000
+        var2 = ((var1 / 4) * (var1 / 4)) / 2048
+        var2 = (var2 * p[5]) / 4
+        var2 = var2 + (var1 * p[4] * 2)
+        var2 = (var2 / 4) + (p[3] * 65536)
+        var1 = ((((var1 / 4) * (var1 / 4)) / 8192) * (p[2] * 32) / 8) + ((p[1] * var1) / 2)
+        var1 = var1 / 262144
+        var1 = ((32768 + var1) * p[0]) / 32768
+        calc_pres = 1048576 - adc_pres
+        calc_pres = (calc_pres - (var2 / 4096)) * 3125
+        calc_pres = (calc_pres / var1) * 2
+        var1 = (p[8] * (((calc_pres / 8) * (calc_pres / 8)) / 8192)) / 4096
+        var2 = ((calc_pres / 4) * p[7]) / 8192
+        var3 = (((calc_pres / 256) ** 3) * p[9]) / 131072
+        calc_pres += (var1 + var2 + var3 + (p[6] * 128)) / 16
+        return calc_pres / 100
+
+    def humidity(self, t_fine, adc_hum):
+        h = self.h_cal
+        temp_scaled = ((t_fine * 5) + 128) / 256
+        var1 = (adc_hum - (h[0] * 16)) - ((temp_scaled * h[2]) / 200)
+        var2 = (h[1] * (((temp_scaled * h[3]) / 100) +
+                (((temp_scaled * ((temp_scaled * h[4]) / 100)) / 64) / 100) + 16384)) / 1024
+        var3 = var1 * var2
+        var4 = h[5] * 128
+        var4 = (var4 + ((temp_scaled * h[6]) / 100)) / 16
+        var5 = ((var3 / 16384) * (var3 / 16384)) / 1024
+        var6 = (var4 * var5) / 2
+        return (((var3 + var6) / 1024) * 1000) / 4096 / 1000
+
+    # ... and backwards
+
+    @staticmethod
+    def solve(fn, target, low, high):
+        """Smallest integer in [low, high] where the increasing fn reaches target."""
+        while low < high:
+            middle = (low + high) // 2
+            if fn(middle) < target:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def raw_sample(self):
+        greenhouse = self.board.greenhouse
+        adc_temp = self.solve(lambda adc: self.temperature(self.t_fine(adc)), greenhouse.read("temperature"), 0, 0xFFFFF)
+        t_fine = self.t_fine(adc_temp)
+        # Pressure falls as its ADC count rises
+        adc_pres = self.solve(lambda adc: -self.pressure(t_fine, adc), -greenhouse.read("pressure"), 0, 0xFFFFF)
+        adc_hum = self.solve(lambda adc: self.humidity(t_fine, adc), min(greenhouse.read("humidity"), 100.0), 0, 0xFFFF)
+        return adc_temp, adc_pres, adc_hum
+
+    def measurement_time(self):
+        """Seconds for one forced-mode cycle, as Bosch's API computes it, plus the gas heater's wait."""
+        ctrl_meas, ctrl_hum = self.registers[0x74], self.registers[0x72]
+        cycles = sum(self.OVERSAMPLING[code] for code in (ctrl_meas >> 5, (ctrl_meas >> 2) & 0x07, ctrl_hum & 0x07))
+        microseconds = cycles * 1963 + 477 * 4 + 477 * 5 + 1000
+        seconds = microseconds / 1e6
+        if self.registers[0x71] & 0x10:  # run_gas
+            gas_wait = self.registers[0x64]
+            seconds += (gas_wait & 0x3F) * (1, 4, 16, 64)[gas_wait >> 6] / 1000
+        return seconds
+
+    def write_register(self, register, value):
+        if register == 0xE0:
+            if value == 0xB6:
+                self.reset()
+            return
+        if register in (0x1D, 0xD0) or 0x1F <= register <= 0x2B:
+            return  # Read only
+        self.registers[register] = value
+        if register == 0x74 and value & 0x03 == 0x01:
+            self.registers[0x1D] = 0x20  # measuring, new_data cleared
+            self.ready_at = self.later(self.measurement_time())
+
+    def _update(self):
+        if self.ready_at is None or self.now() < self.ready_at:
+            return
+        self.ready_at = None
+        adc_temp, adc_pres, adc_hum = self.raw_sample()
+        for register, adc in ((0x1F, adc_pres), (0x22, adc_temp)):
+            self.registers[register:register + 3] = bytes([adc >> 12, (adc >> 4) & 0xFF, (adc & 0x0F) << 4])
+        self.registers[0x25:0x27] = struct.pack(">H", adc_hum)
+        gas_valid = 0x20 if self.registers[0x71] & 0x10 else 0
+        self.registers[0x2A] = self.GAS_ADC >> 2
+        self.registers[0x2B] = (self.GAS_ADC & 0x03) << 6 | gas_valid | 0x10 | self.GAS_RANGE
+        self.registers[0x1D] = 0x80  # new_data
+        self.registers[0x74] &= 0xFC  # Back to sleep mode
+
+    def read_register(self, register):
+        if register == 0x1D:
+            self._update()
+        return self.registers[register]
+
+
+##################################################################
+def sensirion_crc(data):
+    crc = 0xFF
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x31) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    return crc
+
+
+class SCD4x(I2CDevice):
+    """Sensirion SCD40/41 CO2 sensor (0x62): 16-bit commands, CRC-protected words, a 5 s measurement period."""
+
+    START_PERIODIC = 0x21B1
+    STOP_PERIODIC = 0x3F86
+    READ_MEASUREMENT = 0xEC05
+    DATA_READY = 0xE4B8
+    SERIAL_NUMBER = 0x3682
+    MEASURE_SINGLE_SHOT = 0x219D
+    REINIT = 0x3646
+    # command -> execution time; the sensor NACKs further commands until it is done
+    EXECUTION_TIME = {
+        START_PERIODIC: 0.0, STOP_PERIODIC: 0.5, READ_MEASUREMENT: 0.001, DATA_READY: 0.001,
+        SERIAL_NUMBER: 0.001, MEASURE_SINGLE_SHOT: 5.0, REINIT: 0.02,
+    }
+    ALLOWED_WHILE_MEASURING = (STOP_PERIODIC, READ_MEASUREMENT, DATA_READY)
+    PERIOD = 5.0
+    SERIAL = (0x9B4C, 0x7F07, 0x3B21)
+
+    def __init__(self, board, address=0x62):
+        super().__init__(board, address)
+        self.busy_until = 0.0
+        self.periodic_since = None
+        self.single_shot_at = None
+        self.last_read_sample = 0
+        self.response = b""
+
+    def _check_ready(self):
+        if self.now() < self.busy_until:
+            self.nack()
+
+    def _samples(self):
+        """Number of measurements completed since periodic measurement started."""
+        if self.periodic_since is None:
+            return 0
+        return int((self.now() - self.periodic_since) / (self.PERIOD * self.board.time_scale or 1e-9))
+
+    def _words(self, words):
+        response = bytearray()
+        for word in words:
+            pair = bytes([word >> 8, word & 0xFF])
+            response += pair + bytes([sensirion_crc(pair)])
+        return bytes(response)
+
+    def _measurement(self):
+        greenhouse = self.board.greenhouse
+        co2 = int(greenhouse.read("co2"))
+        temperature = int((greenhouse.read("temperature") + 45) * 65535 / 175)
+        humidity = int(min(greenhouse.read("humidity"), 100.0) * 65535 / 100)
+        return self._words([co2, temperature, humidity])
+
+    def _data_ready(self):
+        if self.single_shot_at is not None:
+            return self.now() >= self.single_shot_at
+        return self._samples() > self.last_read_sample
+
+    def write(self, data):
+        self._check_ready()
+        if len(data) < 2:
+            self.nack()
+        command = data[0] << 8 | data[1]
+        if command not in self.EXECUTION_TIME:
+            self.nack()
+        if self.periodic_since is not None and command not in self.ALLOWED_WHILE_MEASURING:
+            self.nack()
+        self.response = b""
+        if command == self.START_PERIODIC:
+            self.periodic_since = self.now()
+            self.last_read_sample = 0
+        elif command == self.STOP_PERIODIC:
+            self.periodic_since = None
+        elif command == self.MEASURE_SINGLE_SHOT:
+            self.single_shot_at = self.later(self.EXECUTION_TIME[command])
+        elif command == self.SERIAL_NUMBER:
+            self.response = self._words(self.SERIAL)
+        elif command == self.DATA_READY:
+            self.response = self._words([0x8006 if self._data_ready() else 0x8000])
+        elif command == self.READ_MEASUREMENT:
+            # The buffer is emptied by reading it; with nothing new in it the read is NACKed
+            if self._data_ready():
+                self.response = self._measurement()
+                self.last_read_sample = self._samples()
+                self.single_shot_at = None
+        if command != self.MEASURE_SINGLE_SHOT:
+            self.busy_until = self.later(self.EXECUTION_TIME[command])
+
+    def read(self, nbytes):
+        # Reading a response early is not NACKed (the 1 ms execution times are within the bus overhead)
+        if not self.response:
+            self.nack()
+        response, self.response = self.response, b""
+        return (response + b"\xff" * nbytes)[:nbytes]
+
+
+class CO2Module(I2CDevice):
+    """The older CO2 module (0x31) pop falls back to: a 7-byte frame at 0x52 with the ppm in bytes 1-2."""
+
+    def __init__(self, board, address=0x31):
+        super().__init__(board, address)
+
+    def read(self, nbytes):
+        co2 = int(self.board.greenhouse.read("co2"))
+        frame = bytearray([0x52, co2 >> 8, co2 & 0xFF, 0, 0, 0, 0])
+        frame[6] = sum(frame[:6]) & 0xFF
+        return bytes((frame + b"\0" * nbytes)[:nbytes])
+
+
+##################################################################
+class PCA9685(RegisterFile):
+    """16-channel PWM controller (0x5E for the LED bar, 0x40 for the window servo)."""
+
+    MODE1 = 0x00
+    MODE2 = 0x01
+    LED0 = 0x06
+    ALL_LED = 0xFA
+    PRESCALE = 0xFE
+    SLEEP = 0x10
+    AI = 0x20
+    RESTART = 0x80
+    OSCILLATOR = 25000000
+
+    def __init__(self, board, address):
+        super().__init__(board, address)
+        self.registers[self.MODE1] = 0x11  # SLEEP | ALLCALL
+        self.registers[self.MODE2] = 0x04
+        self.registers[self.PRESCALE] = 0x1E
+        for channel in range(16):
+            self.registers[self.LED0 + 4 * channel + 3] = 0x10  # Full off
+
+    def write(self, data):
+        if not data:
+            return
+        self.pointer = data[0]
+        for value in data[1:]:
+            self.write_register(self.pointer, value)
+            if self.registers[self.MODE1] & self.AI:
+                self.pointer = (self.pointer + 1) & 0xFF
+        self.board.pwm_written(self)
+
+    def read(self, nbytes):
+        values = []
+        for _ in range(nbytes):
+            values.append(self.read_register(self.pointer))
+            if self.registers[self.MODE1] & self.AI:
+                self.pointer = (self.pointer + 1) & 0xFF
+        return bytes(values)
+
+    def write_register(self, register, value):
+        if register == self.PRESCALE:
+            if self.registers[self.MODE1] & self.SLEEP:  # Only writable while the oscillator is off
+                self.registers[register] = max(value, 3)
+        elif self.ALL_LED <= register < self.ALL_LED + 4:
+            for channel in range(16):
+                self.registers[self.LED0 + 4 * channel + register - self.ALL_LED] = value
+        elif register == self.MODE1:
+            self.registers[register] = value & ~self.RESTART & 0xFF
+        else:
+            self.registers[register] = value
+
+    def read_register(self, register):
+        if self.ALL_LED <= register < self.ALL_LED + 4:
+            return 0
+        return self.registers[register]
+
+    def frequency(self):
+        return self.OSCILLATOR / (4096 * (self.registers[self.PRESCALE] + 1))
+
+    def _counts(self, channel):
+        base = self.LED0 + 4 * channel
+        on = self.registers[base] | self.registers[base + 1] << 8
+        off = self.registers[base + 2] | self.registers[base + 3] << 8
+        return on, off
+
+    def duty(self, channel):
+        """Share of the period the output is high (0 while the oscillator sleeps)."""
+        if self.registers[self.MODE1] & self.SLEEP:
+            return 0.0
+        on, off = self._counts(channel)
+        if off & 0x1000:
+            return 0.0
+        if on & 0x1000:
+            return 1.0
+        return ((off & 0xFFF) - (on & 0xFFF)) % 4096 / 4096
+
+    def off_counts(self, channel):
+        """High time of the channel in counts, or None when it sends no pulse."""
+        duty = self.duty(channel)
+        return None if duty in (0.0, 1.0) else round(duty * 4096)
+
+
+##################################################################
+class LcdBackpack(I2CDevice):
+    """20x4 HD44780 LCD behind a PCF8574 (0x27): P0 RS, P2 EN, P3 backlight, P4-P7 data in 4-bit mode.
+
+    A nibble is latched on the falling edge of EN. The real controller ignores what arrives while it
+    is still busy with the previous instruction; here it is executed anyway and counted in
+    busy_violations, so a driver racing the display shows up without garbling the text.
+    """
+
+    RS = 0x01
+    EN = 0x04
+    BACKLIGHT = 0x08
+    WIDTH = 20
+    LINE_ADDRESSES = (0x00, 0x40, 0x14, 0x54)
+
+    def __init__(self, board, address=0x27):
+        super().__init__(board, address)
+        self.port = 0xFF
+        self.eight_bit = True
+        self.high_nibble = None
+        self.ddram = bytearray(b" " * 0x80)
+        self.address_counter = 0
+        self.increment = 1
+        self.display_on = False
+        self.writing_cgram = False
+        self.busy_until = 0.0
+        self.busy_violations = 0
+
+    def write(self, data):
+        for value in data:
+            if self.port & self.EN and not value & self.EN:
+                self._latch(self.port & 0xF0, bool(self.port & self.RS))
+            self.port = value
+
+    def read(self, nbytes):
+        return bytes([self.port] * nbytes)
+
+    def _latch(self, nibble, data):
+        if self.now() < self.busy_until:
+            self.busy_violations += 1
+        if self.eight_bit:
+            # Only D7-D4 are wired, so in 8-bit mode every latch is a whole instruction with D3-D0 low
+            self._execute(nibble, data)
+            return
+        if self.high_nibble is None:
+            self.high_nibble = nibble
+            return
+        byte, self.high_nibble = self.high_nibble | nibble >> 4, None
+        self._execute(byte, data)
+
+    def _execute(self, byte, data):
+        duration = 37e-6
+        if data:
+            if not self.writing_cgram:
+                self.ddram[self.address_counter] = byte
+                self._advance(self.increment)
+            duration = 41e-6
+        elif byte & 0x80:
+            self.address_counter = byte & 0x7F
+            self.writing_cgram = False
+        elif byte & 0x40:
+            self.writing_cgram = True
+        elif byte & 0x20:
+            self.eight_bit = bool(byte & 0x10)
+            self.high_nibble = None
+        elif byte & 0x10:
+            if not byte & 0x08:  # Cursor shift; display shift is not modelled
+                self._advance(1 if byte & 0x04 else -1)
+        elif byte & 0x08:
+            self.display_on = bool(byte & 0x04)
+        elif byte & 0x04:
+            self.increment = 1 if byte & 0x02 else -1
+        elif byte & 0x02:
+            self.address_counter = 0
+            duration = 1.52e-3
+        elif byte & 0x01:
+            self.ddram[:] = b" " * len(self.ddram)
+            self.address_counter = 0
+            self.increment = 1
+            duration = 1.52e-3
+        self.busy_until = self.later(duration)
+
+    def _advance(self, step):
+        # In 2-line mode DDRAM is 0x00-0x27 and 0x40-0x67, each wrapping into the other
+        address = self.address_counter + step
+        if address == 0x28:
+            address = 0x40
+        elif address == 0x68 or address < 0:
+            address = 0x00 if step > 0 else 0x67
+        elif address == 0x3F:
+            address = 0x27
+        self.address_counter = address
+
+    def lines(self):
+        """The four lines of text on the display (blank while it is off)."""
+        if not self.display_on:
+            return [" " * self.WIDTH] * 4
+        return [
+            self.ddram[start:start + self.WIDTH].decode("latin-1")
+            for start in self.LINE_ADDRESSES
+        ]
@@ -0,0 +1,176 @@
+"""Host stand-in for Pycom's `machine` module, backed by the board sim.install() set up."""
+import threading
+
+import sim
+from sim.board import StopSimulation
+
+
+def _board():
+    return sim.board()
+
+
+class Pin:
+    IN = 1
+    OUT = 2
+    OPEN_DRAIN = 3
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 1
+    IRQ_RISING = 2
+    IRQ_LOW_LEVEL = 4
+    IRQ_HIGH_LEVEL = 8
+
+    def __init__(self, id, mode=IN, pull=None, value=None, alt=-1):
+        self._sim = _board().pin(id)
+        self.init(mode, pull, value=value)
+
+    def init(self, mode=IN, pull=None, value=None, alt=-1):
+        self._sim.mode = mode
+        if pull == self.PULL_UP and mode == self.IN:
+            self._sim.value = 1
+        if value is not None:
+            self.value(value)
+
+    def id(self):
+        return self._sim.id
+
+    def value(self, value=None):
+        if value is None:
+            return self._sim.value
+        self._sim.value = 1 if value else 0
+        _board().pin_written(self._sim)
+
+    def __call__(self, value=None):
+        return self.value(value)
+
+    def toggle(self):
+        self.value(not self._sim.value)
+
+    def mode(self, mode=None):
+        if mode is None:
+            return self._sim.mode
+        self._sim.mode = mode
+
+    def callback(self, trigger, handler=None, arg=None):
+        self._sim.callbacks = [entry for entry in self._sim.callbacks if entry[3] is not self]
+        if handler is not None:
+            self._sim.callbacks.append((trigger, handler, arg, self))
+
+
+class ADCChannel:
+    def __init__(self, pin, attn):
+        self.pin = pin
+        self.attn = attn
+
+    def init(self):
+        pass
+
+    def deinit(self):
+        pass
+
+    def value(self):
+        return _board().adc_read(self.pin)
+
+    def __call__(self):
+        return self.value()
+
+    def voltage(self):
+        # Millivolts, for the 11 dB range
+        return int(self.value() * 3300 / 4095)
+
+
+class ADC:
+    ATTN_0DB = 0
+    ATTN_2_5DB = 1
+    ATTN_6DB = 2
+    ATTN_11DB = 3
+
+    def __init__(self, id=0, bits=12):
+        self.bits = bits
+
+    def channel(self, id=None, pin=None, attn=ATTN_0DB):
+        return ADCChannel(pin, attn)
+
+    def init(self, bits=12):
+        self.bits = bits
+
+    def deinit(self):
+        pass
+
+
+class I2C:
+    MASTER = 0
+
+    def __init__(self, bus=0, mode=MASTER, baudrate=100000, pins=None):
+        self.bus = bus
+        self.baudrate = baudrate
+
+    def init(self, mode=MASTER, baudrate=100000, pins=None):
+        self.baudrate = baudrate
+
+    def deinit(self):
+        pass
+
+    def _device(self, address):
+        board = _board()
+        if threading.current_thread() is threading.main_thread():
+            board.check_deadline()
+        return board, board.device(self.bus, address)
+
+    def scan(self):
+        board = _board()
+        found = []
+        for address in range(0x08, 0x78):
+            board.sleep(9 / board.i2c_baudrate)
+            if address in board.buses.get(self.bus, {}):
+                found.append(address)
+        return found
+
+    def readfrom(self, addr, nbytes):
+        board, device = self._device(addr)
+        board.transfer(addr, nbytes)
+        return device.read(nbytes)
+
+    def readfrom_into(self, addr, buf):
+        buf[:] = self.readfrom(addr, len(buf))
+
+    def writeto(self, addr, buf, stop=True):
+        board, device = self._device(addr)
+        board.transfer(addr, len(buf))
+        device.write(bytes(buf))
+        return len(buf)
+
+    def readfrom_mem(self, addr, memaddr, nbytes, addrsize=8):
+        # Register pointer write, repeated start, then the read
+        board, device = self._device(addr)
+        board.transfer(addr, addrsize // 8)
+        device.write(bytes([memaddr]))
+        board.transfer(addr, nbytes)
+        return device.read(nbytes)
+
+    def readfrom_mem_into(self, addr, memaddr, buf, addrsize=8):
+        buf[:] = self.readfrom_mem(addr, memaddr, len(buf), addrsize)
+
+    def writeto_mem(self, addr, memaddr, buf, addrsize=8):
+        board, device = self._device(addr)
+        board.transfer(addr, addrsize // 8 + len(buf))
+        device.write(bytes([memaddr]) + bytes(buf))
+        return len(buf)
+
+
+def unique_id():
+    return _board().unique_id
+
+
+def reset():
+    # The device reboots: the simulated firmware run ends here
+    _board().reset_requested = True
+    raise StopSimulation("machine.reset()")
+
+
+def idle():
+    pass
+
+
+def freq():
+    return 160000000
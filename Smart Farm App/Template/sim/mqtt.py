@@ -0,0 +1,174 @@
+"""In-memory MQTT 3.1.1 broker standing in for io.adafruit.com, reached through sim.usocket.
+
+The firmware's own client (lib/mqtt/mqtt.py) talks to it byte for byte. Packets take half the
+board's network round trip to arrive in either direction. The broker keeps every publish it
+receives, and publish() sends a message to the device the way the server does.
+"""
+import threading
+import time
+
+
+class Connection:
+    """The broker's side of one TCP connection: parses what the client writes, queues what it reads."""
+
+    def __init__(self, broker):
+        self.broker = broker
+        self.inbound = bytearray()  # Client -> broker, not parsed yet
+        self.outbound = []  # (deliver at, bytes) broker -> client
+        self.subscriptions = set()
+        self.client_id = None
+        self.closed = False
+        self.condition = threading.Condition()
+
+    # Client side
+
+    def client_write(self, data):
+        with self.condition:
+            self.inbound += data
+        self._parse()
+
+    def client_read(self, nbytes, blocking):
+        """Bytes that have arrived: all nbytes when blocking (fewer once closed), else what is there or None."""
+        data = bytearray()
+        with self.condition:
+            while True:
+                now = time.time()
+                while self.outbound and self.outbound[0][0] <= now and len(data) < nbytes:
+                    deliver_at, chunk = self.outbound.pop(0)
+                    take = nbytes - len(data)
+                    data += chunk[:take]
+                    if len(chunk) > take:
+                        self.outbound.insert(0, (deliver_at, chunk[take:]))
+                if len(data) == nbytes or self.closed:
+                    return bytes(data)
+                if not blocking:
+                    return bytes(data) if data else None
+                self.condition.wait(self.outbound[0][0] - now if self.outbound else None)
+
+    def client_close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.broker.disconnected(self)
+
+    # Broker side
+
+    def send(self, packet):
+        with self.condition:
+            self.outbound.append((time.time() + self.broker.one_way_delay(), bytes(packet)))
+            self.condition.notify_all()
+
+    def _parse(self):
+        while True:
+            with self.condition:
+                packet = self._take_packet()
+            if packet is None:
+                return
+            self._handle(*packet)
+
+    def _take_packet(self):
+        if len(self.inbound) < 2:
+            return None
+        length, multiplier, index = 0, 1, 1
+        while True:
+            if index >= len(self.inbound):
+                return None
+            byte = self.inbound[index]
+            length += (byte & 0x7F) * multiplier
+            multiplier *= 128
+            index += 1
+            if not byte & 0x80:
+                break
+        if len(self.inbound) < index + length:
+            return None
+        header, body = self.inbound[0], bytes(self.inbound[index:index + length])
+        del self.inbound[:index + length]
+        return header, body
+
+    @staticmethod
+    def _string(body, offset):
+        length = body[offset] << 8 | body[offset + 1]
+        return body[offset + 2:offset + 2 + length], offset + 2 + length
+
+    def _handle(self, header, body):
+        kind = header & 0xF0
+        if kind == 0x10:  # CONNECT
+            self.client_id = self._string(body, 10)[0].decode()
+            self.send(b"\x20\x02\x00\x00")
+        elif kind == 0x30:  # PUBLISH
+            qos = (header >> 1) & 0x03
+            topic, offset = self._string(body, 0)
+            if qos:
+                packet_id = body[offset:offset + 2]
+                offset += 2
+                self.send(b"\x40\x02" + packet_id)
+            self.broker.received(self, topic.decode(), body[offset:])
+        elif kind == 0x80:  # SUBSCRIBE
+            packet_id, offset, granted = body[:2], 2, bytearray()
+            while offset < len(body):
+                topic, offset = self._string(body, offset)
+                granted.append(min(body[offset], 1))
+                offset += 1
+                self.subscriptions.add(topic.decode())
+            self.send(bytes([0x90, 2 + len(granted)]) + packet_id + bytes(granted))
+        elif kind == 0xC0:  # PINGREQ
+            self.send(b"\xd0\x00")
+        elif kind == 0xE0:  # DISCONNECT
+            self.broker.disconnected(self)
+
+
+def publish_packet(topic, message):
+    topic, message = topic.encode(), message if isinstance(message, bytes) else message.encode()
+    remaining = 2 + len(topic) + len(message)
+    header = bytearray([0x30])
+    while True:
+        byte, remaining = remaining & 0x7F, remaining >> 7
+        header.append(byte | (0x80 if remaining else 0))
+        if not remaining:
+            break
+    return bytes(header) + bytes([len(topic) >> 8, len(topic) & 0xFF]) + topic + message
+
+
+class MQTTBroker:
+    def __init__(self, board):
+        self.board = board
+        self.connections = []
+        self.published = []  # (time, topic, payload bytes) of every message a client published
+        self.listeners = []  # fn(time, topic, payload), called for every message a client publishes
+        self.lock = threading.Lock()
+
+    def one_way_delay(self):
+        return self.board.network_rtt / 2 * self.board.time_scale
+
+    def open(self):
+        connection = Connection(self)
+        with self.lock:
+            self.connections.append(connection)
+        return connection
+
+    def disconnected(self, connection):
+        with self.lock:
+            if connection in self.connections:
+                self.connections.remove(connection)
+
+    def received(self, connection, topic, payload):
+        # The message reached the broker half a round trip after the client wrote it
+        received_at = time.time() + self.one_way_delay()
+        with self.lock:
+            self.published.append((received_at, topic, payload))
+            listeners = list(self.listeners)
+        for listener in listeners:
+            listener(received_at, topic, payload)
+        self.publish(topic, payload)
+
+    def publish(self, topic, message):
+        """Deliver a message to every connection subscribed to topic; returns how many there were."""
+        with self.lock:
+            connections = [c for c in self.connections if topic in c.subscriptions]
+        for connection in connections:
+            connection.send(publish_packet(topic, message))
+        return len(connections)
+
+    def subscriptions(self):
+        with self.lock:
+            return sorted({topic for connection in self.connections for topic in connection.subscriptions})
@@ -0,0 +1,63 @@
+"""Host stand-in for Pycom's `network` module: a station interface joining the board's access points."""
+import time
+
+import sim
+
+
+class WLAN:
+    STA = 1
+    AP = 2
+    STA_AP = 3
+    WEP = 1
+    WPA = 2
+    WPA2 = 3
+    INT_ANT = 0
+    EXT_ANT = 1
+
+    def __init__(self, id=0, mode=STA, **kwargs):
+        self._mode = mode
+        self._joining = None  # (ssid, time.time() when associated)
+
+    def mode(self, mode=None):
+        if mode is None:
+            return self._mode
+        self._mode = mode
+
+    def connect(self, ssid, auth=None, bssid=None, timeout=None, **kwargs):
+        """Starts joining ssid, like Pycom's, without waiting; isconnected() turns True once associated.
+
+        Calling it again for the network already being joined does not restart the association.
+        """
+        board = sim.board()
+        password = auth[1] if auth and len(auth) > 1 else None
+        if self._joining is not None and self._joining[0] == ssid:
+            return
+        board.wifi_ssid = None
+        if board.access_points.get(ssid, object()) == password:
+            self._joining = (ssid, time.time() + board.wifi_delay * board.time_scale)
+        else:
+            self._joining = (ssid, None)  # Wrong network or password: never associates
+
+    def isconnected(self):
+        board = sim.board()
+        if self._joining is None or self._joining[1] is None or time.time() < self._joining[1]:
+            return False
+        board.wifi_ssid = self._joining[0]
+        return True
+
+    def disconnect(self):
+        self._joining = None
+        sim.board().wifi_ssid = None
+
+    def ifconfig(self, id=0, config=None):
+        if self.isconnected():
+            return ("192.168.1.57", "255.255.255.0", "192.168.1.1", "192.168.1.1")
+        return ("0.0.0.0", "0.0.0.0", "0.0.0.0", "0.0.0.0")
+
+    def scan(self):
+        board = sim.board()
+        board.sleep(1.2)  # An active scan of all channels
+        return [(ssid, bytes(6), self.WPA2, 6, -55) for ssid in board.access_points]
+
+    def deinit(self):
+        self.disconnect()
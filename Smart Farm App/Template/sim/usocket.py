@@ -0,0 +1,61 @@
+"""Host stand-in for MicroPython's `usocket`: every connection goes to the board's MQTT broker."""
+import errno
+import threading
+
+import sim
+
+
+AF_INET = 2
+SOCK_STREAM = 1
+
+
+def getaddrinfo(host, port, af=0, type=0, proto=0, flags=0):
+    return [(AF_INET, SOCK_STREAM, 0, "", (host, port))]
+
+
+class socket:
+    def __init__(self, af=AF_INET, type=SOCK_STREAM, proto=0):
+        self._connection = None
+        self._blocking = True
+
+    def _check(self):
+        board = sim.board()
+        if threading.current_thread() is threading.main_thread():
+            board.check_deadline()
+        if self._connection is None or board.wifi_ssid is None:
+            raise OSError(errno.ENOTCONN, "ENOTCONN")
+
+    def connect(self, address):
+        board = sim.board()
+        if board.wifi_ssid is None:
+            raise OSError(errno.EHOSTUNREACH, "EHOSTUNREACH")
+        board.sleep(board.network_rtt)  # TCP handshake
+        self._connection = board.broker.open()
+
+    def setblocking(self, flag):
+        self._blocking = bool(flag)
+
+    def settimeout(self, value):
+        self._blocking = value is None or value > 0
+
+    def write(self, buf, n=None):
+        self._check()
+        if isinstance(buf, str):
+            buf = buf.encode()  # MicroPython streams take str too
+        data = bytes(buf if n is None else buf[:n])
+        self._connection.client_write(data)
+        return len(data)
+
+    send = write
+
+    def read(self, n):
+        self._check()
+        return self._connection.client_read(n, self._blocking)
+
+    def recv(self, n):
+        return self.read(n) or b""
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.client_close()
+            self._connection = None
@@ -0,0 +1,159 @@
+import threading
+from collections import deque
+
+
+# Thresholds the dashboard pages used to hard-code, used to seed the rules table
+DEFAULT_THRESHOLDS = {
+    "temperature": 30,
+    "humidity": 60,
+    "co2": 1000,
+    "light_intensity": 500,
+}
+
+OPERATORS = ("above", "below")
+
+
+class ThresholdRule:
+    """A single threshold rule for one metric of one farm.
+
+    The alert is raised once the value has stayed past the threshold for min_duration seconds,
+    and cleared once it moves back past the threshold by more than hysteresis.
+    """
+
+    def __init__(self, rule_id, farm_id, metric, operator, threshold, hysteresis=0.0, min_duration=0.0):
+        if operator not in OPERATORS:
+            raise ValueError(f"Unknown operator: {operator}")
+        self.rule_id = rule_id
+        self.farm_id = farm_id
+        self.metric = metric
+        self.operator = operator
+        self.threshold = float(threshold)
+        self.hysteresis = float(hysteresis or 0.0)
+        self.min_duration = float(min_duration or 0.0)
+
+    def is_breached(self, value):
+        if self.operator == "above":
+            return value > self.threshold
+        return value < self.threshold
+
+    def is_cleared(self, value):
+        if self.operator == "above":
+            return value <= self.threshold - self.hysteresis
+        return value >= self.threshold + self.hysteresis
+
+
+class _RuleState:
+    __slots__ = ("pending_since", "active")
+
+    def __init__(self):
+        self.pending_since = None
+        self.active = False
+
+
+class AlertEngine:
+    """Evaluate readings against threshold rules.
+
+    Rules are indexed by (farm_id, metric), so each reading only touches the rules of its own
+    farm and metrics, whatever the total number of rules.
+    """
+
+    def __init__(self, rules=()):
+        self._lock = threading.Lock()
+        self._index = {}
+        self._states = {}
+        self.load_rules(rules)
+
+    def load_rules(self, rules):
+        """Replace the rule set. State is kept for rules that still exist."""
+        index = {}
+        for rule in rules:
+            index.setdefault((rule.farm_id, rule.metric), []).append(rule)
+
+        with self._lock:
+            states = {}
+            for bucket in index.values():
+                for rule in bucket:
+                    states[rule.rule_id] = self._states.get(rule.rule_id) or _RuleState()
+            self._index = index
+            self._states = states
+
+    def rule_count(self):
+        with self._lock:
+            return sum(len(bucket) for bucket in self._index.values())
+
+    def evaluate(self, farm_id, timestamp, values):
+        """Evaluate one reading ({metric: value}) taken at timestamp (Unix seconds).
+
+        Returns the list of alert events ("raised" or "cleared") the reading triggered.
+        """
+        events = []
+        with self._lock:
+            for metric, value in values.items():
+                if value is None:
+                    continue
+                for rule in self._index.get((farm_id, metric), ()):
+                    event = self._step(rule, self._states[rule.rule_id], timestamp, value)
+                    if event is not None:
+                        events.append(event)
+        return events
+
+    def _step(self, rule, state, timestamp, value):
+        if state.active:
+            if rule.is_cleared(value):
+                state.active = False
+                state.pending_since = None
+                return self._event(rule, "cleared", timestamp, value)
+            return None
+
+        if not rule.is_breached(value):
+            state.pending_since = None
+            return None
+
+        if state.pending_since is None:
+            state.pending_since = timestamp
+        if timestamp - state.pending_since >= rule.min_duration:
+            state.active = True
+            return self._event(rule, "raised", timestamp, value)
+        return None
+
+    @staticmethod
+    def _event(rule, state, timestamp, value):
+        return {
+            "rule_id": rule.rule_id,
+            "farm_id": rule.farm_id,
+            "metric": rule.metric,
+            "operator": rule.operator,
+            "threshold": rule.threshold,
+            "state": state,
+            "value": value,
+            "timestamp": timestamp,
+        }
+
+
+class EventStream:
+    """Bounded in-process event stream. Each event gets an increasing sequence number,
+    and subscribers wait for events newer than the last one they saw."""
+
+    def __init__(self, maxlen=1000):
+        self._events = deque(maxlen=maxlen)
+        self._seq = 0
+        self._cond = threading.Condition()
+
+    def publish(self, event):
+        with self._cond:
+            self._seq += 1
+            self._events.append((self._seq, event))
+            self._cond.notify_all()
+        return self._seq
+
+    def since(self, seq, timeout=None):
+        """Return [(seq, event)] newer than seq, waiting up to timeout seconds if there are none yet."""
+        with self._cond:
+            if timeout and self._seq <= seq:
+                self._cond.wait(timeout)
+            return [item for item in self._events if item[0] > seq]
+
+    @property
+    def last_seq(self):
+        with self._cond:
+            return self._seq
@@ -0,0 +1,178 @@
+"""Sensor fault and anomaly detection.
+
+Streaming mode keeps an exponentially weighted mean/variance per (farm, device, metric), so each
+reading costs O(1) time and memory. Batch mode scores historical arrays with a vectorized rolling
+z-score. Both flag values outside the sensor's physical range, values stuck at the same reading
+(except for metrics that are legitimately constant, like light at night), and spikes. A run of
+spikes in the same direction is a level shift (a heater turned on, a sensor replaced): streaming
+mode then moves its baseline to the new level instead of quarantining the metric for good.
+"""
+import math
+import threading
+
+import numpy as np
+
+
+# Physical output range of the prototype's sensors
+SENSOR_RANGES = {
+    "temperature": (-40.0, 85.0),        # Tphg (BME680) at 0x76
+    "humidity": (0.0, 100.0),            # Tphg (BME680) at 0x76
+    "co2": (1.0, 40000.0),               # SCD4x at 0x62; a reading of 0 means the sensor is not ready
+    "light_intensity": (0.0, 65535.0),   # BH1750 at 0x5C
+}
+
+DEFAULT_ALPHA = 0.1         # EWMA smoothing factor
+DEFAULT_Z_THRESHOLD = 4.0   # Spike threshold, in standard deviations
+DEFAULT_WARMUP = 10         # Readings needed before spikes are flagged
+DEFAULT_STUCK_COUNT = 12    # Identical consecutive readings that count as a stuck sensor
+DEFAULT_SHIFT_COUNT = 5     # Consecutive spikes in one direction accepted as a new level
+# Metrics that can hold one value for hours without a fault (light is 0 all night): no stuck check
+STEADY_METRICS = frozenset({"light_intensity"})
+MIN_STD = 1e-6
+
+
+class _MetricState:
+    __slots__ = ("mean", "var", "count", "last_value", "repeats", "shift_direction", "shift_count", "shift_sum")
+
+    def __init__(self):
+        self.mean = 0.0
+        self.var = 0.0
+        self.count = 0
+        self.last_value = None
+        self.repeats = 0
+        self.shift_direction = 0
+        self.shift_count = 0
+        self.shift_sum = 0.0
+
+
+class StreamingDetector:
+    """Online anomaly detector with constant memory per (farm, device, metric)."""
+
+    def __init__(self, alpha=DEFAULT_ALPHA, z_threshold=DEFAULT_Z_THRESHOLD, warmup=DEFAULT_WARMUP,
+                 stuck_count=DEFAULT_STUCK_COUNT, shift_count=DEFAULT_SHIFT_COUNT, ranges=None, steady_metrics=STEADY_METRICS):
+        self.alpha = alpha
+        self.z_threshold = z_threshold
+        self.warmup = warmup
+        self.stuck_count = stuck_count
+        self.shift_count = shift_count
+        self.ranges = ranges or SENSOR_RANGES
+        self.steady_metrics = steady_metrics
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def score(self, farm_id, values, device_id=None):
+        """Score one reading ({metric: value}); return {metric: reason} for the anomalous metrics.
+
+        Each device has its own baselines. Anomalous values do not update the running statistics,
+        so a fault can't drag the baseline, until shift_count spikes in a row confirm a new level.
+        """
+        flags = {}
+        with self._lock:
+            for metric, value in values.items():
+                if value is None:
+                    continue
+                key = (farm_id, device_id, metric)
+                state = self._states.get(key)
+                if state is None:
+                    state = self._states[key] = _MetricState()
+                reason = self._step(metric, state, value)
+                if reason is not None:
+                    flags[metric] = reason
+        return flags
+
+    def _step(self, metric, state, value):
+        low, high = self.ranges.get(metric, (-math.inf, math.inf))
+        if not low <= value <= high:
+            return "out_of_range"
+
+        state.repeats = state.repeats + 1 if value == state.last_value else 1
+        state.last_value = value
+        if state.repeats >= self.stuck_count and metric not in self.steady_metrics:
+            return "stuck"
+
+        if state.count >= self.warmup:
+            std = max(math.sqrt(state.var), MIN_STD)
+            if abs(value - state.mean) / std > self.z_threshold:
+                direction = 1 if value > state.mean else -1
+                if direction != state.shift_direction:
+                    state.shift_direction, state.shift_count, state.shift_sum = direction, 0, 0.0
+                state.shift_count += 1
+                state.shift_sum += value
+                if state.shift_count < self.shift_count:
+                    return "spike"
+                # The readings stayed off to one side: accept their level as the new baseline
+                state.mean = state.shift_sum / state.shift_count
+                state.shift_direction, state.shift_count, state.shift_sum = 0, 0, 0.0
+                state.count += 1
+                return None
+        state.shift_direction, state.shift_count, state.shift_sum = 0, 0, 0.0
+
+        # Exponentially weighted mean and variance
+        if state.count == 0:
+            state.mean = value
+        else:
+            diff = value - state.mean
+            increment = self.alpha * diff
+            state.mean += increment
+            state.var = (1 - self.alpha) * (state.var + diff * increment)
+        state.count += 1
+        return None
+
+    def state_count(self):
+        with self._lock:
+            return len(self._states)
+
+
+def score_batch(values, metric, window=60, z_threshold=DEFAULT_Z_THRESHOLD, stuck_count=DEFAULT_STUCK_COUNT, ranges=None,
+                steady_metrics=STEADY_METRICS):
+    """Score a 1-D array of readings (oldest first, NaN for missing) for one metric.
+
+    Returns an array of reason strings ("" for normal values). Spikes are measured against the
+    mean/std of the previous `window` valid readings, computed with cumulative sums, so the whole
+    range is scored in a few vectorized passes.
+    """
+    x = np.asarray(values, dtype=np.float64)
+    n = x.size
+    reasons = np.full(n, "", dtype=object)
+    if n == 0:
+        return reasons
+
+    low, high = (ranges or SENSOR_RANGES).get(metric, (-np.inf, np.inf))
+    valid = ~np.isnan(x)
+    out_of_range = valid & ((x < low) | (x > high))
+    usable = valid & ~out_of_range
+
+    # Stuck sensor: length of the run of identical values ending at each index
+    same_as_previous = np.zeros(n, dtype=bool)
+    same_as_previous[1:] = usable[1:] & usable[:-1] & (x[1:] == x[:-1])
+    run_starts = np.where(~same_as_previous, np.arange(n), 0)
+    np.maximum.accumulate(run_starts, out=run_starts)
+    run_length = np.arange(n) - run_starts + 1
+    stuck = usable & (run_length >= stuck_count) & (metric not in steady_metrics)
+
+    # Rolling z-score over the previous `window` usable values
+    filled = np.where(usable, x, 0.0)
+    csum = np.concatenate(([0.0], np.cumsum(filled)))
+    csum_sq = np.concatenate(([0.0], np.cumsum(filled * filled)))
+    ccount = np.concatenate(([0], np.cumsum(usable)))
+
+    idx = np.arange(n)
+    start = np.maximum(idx - window, 0)
+    count = ccount[idx] - ccount[start]
+    total = csum[idx] - csum[start]
+    total_sq = csum_sq[idx] - csum_sq[start]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total / count
+        std = np.sqrt(np.maximum(total_sq / count - mean * mean, 0.0))
+        z = np.abs(x - mean) / np.maximum(std, MIN_STD)
+    spike = usable & ~stuck & (count >= min(window, DEFAULT_WARMUP)) & (z > z_threshold)
+
+    reasons[spike] = "spike"
+    reasons[stuck] = "stuck"
+    reasons[out_of_range] = "out_of_range"
+    return reasons
+
+
+def format_flags(flags):
+    """Encode {metric: reason} as the "metric:reason,..." string stored on a row."""
+    return ",".join(f"{metric}:{reason}" for metric, reason in sorted(flags.items())) or None
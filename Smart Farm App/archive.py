@@ -0,0 +1,146 @@
+"""Time-partitioned Parquet archive of cold SmartFarmData rows.
+
+Layout: <root>/<farm_id>/<YYYY-MM>.parquet, one zstd-compressed file per farm and month, sorted
+by time and split into row groups, so range reads skip whole files by name and whole row groups
+by their updated_time statistics.
+"""
+import os
+from datetime import datetime
+from urllib.parse import quote, unquote
+
+import numpy as np
+
+from readings import METRICS
+
+# pyarrow is imported on first use: it is slow to import, and the archive is optional
+pa = pq = None
+
+
+ROW_GROUP_SIZE = 20000
+COLUMNS = ("id", "updated_time") + METRICS + ("anomaly",)
+
+
+def _require_pyarrow():
+    global pa, pq
+    if pq is None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError("pyarrow is required for the Parquet archive (pip install pyarrow)")
+        pa, pq = pyarrow, pyarrow.parquet
+
+
+def _schema():
+    fields = [pa.field("id", pa.int64()), pa.field("updated_time", pa.timestamp("us"))]
+    fields += [pa.field(metric, pa.float64()) for metric in METRICS]
+    fields.append(pa.field("anomaly", pa.string()))
+    return pa.schema(fields)
+
+
+def farm_dir(root, farm_id):
+    return os.path.join(root, quote(farm_id, safe=""))
+
+
+def month_path(root, farm_id, year, month):
+    return os.path.join(farm_dir(root, farm_id), f"{year:04d}-{month:02d}.parquet")
+
+
+def archived_farms(root):
+    """Sorted farm_ids that have an archive directory."""
+    if not os.path.isdir(root):
+        return []
+    return sorted(unquote(name) for name in os.listdir(root) if os.path.isdir(os.path.join(root, name)))
+
+
+def archived_months(root, farm_id):
+    """Sorted [(year, month)] of the months archived for a farm."""
+    directory = farm_dir(root, farm_id)
+    if not os.path.isdir(directory):
+        return []
+    months = []
+    for name in os.listdir(directory):
+        if name.endswith(".parquet"):
+            year, month = name[:-len(".parquet")].split("-")
+            months.append((int(year), int(month)))
+    return sorted(months)
+
+
+def write_month(root, farm_id, year, month, columns):
+    """Write (or extend) the archive file of one farm and month.
+
+    columns maps each name in COLUMNS to a sequence: id ints, naive datetimes, float metric values
+    and anomaly strings. Rows whose id is already archived replace the archived copy, so writing
+    the same rows again (e.g. after a crash before they were deleted from the database) does not
+    duplicate them. The file is replaced atomically, so readers never see a partial file.
+    """
+    _require_pyarrow()
+    table = pa.table({name: columns[name] for name in COLUMNS}, schema=_schema())
+
+    path = month_path(root, farm_id, year, month)
+    if os.path.exists(path):
+        table = pa.concat_tables([pq.read_table(path, schema=_schema()), table])
+        # Keep the last copy of each id: the rows being written win over the archived ones
+        ids = table.column("id").to_numpy()
+        _, last_from_end = np.unique(ids[::-1], return_index=True)
+        if last_from_end.size < ids.size:
+            table = table.take(np.sort(ids.size - 1 - last_from_end))
+    table = table.sort_by([("updated_time", "ascending"), ("id", "ascending")])
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    pq.write_table(table, tmp_path, row_group_size=ROW_GROUP_SIZE, compression="zstd", write_statistics=True)
+    with open(tmp_path, "rb") as archive_file:
+        os.fsync(archive_file.fileno())
+    os.replace(tmp_path, path)
+    return table.num_rows
+
+
+def read_range(root, farm_id, start, end, columns=COLUMNS):
+    """Read the archived rows of a farm with start <= updated_time < end (naive datetimes).
+
+    Returns {column: numpy array} sorted by time; updated_time is datetime64[us].
+    """
+    empty = {name: np.empty(0, dtype="datetime64[us]" if name == "updated_time" else object) for name in columns}
+    months = [
+        (year, month) for year, month in archived_months(root, farm_id)
+        if datetime(year, month, 1) < end and (datetime(year + month // 12, month % 12 + 1, 1) > start)
+    ]
+    if not months:
+        return empty
+    _require_pyarrow()
+
+    wanted = list(dict.fromkeys(("updated_time",) + tuple(columns)))
+    start64, end64 = np.datetime64(start, "us"), np.datetime64(end, "us")
+    tables = []
+    for year, month in months:
+        parquet_file = pq.ParquetFile(month_path(root, farm_id, year, month))
+        time_index = parquet_file.schema_arrow.get_field_index("updated_time")
+
+        # Row-group pruning on the updated_time min/max statistics
+        groups = []
+        for i in range(parquet_file.num_row_groups):
+            stats = parquet_file.metadata.row_group(i).column(time_index).statistics
+            if stats is not None and stats.has_min_max:
+                if np.datetime64(stats.max, "us") < start64 or np.datetime64(stats.min, "us") >= end64:
+                    continue
+            groups.append(i)
+        if groups:
+            tables.append(parquet_file.read_row_groups(groups, columns=wanted))
+
+    if not tables:
+        return empty
+
+    table = pa.concat_tables(tables)
+    times = table.column("updated_time").to_numpy().astype("datetime64[us]")
+    mask = (times >= start64) & (times < end64)
+    result = {}
+    for name in columns:
+        column = table.column(name)
+        if name == "updated_time":
+            result[name] = times[mask]
+        elif name in METRICS:
+            result[name] = column.to_numpy(zero_copy_only=False).astype(np.float64)[mask]
+        else:
+            result[name] = np.asarray(column.to_pylist(), dtype=object)[mask]
+    return result
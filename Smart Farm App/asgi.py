@@ -0,0 +1,198 @@
+"""ASGI entry point, so a few workers can keep serving while the message broker is slow.
+
+    uvicorn asgi:app --workers 2
+
+Routes that wait on the message broker (sensor and state fetch, Wi-Fi info and status) and the
+actuator routes are served natively here: the Adafruit IO round trip is awaited on the event loop,
+and their database work (such as queueing an actuator command) is awaited in a small thread pool. Every other route goes to the Flask app through asgiref's
+WSGI adapter, which runs it in a thread as well, so no request holds up the event loop.
+"""
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi
+from flask_jwt_extended import decode_token, get_unverified_jwt_headers
+
+import metrics
+import smart_farm_app as sfa
+from smart_farm_app import rq
+
+
+flask_app = sfa.create_app()
+wsgi_app = WsgiToAsgi(flask_app)
+db_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('SMART_FARM_ASYNC_DB_THREADS', '8')), thread_name_prefix="async-db")
+
+
+async def run_in_app(fn, *args):
+    """Await blocking (database) work, run in the thread pool inside an app context."""
+    def call():
+        with flask_app.app_context():
+            return fn(*args)
+    return await asyncio.get_running_loop().run_in_executor(db_executor, call)
+
+
+async def check_auth(headers):
+    """The auth_required() rule: an access token in stateless mode, open otherwise. Returns an error response or None.
+
+    Like jwt_required() in the Flask app, the token's user is loaded through the same cached lookup,
+    so a token of a user who no longer exists is refused once the cache entry is gone.
+    """
+    if not flask_app.config['JWT_STATELESS_AUTH']:
+        return None
+    authorization = headers.get(b"authorization", b"").decode("latin-1")
+    if not authorization.startswith("Bearer "):
+        return 401, {"msg": "Missing Authorization Header"}
+    token = authorization[len("Bearer "):]
+    try:
+        with flask_app.app_context():
+            claims = decode_token(token)
+            jwt_header = get_unverified_jwt_headers(token)
+    except Exception as e:
+        return 422, {"msg": str(e)}
+    if claims.get("type") != "access":
+        return 422, {"msg": "Only non-refresh tokens are allowed"}
+    if await run_in_app(sfa.user_lookup_callback, jwt_header, claims) is None:
+        return 401, {"msg": f"Error loading the user {claims.get('sub')}"}
+    return None
+
+
+# Natively served routes, mirroring the Flask views of the same path
+
+def actuator_view(name):
+    async def view(scope):
+        query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+        device_id = query.get("device_id", [sfa.ANY_DEVICE])[0] or sfa.ANY_DEVICE
+        response = await run_in_app(sfa.queue_actuator_command, name, device_id)
+        if response["status"] != "accepted":
+            return 200, response
+        return 202, response, [(b"location", response["status_url"].encode("latin-1"))]
+    return view
+
+
+async def retrieve_sensor_data(scope):
+    try:
+        broker_data = await rq.sf_recv_from_sfout_async(topic=rq.OUT_CHANNEL)
+    except Exception as e:
+        return 200, {
+            "status": "error",
+            "message": f"An error occurred: {str(e)}"
+        }
+    return 200, await run_in_app(sfa.save_smart_farm_data, broker_data, None, rq.published_time(rq.OUT_CHANNEL, broker_data))
+
+
+async def retrieve_actuator_states(scope):
+    try:
+        message = await rq.sf_recv_from_stout_async(topic=rq.STATE_CHANNEL)
+        with flask_app.app_context():
+            updated = sfa.apply_state_message(message)
+    except Exception as e:
+        return 200, {
+            "status": "error",
+            "message": f"Failed to retrieve actuator states: {str(e)}"
+        }
+    return 200, {
+        "status": "success",
+        "updated": updated
+    }
+
+
+async def wifi_info(scope):
+    await rq.sf_send_async(topic=rq.IN_CHANNEL, msg="/flash/wifi.json")
+    wifi_data = await rq.sf_recv_from_wfout_async(topic=rq.WIFI_CHANNEL)
+    return 200, await run_in_app(sfa.save_wifi_info, wifi_data)
+
+
+async def connect_status(scope):
+    try:
+        status = await rq.sf_recv_from_wfout_async(topic=rq.WIFI_CHANNEL)
+    except Exception as e:
+        return 200, {
+            "message": f"Error: {str(e)}",
+            "status_code": 500
+        }
+    return 200, sfa.connect_status_response(status)
+
+
+ASYNC_ROUTES = {
+    ("POST", "/open_window"): actuator_view("open_window"),
+    ("POST", "/close_window"): actuator_view("close_window"),
+    ("POST", "/light_on"): actuator_view("light_on"),
+    ("POST", "/light_off"): actuator_view("light_off"),
+    ("POST", "/open_fan"): actuator_view("open_fan"),
+    ("POST", "/close_fan"): actuator_view("close_fan"),
+    ("POST", "/retrieve_sensor_data"): retrieve_sensor_data,
+    ("POST", "/retrieve_actuator_states"): retrieve_actuator_states,
+    ("GET", "/request_wifi_info"): wifi_info,
+    ("GET", "/connect_status"): connect_status,
+}
+
+
+async def send_json(send, status, body, headers=()):
+    payload = json.dumps(body).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(payload)).encode("ascii")),
+            (b"access-control-allow-origin", b"*"),  # Same as CORS(app)
+            *headers,
+        ],
+    })
+    await send({"type": "http.response.body", "body": payload})
+
+
+async def serve_async_route(view, scope, send):
+    started = time.perf_counter()
+    metrics.inc("sf_http_requests_in_flight")
+    status = 500
+    headers = ()
+    try:
+        error = await check_auth(dict(scope["headers"]))
+        if error is not None:
+            status, body = error
+        else:
+            try:
+                # (status, body) or (status, body, extra headers)
+                status, body, *extra = await view(scope)
+                headers = extra[0] if extra else ()
+            except Exception as e:
+                flask_app.logger.exception("Error serving %s", scope["path"])
+                status, body = 500, {"status": "error", "message": f"An error occurred: {str(e)}"}
+        await send_json(send, status, body, headers)
+    finally:
+        metrics.dec("sf_http_requests_in_flight")
+        metrics.observe("sf_http_request_duration_seconds", time.perf_counter() - started,
+                        route=scope["path"], method=scope["method"], status=status)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            # Background workers, unless another process runs them
+            if os.environ.get('SMART_FARM_BACKGROUND_WORKERS', '1') == '1':
+                await asyncio.get_running_loop().run_in_executor(None, sfa.start_background_workers, flask_app)
+            else:
+                sfa.share_broker_budget(flask_app)
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await rq.close_async_client()
+            db_executor.shutdown(wait=False)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    view = ASYNC_ROUTES.get((scope.get("method"), scope.get("path"))) if scope["type"] == "http" else None
+    if view is None:
+        await wsgi_app(scope, receive, send)
+        return
+    await serve_async_route(view, scope, send)
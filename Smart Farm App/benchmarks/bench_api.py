@@ -0,0 +1,201 @@
+"""Latency/throughput benchmark of the Flask API against SQLite and a fake message broker.
+
+    python benchmarks/bench_api.py --sizes 1000 10000 100000 --requests 200 --output bench.json
+    python benchmarks/bench_api.py --sizes 1000 --compare bench.json
+
+Requests go through the Flask test client, so the numbers measure the application itself
+(routing, auth, ORM, serialization) without any network or WSGI server overhead.
+Set SMART_FARM_DATABASE_URI to benchmark a local MySQL instead of SQLite.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, APP_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import fake_broker
+
+
+# (name, method, path, body) of each benchmarked route
+ROUTES = [
+    ("data_retrieval", "GET", "/data_retrieval", None),
+    ("data_simulation", "POST", "/data_simulation",
+     {"temperature": "27.1", "humidity": "58.0", "co2": "610", "light_intensity": "420"}),
+    ("login", "POST", "/login", {"username": "benchuser", "password": "benchpassword"}),
+    ("open_fan", "POST", "/open_fan", None),
+    ("close_fan", "POST", "/close_fan", None),
+    ("open_window", "POST", "/open_window", None),
+    ("close_window", "POST", "/close_window", None),
+    ("light_on", "POST", "/light_on", None),
+    ("light_off", "POST", "/light_off", None),
+]
+
+
+def load_app(work_dir):
+    """Create the app against a fresh, migrated database with the fake broker installed."""
+    os.environ.setdefault("SMART_FARM_DATABASE_URI", "sqlite:///" + os.path.join(work_dir, "bench.db"))
+    fake_broker.install()
+
+    import smart_farm_app
+    app = smart_farm_app.create_app({"JWT_STATELESS_AUTH": True, "LOGIN_RATE_LIMIT": 0})
+    with app.app_context():
+        smart_farm_app.setup_database()
+    return smart_farm_app, app
+
+
+def reset_table(module, app, size, seed=42):
+    """Replace the SmartFarmData rows with size synthetic readings, one per minute."""
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    with app.app_context():
+        module.SmartFarmData.query.delete()
+        rows = [
+            {
+                "farm_id": "default",
+                "updated_time": start + timedelta(minutes=i),
+                "co2": str(rng.randint(400, 1500)),
+                "temperature": f"{rng.uniform(18, 35):.2f}",
+                "humidity": f"{rng.uniform(40, 90):.2f}",
+                "light_intensity": str(rng.randint(0, 1000)),
+            }
+            for i in range(size)
+        ]
+        for offset in range(0, len(rows), 10000):
+            module.db.session.execute(module.SmartFarmData.__table__.insert(), rows[offset:offset + 10000])
+        module.db.session.commit()
+
+
+def ensure_user(module, client):
+    client.post('/register', json={"username": "benchuser", "password": "benchpassword"})
+    response = client.post('/login', json={"username": "benchuser", "password": "benchpassword"})
+    return response.get_json()["token"]
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = min(max(math.ceil(q / 100 * len(sorted_values)) - 1, 0), len(sorted_values) - 1)
+    return sorted_values[rank]
+
+
+def bench_route(client, token, method, path, body, requests, warmup):
+    headers = {"Authorization": f"Bearer {token}"}
+    send = client.get if method == "GET" else client.post
+
+    for _ in range(warmup):
+        send(path, json=body, headers=headers)
+
+    latencies = []
+    errors = 0
+    started = time.perf_counter()
+    for _ in range(requests):
+        t0 = time.perf_counter()
+        response = send(path, json=body, headers=headers)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        if response.status_code >= 400:
+            errors += 1
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "errors": errors,
+        "rps": requests / elapsed if elapsed else None,
+        "mean_ms": statistics.fmean(latencies),
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "max_ms": latencies[-1],
+    }
+
+
+def run(sizes, requests, warmup, routes):
+    work_dir = tempfile.mkdtemp(prefix="smart_farm_bench_")
+    # Routes export JSON files to the working directory; keep them out of the source tree
+    os.chdir(work_dir)
+    module, app = load_app(work_dir)
+    client = app.test_client()
+    token = ensure_user(module, client)
+
+    results = []
+    for size in sizes:
+        for name, method, path, body in ROUTES:
+            if routes and name not in routes:
+                continue
+            # Every route starts from the same table size (data_simulation adds rows)
+            reset_table(module, app, size)
+            # Slow O(table size) routes get fewer iterations on big tables
+            count = requests if size <= 10000 or name not in ("data_retrieval", "data_simulation") else max(5, requests // 10)
+            stats = bench_route(client, token, method, path, body, count, warmup)
+            stats.update({"route": name, "table_rows": size})
+            results.append(stats)
+            print(f"{name:16s} rows={size:<8d} p50={stats['p50_ms']:.2f}ms p95={stats['p95_ms']:.2f}ms "
+                  f"p99={stats['p99_ms']:.2f}ms rps={stats['rps']:.1f}", file=sys.stderr)
+
+    return {
+        "benchmark": "smart_farm_api",
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "database": app.config['SQLALCHEMY_DATABASE_URI'].split(":", 1)[0],
+        "results": results,
+    }
+
+
+def compare(current, baseline_path):
+    """Print the p95 latency and throughput change of each (route, table size) against a previous run."""
+    with open(baseline_path, "r") as baseline_file:
+        baseline = json.load(baseline_file)
+    previous = {(r["route"], r["table_rows"]): r for r in baseline["results"]}
+
+    print(f"{'route':16s} {'rows':>8s} {'p95 before':>11s} {'p95 after':>10s} {'change':>8s} {'rps change':>11s}")
+    for result in current["results"]:
+        before = previous.get((result["route"], result["table_rows"]))
+        if before is None:
+            continue
+        p95_change = (result["p95_ms"] / before["p95_ms"] - 1) * 100
+        rps_change = (result["rps"] / before["rps"] - 1) * 100
+        print(f"{result['route']:16s} {result['table_rows']:8d} {before['p95_ms']:10.2f}ms {result['p95_ms']:9.2f}ms "
+              f"{p95_change:+7.1f}% {rps_change:+10.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Smart Farm API routes.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="SmartFarmData table sizes to benchmark at")
+    parser.add_argument("--requests", type=int, default=200, help="Timed requests per route and size")
+    parser.add_argument("--warmup", type=int, default=5, help="Untimed requests before each measurement")
+    parser.add_argument("--routes", nargs="+", help="Only benchmark these routes")
+    parser.add_argument("--output", help="Write the JSON results to this file (default: stdout)")
+    parser.add_argument("--compare", help="Previous JSON results to compare against")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = os.path.abspath(args.compare) if args.compare else None
+
+    current = run(args.sizes, args.requests, args.warmup, args.routes)
+
+    if output:
+        with open(output, "w") as json_file:
+            json.dump(current, json_file, indent=4)
+    else:
+        print(json.dumps(current, indent=4))
+
+    if baseline:
+        compare(current, baseline)
+
+
+if __name__ == '__main__':
+    main()
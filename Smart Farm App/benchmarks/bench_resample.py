@@ -0,0 +1,75 @@
+"""Benchmark of timeseries.resample on multi-million-row ranges.
+
+    python benchmarks/bench_resample.py --rows 1000000 5000000 --output resample.json
+
+Readings are synthetic: ~5 s apart with jitter and random dropped packets, like the firmware loop.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from timeseries import RESAMPLE_METHODS, make_grid, resample
+
+
+def synthetic_readings(rows, seed=42):
+    rng = np.random.default_rng(seed)
+    timestamps = 1704067200 + np.cumsum(rng.uniform(4.5, 5.5, rows))
+    values = 25 + 5 * np.sin(timestamps / 86400 * 2 * np.pi) + rng.normal(0, 0.3, rows)
+    values[rng.random(rows) < 0.02] = np.nan  # Lost packets
+    return timestamps, values
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark resampling onto a regular grid.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000000, 5000000])
+    parser.add_argument("--interval", type=float, default=60, help="Grid interval in seconds")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="Write the JSON results to this file (default: stdout)")
+    args = parser.parse_args()
+
+    results = []
+    for rows in args.rows:
+        timestamps, values = synthetic_readings(rows)
+        grid = make_grid(timestamps[0], timestamps[-1], args.interval)
+        for method in RESAMPLE_METHODS:
+            timings = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                resample(timestamps, values, grid, method, max_gap=600)
+                timings.append(time.perf_counter() - started)
+            best = min(timings)
+            results.append({
+                "rows": rows,
+                "grid_points": int(grid.size),
+                "method": method,
+                "best_s": best,
+                "median_s": float(np.median(timings)),
+                "rows_per_s": rows / best,
+            })
+            print(f"{method:7s} rows={rows:<9d} best={best * 1000:.1f}ms rows/s={rows / best:,.0f}", file=sys.stderr)
+
+    output = {
+        "benchmark": "resample",
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as json_file:
+            json.dump(output, json_file, indent=4)
+    else:
+        print(json.dumps(output, indent=4))
+
+
+if __name__ == '__main__':
+    main()
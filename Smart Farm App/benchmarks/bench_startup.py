@@ -0,0 +1,131 @@
+"""Cold-start benchmark: time from `import smart_farm_app` to the first served request.
+
+    python benchmarks/bench_startup.py --runs 20 --output startup.json
+    python benchmarks/bench_startup.py --runs 20 --compare startup.json
+
+Every run is a fresh Python process (nothing cached in sys.modules), against an already migrated
+SQLite database and the fake message broker. Phases timed in each process:
+    import         import smart_farm_app
+    create_app     create_app()
+    first_request  GET / (routing only)
+    first_query    GET /data_retrieval (first database connection and query)
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(BENCH_DIR)
+
+PHASES = ("import", "create_app", "first_request", "first_query")
+
+
+def child():
+    """One cold start; prints the phase timings as JSON."""
+    sys.path.insert(0, APP_DIR)
+    sys.path.insert(0, BENCH_DIR)
+    import fake_broker
+    fake_broker.install()
+
+    timings = {}
+    started = time.perf_counter()
+    import smart_farm_app
+    timings["import"] = time.perf_counter() - started
+
+    t0 = time.perf_counter()
+    app = smart_farm_app.create_app({"JWT_STATELESS_AUTH": False})
+    timings["create_app"] = time.perf_counter() - t0
+
+    client = app.test_client()
+    t0 = time.perf_counter()
+    client.get('/')
+    timings["first_request"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    client.get('/data_retrieval')
+    timings["first_query"] = time.perf_counter() - t0
+
+    timings["total"] = time.perf_counter() - started
+    print(json.dumps(timings))
+
+
+def migrate(env):
+    code = ("import sys; sys.path[:0] = [%r, %r]; import fake_broker; fake_broker.install(); import smart_farm_app as m; "
+            "app = m.create_app()\nwith app.app_context(): m.setup_database()") % (APP_DIR, BENCH_DIR)
+    subprocess.run([sys.executable, "-c", code], env=env, check=True)
+
+
+def run(runs):
+    work_dir = tempfile.mkdtemp(prefix="smart_farm_startup_")
+    env = dict(os.environ, SMART_FARM_DATABASE_URI="sqlite:///" + os.path.join(work_dir, "startup.db"),
+               SMART_FARM_INGEST_LOG=os.path.join(work_dir, "ingest.log"))
+    migrate(env)
+
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), "--child"], env=env, cwd=work_dir,
+                                check=True, capture_output=True, text=True).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+
+    results = {}
+    for phase in PHASES + ("total",):
+        values = sorted(sample[phase] * 1000 for sample in samples)
+        results[phase] = {"min_ms": values[0], "median_ms": statistics.median(values), "max_ms": values[-1]}
+        print(f"{phase:14s} min={values[0]:8.1f}ms median={statistics.median(values):8.1f}ms", file=sys.stderr)
+
+    return {
+        "benchmark": "smart_farm_startup",
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "runs": runs,
+        "results": results,
+    }
+
+
+def compare(current, baseline_path):
+    """Print the median change of each phase against a previous run."""
+    with open(baseline_path, "r") as baseline_file:
+        baseline = json.load(baseline_file)
+
+    print(f"{'phase':14s} {'before':>10s} {'after':>10s} {'change':>8s}")
+    for phase, result in current["results"].items():
+        before = baseline["results"].get(phase)
+        if before is None:
+            continue
+        change = (result["median_ms"] / before["median_ms"] - 1) * 100
+        print(f"{phase:14s} {before['median_ms']:8.1f}ms {result['median_ms']:8.1f}ms {change:+7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Smart Farm app cold start.")
+    parser.add_argument("--runs", type=int, default=10, help="Cold starts to measure")
+    parser.add_argument("--output", help="Write the JSON results to this file (default: stdout)")
+    parser.add_argument("--compare", help="Previous JSON results to compare against")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child()
+        return
+
+    current = run(args.runs)
+    if args.output:
+        with open(args.output, "w") as json_file:
+            json.dump(current, json_file, indent=4)
+    else:
+        print(json.dumps(current, indent=4))
+
+    if args.compare:
+        compare(current, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,284 @@
+"""Local stand-in for the Adafruit IO v2 REST API, so the real request_message.py runs offline.
+
+    python benchmarks/fake_aio_server.py --port 8090 --latency 0.2 --error-rate 0.01 --throttle-per-minute 30
+    AIO_BASE_URL=http://127.0.0.1:8090/api/v2 flask --app smart_farm_app run
+
+Implements the calls the project makes, for any username and feed (feeds are created on first write):
+    POST /api/v2/<user>/feeds/<feed>/data        {"value": ...}, answers the stored data point
+    GET  /api/v2/<user>/feeds/<feed>/data/last   newest data point (404 if the feed is empty)
+    GET  /api/v2/<user>/feeds/<feed>/data        history, newest first: ?limit= (max 1000),
+                                                 ?start_time= / ?end_time= (ISO 8601, end exclusive);
+                                                 X-Pagination-* headers and a Link rel="next"
+Fault injection, for every API call:
+    --latency / --latency-jitter   seconds added to each response
+    --error-rate                   share of calls failing with 500
+    --throttle-per-minute          calls allowed per key and rolling minute, then 429 with Retry-After
+They can be changed while running with POST /_control (same names, underscores), and GET /_control
+shows them with the call counts.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+
+FEED_PATH = re.compile(r"^/api/v2/(?P<user>[^/]+)/feeds/(?P<feed>[^/]+)/data(?P<last>/last)?/?$")
+MAX_PAGE = 1000
+
+
+def iso_time(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc).isoformat(timespec="microseconds").replace("+00:00", "Z")
+
+
+def parse_time(value):
+    """Epoch seconds of an ISO 8601 time (or of a number of epoch seconds)."""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+class FakeAdafruitIO:
+    """Feed data and fault injection settings shared by the request handler threads."""
+
+    def __init__(self, latency=0.0, latency_jitter=0.0, error_rate=0.0, throttle_per_minute=0, key=None, seed=None):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.throttle_per_minute = throttle_per_minute
+        self.key = key  # Required X-AIO-Key, if set
+        self.rng = random.Random(seed)
+        self.feeds = {}  # (user, feed) -> list of data points, oldest first
+        self.counts = {"requests": 0, "errors_injected": 0, "throttled": 0, "created": 0}
+        self._calls = {}  # key -> deque of call times in the last minute
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def settings(self):
+        return {
+            "latency": self.latency,
+            "latency_jitter": self.latency_jitter,
+            "error_rate": self.error_rate,
+            "throttle_per_minute": self.throttle_per_minute,
+        }
+
+    def configure(self, settings):
+        with self._lock:
+            for name, value in settings.items():
+                if name not in self.settings():
+                    raise ValueError(f"Unknown setting: {name}")
+                setattr(self, name, type(getattr(self, name))(value))
+
+    def delay(self):
+        return max(0.0, self.latency + self.rng.uniform(-self.latency_jitter, self.latency_jitter))
+
+    def admit(self, key):
+        """None if the call may proceed, else (status, body, headers) of the injected failure."""
+        now = time.time()
+        with self._lock:
+            self.counts["requests"] += 1
+            if self.throttle_per_minute > 0:
+                calls = self._calls.setdefault(key, deque())
+                while calls and calls[0] <= now - 60:
+                    calls.popleft()
+                if len(calls) >= self.throttle_per_minute:
+                    self.counts["throttled"] += 1
+                    retry_after = max(1, int(calls[0] + 60 - now + 1))
+                    return 429, {"error": "request limit reached, please slow down"}, {
+                        "Retry-After": str(retry_after),
+                        "X-AIO-RateLimit-Limit": str(self.throttle_per_minute),
+                        "X-AIO-RateLimit-Remaining": "0",
+                    }
+                calls.append(now)
+            if self.error_rate > 0 and self.rng.random() < self.error_rate:
+                self.counts["errors_injected"] += 1
+                return 500, {"error": "injected server error"}, {}
+        return None
+
+    def create(self, user, feed, value):
+        now = time.time()
+        with self._lock:
+            point = {
+                "id": f"{self._next_id:016d}",
+                "value": value,
+                "feed_key": feed,
+                "created_at": iso_time(now),
+                "created_epoch": now,
+            }
+            self._next_id += 1
+            self.feeds.setdefault((user, feed), []).append(point)
+            self.counts["created"] += 1
+        return point
+
+    def last(self, user, feed):
+        with self._lock:
+            points = self.feeds.get((user, feed))
+            return points[-1] if points else None
+
+    def history(self, user, feed, limit, start_time=None, end_time=None):
+        """(page of data points, newest first; total points in the time range)."""
+        with self._lock:
+            points = [
+                point for point in self.feeds.get((user, feed), [])
+                if (start_time is None or point["created_epoch"] >= start_time)
+                and (end_time is None or point["created_epoch"] < end_time)
+            ]
+        return points[::-1][:limit], len(points)
+
+
+def make_handler(aio):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, status, body, headers=None):
+            payload = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(payload)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def read_json(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            return json.loads(self.rfile.read(length) or b"{}")
+
+        def feed_call(self):
+            """(match, url parts) of a feed data call that passed auth and fault injection, else None."""
+            url = urlsplit(self.path)
+            match = FEED_PATH.match(url.path)
+            if match is None:
+                self.send_json(404, {"error": "not found"})
+                return None
+            key = self.headers.get("X-AIO-Key", "")
+            if aio.key is not None and key != aio.key:
+                self.send_json(401, {"error": "invalid API key"})
+                return None
+            time.sleep(aio.delay())
+            failure = aio.admit(key)
+            if failure is not None:
+                self.send_json(*failure)
+                return None
+            return match, url
+
+        def do_GET(self):
+            if self.path == "/_control":
+                self.send_json(200, dict(aio.settings(), counts=aio.counts))
+                return
+            call = self.feed_call()
+            if call is None:
+                return
+            match, url = call
+            user, feed = match.group("user"), match.group("feed")
+            if match.group("last"):
+                point = aio.last(user, feed)
+                if point is None:
+                    self.send_json(404, {"error": "not found - that is an invalid URL, or does not exist"})
+                else:
+                    self.send_json(200, point)
+                return
+
+            query = {name: values[0] for name, values in parse_qs(url.query).items()}
+            try:
+                limit = min(int(query.get("limit", MAX_PAGE)), MAX_PAGE)
+                start_time = parse_time(query["start_time"]) if "start_time" in query else None
+                end_time = parse_time(query["end_time"]) if "end_time" in query else None
+            except ValueError as e:
+                self.send_json(400, {"error": str(e)})
+                return
+            page, total = aio.history(user, feed, limit, start_time, end_time)
+            headers = {
+                "X-Pagination-Limit": str(limit),
+                "X-Pagination-Total": str(total),
+                "X-Pagination-Count": str(len(page)),
+            }
+            if page:
+                headers["X-Pagination-Start"] = page[-1]["created_at"]
+                headers["X-Pagination-End"] = page[0]["created_at"]
+            if total > len(page):
+                # The next (older) page ends where this one starts
+                next_query = dict(query, limit=limit, end_time=page[-1]["created_at"])
+                host = self.headers.get("Host", "127.0.0.1")
+                headers["Link"] = f'<http://{host}{url.path}?{urlencode(next_query)}>; rel="next"'
+            self.send_json(200, page, headers)
+
+        def do_POST(self):
+            if self.path == "/_control":
+                try:
+                    aio.configure(self.read_json())
+                except (ValueError, TypeError) as e:
+                    self.send_json(400, {"error": str(e)})
+                    return
+                self.send_json(200, aio.settings())
+                return
+            call = self.feed_call()
+            if call is None:
+                return
+            match, _ = call
+            try:
+                value = self.read_json()["value"]
+            except (ValueError, KeyError):
+                self.send_json(400, {"error": "request body must be JSON with a value"})
+                return
+            self.send_json(200, aio.create(match.group("user"), match.group("feed"), value))
+
+    return Handler
+
+
+def create_server(host="127.0.0.1", port=0, **options):
+    """A ThreadingHTTPServer serving a FakeAdafruitIO(**options), available as server.aio."""
+    aio = FakeAdafruitIO(**options)
+    server = ThreadingHTTPServer((host, port), make_handler(aio))
+    server.daemon_threads = True
+    server.aio = aio
+    return server
+
+
+def serve_in_thread(**options):
+    """Start a server in a background thread; returns (server, base URL for AIO_BASE_URL)."""
+    server = create_server(**options)
+    threading.Thread(target=server.serve_forever, name="fake-aio", daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}/api/v2"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for the Adafruit IO REST API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to each response")
+    parser.add_argument("--latency-jitter", type=float, default=0.0, help="Random +/- seconds on top of --latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of calls failing with 500")
+    parser.add_argument("--throttle-per-minute", type=int, default=0, help="Calls per key and minute before 429 (0: no limit)")
+    parser.add_argument("--key", help="Required X-AIO-Key (default: any)")
+    parser.add_argument("--seed", type=int, help="Random seed for latency and errors")
+    parser.add_argument("--value", action="append", default=[], metavar="USER/FEED=VALUE",
+                        help="Initial data point of a feed, e.g. SmartFarmUSTH/wfout=1 (repeatable)")
+    args = parser.parse_args()
+
+    server = create_server(args.host, args.port, latency=args.latency, latency_jitter=args.latency_jitter,
+                           error_rate=args.error_rate, throttle_per_minute=args.throttle_per_minute,
+                           key=args.key, seed=args.seed)
+    for initial in args.value:
+        path, value = initial.split("=", 1)
+        user, feed = path.split("/", 1)
+        server.aio.create(user, feed, value)
+    print(f"Adafruit IO stand-in on http://{args.host}:{server.server_address[1]}/api/v2")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""In-memory stand-in for Template.request_message, so the app can run without Adafruit IO.
+
+Set SMART_FARM_FAKE_BROKER_LATENCY (seconds) to make every call as slow as a real round trip.
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+import types
+
+
+OUT_CHANNEL = "sfout"
+IN_CHANNEL = "sfinp"
+WIFI_CHANNEL = "wfout"
+STATE_CHANNEL = "stout"
+
+sent_messages = []
+history_ids = iter(range(1, 1 << 62))
+latency = float(os.environ.get('SMART_FARM_FAKE_BROKER_LATENCY', '0'))
+
+last_values = {
+    OUT_CHANNEL: json.dumps({"CO2": 520, "Temperature": 27.5, "Humidity": 61.0, "Light_0x5C": 340}),
+    WIFI_CHANNEL: "1",
+    STATE_CHANNEL: json.dumps({"Device": "fake0001", "State": {"fan": "off", "window": "closed", "light": "off"}, "Seq": 1}),
+}
+
+
+def sf_send(topic, msg):
+    time.sleep(latency)
+    sent_messages.append(str(msg))
+
+
+def sf_recv_from_sfout(topic=OUT_CHANNEL):
+    time.sleep(latency)
+    return last_values[OUT_CHANNEL]
+
+
+def sf_recv_from_wfout(topic):
+    time.sleep(latency)
+    return last_values[WIFI_CHANNEL]
+
+
+def sf_recv_from_stout(topic=STATE_CHANNEL):
+    time.sleep(latency)
+    return last_values[STATE_CHANNEL]
+
+
+def recv_history(feed, start_time=None, limit=1000, max_pages=None):
+    """One new data point per call, holding the feed's last value."""
+    time.sleep(latency)
+    now = time.time()
+    return [{"id": f"{next(history_ids):016d}", "value": last_values.get(feed, last_values[OUT_CHANNEL]), "created_epoch": now}]
+
+
+def point_time(point):
+    return float(point["created_epoch"])
+
+
+def published_time(feed, value):
+    """Unknown: readings are timestamped with the time of the poll."""
+    return None
+
+
+async def sf_send_async(topic, msg):
+    await asyncio.sleep(latency)
+    sent_messages.append(str(msg))
+
+
+async def sf_recv_from_sfout_async(topic=OUT_CHANNEL):
+    await asyncio.sleep(latency)
+    return last_values[OUT_CHANNEL]
+
+
+async def sf_recv_from_wfout_async(topic):
+    await asyncio.sleep(latency)
+    return last_values[WIFI_CHANNEL]
+
+
+async def sf_recv_from_stout_async(topic=STATE_CHANNEL):
+    await asyncio.sleep(latency)
+    return last_values[STATE_CHANNEL]
+
+
+async def close_async_client():
+    pass
+
+
+def install():
+    """Register this module as Template.request_message; call before importing smart_farm_app."""
+    module = types.ModuleType("Template.request_message")
+    for name in ("OUT_CHANNEL", "IN_CHANNEL", "WIFI_CHANNEL", "STATE_CHANNEL", "sent_messages", "last_values",
+                 "sf_send", "sf_recv_from_sfout", "sf_recv_from_wfout", "sf_recv_from_stout", "recv_history", "point_time",
+                 "published_time",
+                 "sf_send_async", "sf_recv_from_sfout_async", "sf_recv_from_wfout_async", "sf_recv_from_stout_async",
+                 "close_async_client"):
+        setattr(module, name, globals()[name])
+    sys.modules["Template.request_message"] = module
+    return module
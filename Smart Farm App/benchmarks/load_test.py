@@ -0,0 +1,260 @@
+"""Load test of the sync (WSGI) and async (ASGI) serving modes against a slow message broker.
+
+    python benchmarks/load_test.py --modes wsgi asgi --workers 2 --concurrency 1000 --requests 10000 \
+        --broker-latency 0.5 --output load.json
+
+Each mode runs as a real server on localhost against a broker every call of which takes
+--broker-latency seconds (a slow Adafruit IO round trip): the in-process fake broker, or with
+--broker http the real request_message.py talking to the local Adafruit IO stand-in
+(fake_aio_server.py, request budget lifted).
+    wsgi  Werkzeug with --workers processes serving one request each, like sync gunicorn workers
+    asgi  uvicorn asgi:app with --workers processes
+The client keeps --concurrency requests in flight: actuator commands (queued, 202) mixed with
+dashboard reads (/data_recent, database only), and reports latency per kind of request. It opens
+one connection per request on a bare asyncio socket, so the client itself stays cheap next to the
+server on small machines.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(BENCH_DIR)
+
+ACTUATOR_PATHS = ("/open_fan", "/close_fan", "/open_window", "/close_window", "/light_on", "/light_off")
+
+
+def install_fake_broker():
+    if os.environ.get("SMART_FARM_FAKE_BROKER", "1") == "1":
+        import fake_broker
+        fake_broker.install()
+
+
+def create_fake_broker_app():
+    """uvicorn factory for the server processes: the ASGI app with the fake broker installed."""
+    install_fake_broker()
+    import asgi
+    return asgi.app
+
+
+def serve(mode, port, workers):
+    """Server process: migrate the database, then serve until killed."""
+    install_fake_broker()
+    import smart_farm_app
+
+    app = smart_farm_app.create_app()
+    with app.app_context():
+        smart_farm_app.setup_database()
+
+    if mode == "asgi":
+        import uvicorn
+        uvicorn.run("load_test:create_fake_broker_app", factory=True, host="127.0.0.1", port=port,
+                    workers=workers, log_level="warning", backlog=4096)
+    else:
+        from werkzeug.serving import make_server
+        server = make_server("127.0.0.1", port, app, processes=workers)
+        server.request_queue_size = 4096
+        server.serve_forever()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_aio_server(broker_latency):
+    """Adafruit IO stand-in in this process, with a value in every feed the app reads."""
+    import fake_aio_server
+    import fake_broker
+    server, base_url = fake_aio_server.serve_in_thread(latency=broker_latency)
+    for feed, value in fake_broker.last_values.items():
+        server.aio.create("SmartFarmUSTH", feed, value)
+    return server, base_url
+
+
+def start_server(mode, workers, broker_latency, work_dir, aio_base_url=None):
+    port = free_port()
+    env = dict(os.environ,
+               PYTHONPATH=os.pathsep.join([APP_DIR, BENCH_DIR]),
+               SMART_FARM_DATABASE_URI="sqlite:///" + os.path.join(work_dir, f"{mode}.db"),
+               SMART_FARM_INGEST_LOG=os.path.join(work_dir, f"{mode}.log"),
+               SMART_FARM_SHARED_STATE=os.path.join(work_dir, f"{mode}.state"),
+               SMART_FARM_FAKE_BROKER_LATENCY=str(broker_latency),
+               SMART_FARM_BACKGROUND_WORKERS="0")
+    if aio_base_url:
+        env.update(SMART_FARM_FAKE_BROKER="0", AIO_BASE_URL=aio_base_url, AIO_REQUESTS_PER_MINUTE="1e9", AIO_BURST="1e9")
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", mode, "--port", str(port),
+                                "--workers", str(workers)], env=env, cwd=work_dir)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1).read()
+            return process, port
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"{mode} server did not start")
+
+
+def post_json(port, path, body):
+    request = urllib.request.Request(f"http://127.0.0.1:{port}{path}", data=json.dumps(body).encode("utf-8"),
+                                     headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as e:
+        return json.load(e)
+
+
+def get_token(port):
+    credentials = {"username": "loaduser", "password": "loadpassword"}
+    post_json(port, "/register", credentials)
+    return post_json(port, "/login", credentials)["token"]
+
+
+async def http_request(port, method, path, token):
+    """One request on a fresh connection; returns the status code."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        writer.write((f"{method} {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nAuthorization: Bearer {token}\r\n"
+                      f"Content-Length: 0\r\nConnection: close\r\n\r\n").encode("latin-1"))
+        await writer.drain()
+        status_line = await reader.readline()
+        await reader.read()  # Headers and body, up to the server closing the connection
+        return int(status_line.split()[1])
+    finally:
+        writer.close()
+
+
+def summarize(latencies, errors, elapsed):
+    latencies.sort()
+    count = len(latencies)
+    if not count:
+        return {"requests": 0, "errors": errors}
+
+    def pct(q):
+        return latencies[min(count - 1, int(q / 100 * count))]
+
+    return {
+        "requests": count,
+        "errors": errors,
+        "rps": count / elapsed,
+        "mean_ms": statistics.fmean(latencies),
+        "p50_ms": pct(50),
+        "p95_ms": pct(95),
+        "p99_ms": pct(99),
+        "max_ms": latencies[-1],
+    }
+
+
+async def generate_load(port, token, concurrency, total, read_ratio, timeout):
+    latencies = {"actuator": [], "dashboard_read": []}
+    errors = {"actuator": 0, "dashboard_read": 0}
+    remaining = [total]
+    rng = random.Random(42)
+
+    async def user():
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            if rng.random() < read_ratio:
+                kind, method, path = "dashboard_read", "GET", "/data_recent?hours=1"
+            else:
+                kind, method, path = "actuator", "POST", rng.choice(ACTUATOR_PATHS)
+            started = time.perf_counter()
+            try:
+                status = await asyncio.wait_for(http_request(port, method, path, token), timeout)
+            except (OSError, ValueError, IndexError, asyncio.TimeoutError):
+                errors[kind] += 1
+                continue
+            if status >= 400:
+                errors[kind] += 1
+                continue
+            latencies[kind].append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    results = {kind: summarize(latencies[kind], errors[kind], elapsed) for kind in latencies}
+    done = sum(len(values) for values in latencies.values())
+    results["all"] = {"requests": done, "errors": sum(errors.values()), "rps": done / elapsed, "elapsed_s": elapsed}
+    return results
+
+
+def run(args):
+    work_dir = tempfile.mkdtemp(prefix="smart_farm_load_")
+    aio_base_url = start_aio_server(args.broker_latency)[1] if args.broker == "http" else None
+    results = []
+    for mode in args.modes:
+        process, port = start_server(mode, args.workers, args.broker_latency, work_dir, aio_base_url)
+        try:
+            token = get_token(port)
+            by_kind = asyncio.run(generate_load(port, token, args.concurrency, args.requests,
+                                                args.read_ratio, args.timeout))
+        finally:
+            process.terminate()
+            process.wait()
+        for kind, stats in by_kind.items():
+            results.append(dict(stats, mode=mode, kind=kind))
+            if "p95_ms" in stats:
+                print(f"{mode:5s} {kind:15s} n={stats['requests']:<6d} errors={stats['errors']:<5d} p50={stats['p50_ms']:.0f}ms "
+                      f"p95={stats['p95_ms']:.0f}ms p99={stats['p99_ms']:.0f}ms", file=sys.stderr)
+        print(f"{mode:5s} total rps={by_kind['all']['rps']:.1f} in {by_kind['all']['elapsed_s']:.1f}s", file=sys.stderr)
+
+    return {
+        "benchmark": "smart_farm_load",
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "workers": args.workers,
+        "concurrency": args.concurrency,
+        "broker": args.broker,
+        "broker_latency_s": args.broker_latency,
+        "read_ratio": args.read_ratio,
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the sync and async serving modes.")
+    parser.add_argument("--modes", nargs="+", choices=("wsgi", "asgi"), default=["wsgi", "asgi"])
+    parser.add_argument("--workers", type=int, default=2, help="Server worker processes")
+    parser.add_argument("--concurrency", type=int, default=1000, help="Requests kept in flight")
+    parser.add_argument("--requests", type=int, default=10000, help="Requests per mode")
+    parser.add_argument("--broker-latency", type=float, default=0.5, help="Seconds per fake broker call")
+    parser.add_argument("--broker", choices=("fake", "http"), default="fake",
+                        help="In-process fake broker, or the Adafruit IO stand-in over HTTP")
+    parser.add_argument("--read-ratio", type=float, default=0.2, help="Share of dashboard reads")
+    parser.add_argument("--timeout", type=float, default=60, help="Client timeout per request, in seconds")
+    parser.add_argument("--output", help="Write the JSON results to this file (default: stdout)")
+    parser.add_argument("--serve", choices=("wsgi", "asgi"), help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port, args.workers)
+        return
+
+    output = run(args)
+    if args.output:
+        with open(args.output, "w") as json_file:
+            json.dump(output, json_file, indent=4)
+    else:
+        print(json.dumps(output, indent=4))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+"""Closed-loop climate control: drives the fan, window and light from sensor readings.
+
+Each actuator follows one metric with an on/off setpoint, hysteresis, minimum on/off times
+and a rate limit on the number of commands. Time is taken from the reading timestamps, so
+the same controller can be replayed offline against recorded data:
+
+    python climate_control.py --simulate smf_data_from_dtb.json
+"""
+import argparse
+import json
+import threading
+from collections import deque
+from datetime import datetime
+
+from readings import METRICS, to_epoch, to_float
+
+
+# Default setpoints, matching the dashboard alert thresholds
+DEFAULT_SETPOINTS = {
+    "fan": {"metric": "temperature", "operator": "above", "setpoint": 30, "hysteresis": 1.0,
+            "min_on": 60, "min_off": 60, "max_commands_per_hour": 12},
+    "window": {"metric": "humidity", "operator": "above", "setpoint": 60, "hysteresis": 5.0,
+               "min_on": 120, "min_off": 120, "max_commands_per_hour": 6},
+    "light": {"metric": "light_intensity", "operator": "below", "setpoint": 500, "hysteresis": 50.0,
+              "min_on": 300, "min_off": 300, "max_commands_per_hour": 6},
+}
+
+
+class ActuatorLoop:
+    """On/off control of a single actuator from a single metric."""
+
+    def __init__(self, name, metric, operator="above", setpoint=0, hysteresis=0.0,
+                 min_on=0, min_off=0, max_commands_per_hour=None):
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric: {metric}")
+        if operator not in ("above", "below"):
+            raise ValueError(f"Unknown operator: {operator}")
+        self.name = name
+        self.metric = metric
+        self.operator = operator
+        self.setpoint = float(setpoint)
+        self.hysteresis = float(hysteresis)
+        self.min_on = float(min_on)
+        self.min_off = float(min_off)
+        if min(self.hysteresis, self.min_on, self.min_off) < 0:
+            raise ValueError(f"Hysteresis and minimum times of {name} must not be negative")
+        self.max_commands_per_hour = None if max_commands_per_hour is None else int(max_commands_per_hour)
+
+        self.is_on = None         # Unknown until the first command is sent
+        self.changed_at = None
+        self._commands = deque()  # Timestamps of the commands sent in the last hour
+
+    def desired_state(self, value):
+        """Return True/False for the wanted state, or None to keep the current one (inside the hysteresis band)."""
+        if self.operator == "above":
+            if value > self.setpoint:
+                return True
+            if value <= self.setpoint - self.hysteresis:
+                return False
+        else:
+            if value < self.setpoint:
+                return True
+            if value >= self.setpoint + self.hysteresis:
+                return False
+        return None
+
+    def decide(self, timestamp, value):
+        """Return "on"/"off" if a command should be sent now, otherwise None."""
+        wanted = self.desired_state(value)
+        if wanted is None or wanted == self.is_on:
+            return None
+
+        # Respect the minimum time in the current state
+        if self.changed_at is not None:
+            held = timestamp - self.changed_at
+            if held < (self.min_on if self.is_on else self.min_off):
+                return None
+
+        # Rate limit over a sliding one-hour window
+        while self._commands and timestamp - self._commands[0] >= 3600:
+            self._commands.popleft()
+        if self.max_commands_per_hour is not None and len(self._commands) >= self.max_commands_per_hour:
+            return None
+
+        return "on" if wanted else "off"
+
+    def record(self, timestamp, command, succeeded):
+        """Account for a sent command; state only changes once the command went through."""
+        self._commands.append(timestamp)
+        if succeeded:
+            self.is_on = command == "on"
+            self.changed_at = timestamp
+
+    def config(self):
+        return {
+            "metric": self.metric,
+            "operator": self.operator,
+            "setpoint": self.setpoint,
+            "hysteresis": self.hysteresis,
+            "min_on": self.min_on,
+            "min_off": self.min_off,
+            "max_commands_per_hour": self.max_commands_per_hour,
+        }
+
+    def state(self):
+        return dict(self.config(), is_on=self.is_on, changed_at=self.changed_at)
+
+
+class ClimateController:
+    """Runs one ActuatorLoop per actuator and calls the matching action for each decision.
+
+    actions maps an actuator name to an (on, off) pair of callables, each returning a response
+    dict with a "status" key, like the open_smart_farm_* functions of the API.
+    """
+
+    def __init__(self, actions, setpoints=None):
+        self.actions = actions
+        self._lock = threading.Lock()
+        self.loops = {}
+        self.configure(setpoints or DEFAULT_SETPOINTS)
+
+    def configure(self, setpoints):
+        """Create or update the loops for the given actuators.
+
+        Settings missing from setpoints keep their current values (the defaults for a new loop),
+        and so does the actuator state. Invalid settings raise ValueError or TypeError and leave
+        every loop unchanged.
+        """
+        if not isinstance(setpoints, dict):
+            raise ValueError("Setpoints must map actuator names to their settings")
+        with self._lock:
+            loops = {}
+            for name, conf in setpoints.items():
+                if name not in self.actions:
+                    raise ValueError(f"Unknown actuator: {name}")
+                if not isinstance(conf, dict):
+                    raise ValueError(f"Settings of {name} must be an object")
+                previous = self.loops.get(name)
+                base = previous.config() if previous is not None else DEFAULT_SETPOINTS.get(name, {})
+                loop = ActuatorLoop(name, **dict(base, **conf))
+                if previous is not None:
+                    loop.is_on, loop.changed_at, loop._commands = previous.is_on, previous.changed_at, previous._commands
+                loops[name] = loop
+            self.loops.update(loops)
+
+    def process(self, timestamp, values, *args):
+        """Run every loop on one reading ({metric: value}); return the list of commands issued.
+
+        args are passed on to the actions (the API passes the device that sent the reading).
+        """
+        issued = []
+        with self._lock:
+            for name, loop in self.loops.items():
+                value = values.get(loop.metric)
+                if value is None:
+                    continue
+                command = loop.decide(timestamp, value)
+                if command is None:
+                    continue
+
+                on_action, off_action = self.actions[name]
+                try:
+                    result = (on_action if command == "on" else off_action)(*args)
+                    succeeded = not (isinstance(result, dict) and result.get("status") == "error")
+                except Exception:
+                    succeeded = False
+                loop.record(timestamp, command, succeeded)
+
+                issued.append({
+                    "actuator": name,
+                    "command": command,
+                    "metric": loop.metric,
+                    "value": value,
+                    "timestamp": timestamp,
+                    "succeeded": succeeded,
+                })
+        return issued
+
+    def state(self):
+        with self._lock:
+            return {name: loop.state() for name, loop in self.loops.items()}
+
+
+def simulate(readings, setpoints=None):
+    """Replay readings [(timestamp, {metric: value})] through a controller with recording actions.
+
+    Returns the list of commands the controller would have sent.
+    """
+    def noop():
+        return {"status": "success"}
+
+    actions = {name: (noop, noop) for name in (setpoints or DEFAULT_SETPOINTS)}
+    controller = ClimateController(actions, setpoints)
+
+    commands = []
+    for timestamp, values in readings:
+        commands.extend(controller.process(timestamp, values))
+    return commands
+
+
+def load_recorded_readings(path):
+    """Load readings from a /data_retrieval export (smf_data_from_dtb.json), oldest first."""
+    with open(path, "r") as json_file:
+        export = json.load(json_file)
+
+    rows = export["data"] if isinstance(export, dict) else export
+    readings = []
+    for row in rows:
+        if not row.get("updated_time"):
+            continue
+        timestamp = to_epoch(datetime.fromisoformat(row["updated_time"]))
+        readings.append((timestamp, {metric: to_float(row.get(metric)) for metric in METRICS}))
+
+    readings.sort(key=lambda reading: reading[0])
+    return readings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded readings through the climate controller.")
+    parser.add_argument("--simulate", required=True, help="Path to a /data_retrieval JSON export")
+    parser.add_argument("--setpoints", help="Optional JSON file overriding the default setpoints")
+    args = parser.parse_args()
+
+    setpoints = None
+    if args.setpoints:
+        with open(args.setpoints, "r") as conf_file:
+            setpoints = json.load(conf_file)
+
+    readings = load_recorded_readings(args.simulate)
+    commands = simulate(readings, setpoints)
+    print(json.dumps({"readings": len(readings), "commands": commands}, indent=4))
+
+
+if __name__ == '__main__':
+    main()
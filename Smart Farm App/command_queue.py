@@ -0,0 +1,61 @@
+"""Actuator command queue: the order, retries and expiry of commands on their way to a device.
+
+Commands are rows of the database (ActuatorCommand in smart_farm_app), so they survive restarts
+and are shared by all workers. Every dispatcher pass loads the active ones and asks plan_dispatch
+what to do with each:
+    - commands for one actuator of a device go out one at a time, in (priority, id) order: a lower
+      priority number runs first, so safety commands overtake the ones waiting before them;
+      different actuators are independent, so an unacknowledged fan command never holds up the light
+    - a sent command is re-sent when it was not acknowledged within its retry delay, which doubles
+      per attempt (with jitter) up to a maximum, and fails after max_attempts
+    - a command still queued or unacknowledged past its expiry time is dropped
+Acknowledgement comes from the device itself (its actuator state reports), not from the broker.
+"""
+import random
+
+
+QUEUED = "queued"
+SENT = "sent"
+ACKNOWLEDGED = "acknowledged"
+FAILED = "failed"
+EXPIRED = "expired"
+SUPERSEDED = "superseded"  # A newer command for the same actuator replaced it before it was acknowledged
+ACTIVE_STATES = (QUEUED, SENT)
+
+SAFETY_PRIORITY = 0
+NORMAL_PRIORITY = 10
+ANY_DEVICE = "*"  # Every device listening on the shared command feed
+
+
+def retry_delay(attempts, base, max_delay, jitter=0.1, rng=random):
+    """Seconds to wait for an acknowledgement after the given number of send attempts."""
+    delay = min(base * 2 ** max(attempts - 1, 0), max_delay)
+    return delay * (1 + rng.uniform(-jitter, jitter))
+
+
+def plan_dispatch(commands, now, max_attempts):
+    """[(action, command)] for the active commands, action being "send", "expire" or "fail".
+
+    Commands need device_id, actuator, priority, id, status, attempts, next_attempt_time and
+    expires_time. Only the head command of each (device, actuator) is sent or retried; the others
+    for that actuator wait for it to finish.
+    """
+    lanes = {}
+    for command in commands:
+        lanes.setdefault((command.device_id, command.actuator), []).append(command)
+
+    actions = []
+    for lane in lanes.values():
+        lane.sort(key=lambda command: (command.priority, command.id))
+        for command in lane:
+            if command.expires_time <= now:
+                actions.append(("expire", command))
+                continue
+            if command.next_attempt_time > now:
+                break  # Head still waiting for its acknowledgement (or retry time)
+            if command.status == SENT and command.attempts >= max_attempts:
+                actions.append(("fail", command))
+                continue
+            actions.append(("send", command))
+            break
+    return actions
@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+import threading
+
+
+class ConfigError(Exception):
+    """Raised when a config file cannot be parsed or does not have the expected shape."""
+
+
+def validate_object_or_list(data):
+    """Accept a JSON object or a list of JSON objects."""
+    if isinstance(data, dict):
+        return data
+    if isinstance(data, list) and all(isinstance(item, dict) for item in data):
+        return data
+    raise ConfigError("expected a JSON object or a list of JSON objects")
+
+
+# Keys of the networks in wifi_conf.json, as the device firmware reads them
+WIFI_CONF_KEYS = ("wifi_name", "password", "activate")
+# Keys of the entries in smf_conf.json, as /data_simulation writes them
+SMF_CONF_KEYS = ("updated_time", "temperature", "humidity", "co2", "light_intensity")
+
+
+def check_keys(item, required, allowed, where):
+    """Raise ConfigError unless item is a JSON object with every required key and only allowed keys."""
+    if not isinstance(item, dict):
+        raise ConfigError(f"{where}: expected a JSON object")
+    missing = [key for key in required if key not in item]
+    if missing:
+        raise ConfigError(f"{where}: missing {', '.join(missing)}")
+    unexpected = sorted(set(item) - set(allowed))
+    if unexpected:
+        raise ConfigError(f"{where}: unexpected {', '.join(unexpected)}")
+
+
+def validate_wifi_conf(data):
+    """Accept a list of Wi-Fi networks, {"wifi_name", "password", "activate"}, at most one of them active."""
+    if not isinstance(data, list) or not data:
+        raise ConfigError("expected a non-empty list of Wi-Fi networks")
+    for i, network in enumerate(data):
+        where = f"network {i}"
+        check_keys(network, WIFI_CONF_KEYS, WIFI_CONF_KEYS, where)
+        if not isinstance(network["wifi_name"], str) or not network["wifi_name"]:
+            raise ConfigError(f"{where}: wifi_name must be a non-empty string")
+        if not isinstance(network["password"], str):
+            raise ConfigError(f"{where}: password must be a string")
+        if network["activate"] not in (0, 1) or isinstance(network["activate"], bool):
+            raise ConfigError(f"{where}: activate must be 0 or 1")
+    if sum(network["activate"] for network in data) > 1:
+        raise ConfigError("more than one network has activate set")
+    return data
+
+
+def validate_smf_conf(data):
+    """Accept an entry or a list of entries with some of SMF_CONF_KEYS, each naming at least one metric."""
+    entries = validate_object_or_list(data)
+    for i, entry in enumerate(entries if isinstance(entries, list) else [entries]):
+        where = f"entry {i}"
+        check_keys(entry, (), SMF_CONF_KEYS, where)
+        if not any(key in entry for key in SMF_CONF_KEYS[1:]):
+            raise ConfigError(f"{where}: expected at least one of {', '.join(SMF_CONF_KEYS[1:])}")
+    return data
+
+
+class ConfigCache:
+    """Parse JSON config files once and re-read them only when their mtime or size changes.
+
+    load() also returns a hash of the content, so callers can tell whether it changed since they
+    last published it.
+    """
+
+    def __init__(self):
+        self._entries = {}    # path -> (mtime_ns, size, data, digest)
+        self._lock = threading.Lock()
+
+    def load(self, path, validator=validate_object_or_list):
+        """Return (data, digest) for the file at path.
+
+        Raises FileNotFoundError if the file is missing and ConfigError if it is invalid.
+        """
+        stat = os.stat(path)
+        key = (stat.st_mtime_ns, stat.st_size)
+
+        with self._lock:
+            entry = self._entries.get(path)
+        if entry is not None and entry[:2] == key:
+            return entry[2], entry[3]
+
+        try:
+            with open(path, "r") as conf_file:
+                data = validator(json.load(conf_file))
+        except json.JSONDecodeError as e:
+            raise ConfigError(str(e)) from e
+
+        # Hash a canonical encoding, so formatting-only edits don't count as changes
+        canonical = json.dumps(data, sort_keys=True, separators=(",", ":"))
+        digest = hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+        with self._lock:
+            self._entries[path] = (key[0], key[1], data, digest)
+        return data, digest
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,256 @@
+"""Append-only, memory-mapped log of fixed-size reading records.
+
+Ingestion appends each reading here first (a memory copy), and a drainer replays the log into
+the database in bulk, advancing a drain offset persisted in the file header. After a crash or a
+database outage, replay resumes from that offset, so no fetched reading is lost.
+
+File layout: a 64-byte header, then 256-byte records.
+    header: magic, version, record size, write offset, drain offset (record indexes)
+    record: marker, CRC32, timestamp (Unix seconds), farm_id and device_id (each a length byte
+            and up to 64 bytes of UTF-8), device sequence number (-1 if none), device timestamp
+            (NaN if none), one float64 per metric (NaN if missing)
+IDs that don't fit are rejected by append() rather than truncated. A record that can't be decoded
+is skipped by the drain and counted, so it never holds up the records behind it.
+Appends from several processes are serialized with an exclusive lock on the log file (where fcntl
+exists). Drainers take a second lock, so appends never wait for a slow database write.
+"""
+import math
+import mmap
+import os
+import struct
+import threading
+import zlib
+from collections import namedtuple
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process use only
+    fcntl = None
+
+from readings import METRICS
+
+
+# One logged reading; values maps each metric to a float or None
+LogRecord = namedtuple("LogRecord", "timestamp farm_id values device_id seq device_time")
+
+
+MAGIC = b"SFLOG001"
+VERSION = 3
+HEADER = struct.Struct("<8sIIQQ")
+HEADER_SIZE = 64
+ID_SIZE = 64  # Bytes of UTF-8 for farm_id and device_id
+BODY = struct.Struct(f"<dB{ID_SIZE}sB{ID_SIZE}sqd" + "d" * len(METRICS))
+RECORD = struct.Struct("<B3xI" + BODY.format[1:])
+RECORD_SIZE = 256
+RECORD_MARKER = 0xA5
+GROW_RECORDS = 16384  # File growth step (4 MiB)
+
+assert RECORD.size <= RECORD_SIZE
+
+
+class IngestLog:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._drain_lock = threading.Lock()
+        self._drain_fd = os.open(path + ".drain", os.O_RDWR | os.O_CREAT, 0o644)
+        new_file = not os.path.exists(path) or os.path.getsize(path) < HEADER_SIZE
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._map = None
+        self.skipped = 0  # Undecodable records passed over by drain()
+        self.on_skip = None  # Called with (record index, reason) for each of them
+        with self._locked():
+            if new_file:
+                os.ftruncate(self._fd, HEADER_SIZE + GROW_RECORDS * RECORD_SIZE)
+                self._remap()
+                self._write_header(0, 0)
+            else:
+                self._remap()
+                magic, version, record_size, _, _ = HEADER.unpack_from(self._map, 0)
+                if magic != MAGIC or version != VERSION or record_size != RECORD_SIZE:
+                    raise ValueError(f"{path} is not a compatible ingest log (drain it with the version that wrote it, then remove it)")
+            self._recover()
+
+    # Locking and mapping
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                # Another process may have grown the file
+                if self._map is not None and os.fstat(self._fd).st_size != len(self._map):
+                    self._remap()
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    @contextmanager
+    def _draining(self):
+        with self._drain_lock:
+            if fcntl is not None:
+                fcntl.flock(self._drain_fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self._drain_fd, fcntl.LOCK_UN)
+
+    def _remap(self):
+        if self._map is not None:
+            self._map.close()
+        self._map = mmap.mmap(self._fd, os.fstat(self._fd).st_size)
+
+    def _capacity(self):
+        return (len(self._map) - HEADER_SIZE) // RECORD_SIZE
+
+    def _read_header(self):
+        _, _, _, write_offset, drain_offset = HEADER.unpack_from(self._map, 0)
+        return write_offset, drain_offset
+
+    def _write_header(self, write_offset, drain_offset):
+        HEADER.pack_into(self._map, 0, MAGIC, VERSION, RECORD_SIZE, write_offset, drain_offset)
+
+    def _slot(self, index):
+        return HEADER_SIZE + index * RECORD_SIZE
+
+    def _intact(self, index):
+        """True if the slot holds a complete record (marker set, CRC matching)."""
+        start = self._slot(index)
+        marker, crc = struct.unpack_from("<B3xI", self._map, start)
+        return marker == RECORD_MARKER and zlib.crc32(self._map[start + 8:start + RECORD_SIZE]) == crc
+
+    def _decode(self, index):
+        """Return (LogRecord, None) for a slot, or (None, reason) if it is empty, corrupt or undecodable."""
+        if not self._intact(index):
+            return None, "corrupt"
+        (_, _, timestamp, farm_length, farm, device_length, device, seq, device_time,
+         *metric_values) = RECORD.unpack_from(self._map, self._slot(index))
+        try:
+            farm_id = farm[:farm_length].decode("utf-8")
+            device_id = device[:device_length].decode("utf-8") or None
+        except UnicodeDecodeError:
+            return None, "undecodable"
+        return LogRecord(
+            timestamp,
+            farm_id,
+            {metric: None if math.isnan(value) else value for metric, value in zip(METRICS, metric_values)},
+            device_id,
+            None if seq < 0 else seq,
+            None if math.isnan(device_time) else device_time,
+        ), None
+
+    def _skip(self, index, reason):
+        self.skipped += 1
+        if self.on_skip is not None:
+            self.on_skip(index, reason)
+
+    def _recover(self):
+        """Account for records written before a crash but after the last header update."""
+        write_offset, drain_offset = self._read_header()
+        while write_offset < self._capacity() and self._intact(write_offset):
+            write_offset += 1
+        self._write_header(write_offset, drain_offset)
+
+    @staticmethod
+    def _encode_id(name, value):
+        encoded = (value or "").encode("utf-8")
+        if len(encoded) > ID_SIZE:
+            raise ValueError(f"{name} is longer than {ID_SIZE} bytes: {value!r}")
+        return encoded
+
+    # Public API
+
+    def append(self, timestamp, farm_id, values, device_id=None, seq=None, device_time=None):
+        """Append one reading ({metric: value}) and return its record index.
+
+        Raises ValueError if farm_id or device_id is longer than ID_SIZE bytes of UTF-8.
+        """
+        metric_values = [math.nan if values.get(metric) is None else float(values[metric]) for metric in METRICS]
+        farm = self._encode_id("farm_id", farm_id)
+        device = self._encode_id("device_id", device_id)
+        body = BODY.pack(
+            timestamp,
+            len(farm), farm,
+            len(device), device,
+            -1 if seq is None else int(seq),
+            math.nan if device_time is None else float(device_time),
+            *metric_values
+        )
+        body += b"\0" * (RECORD_SIZE - 8 - len(body))
+
+        with self._locked():
+            write_offset, drain_offset = self._read_header()
+            if write_offset >= self._capacity():
+                os.ftruncate(self._fd, len(self._map) + GROW_RECORDS * RECORD_SIZE)
+                self._remap()
+            start = self._slot(write_offset)
+            self._map[start + 8:start + RECORD_SIZE] = body
+            struct.pack_into("<B3xI", self._map, start, RECORD_MARKER, zlib.crc32(body))
+            self._write_header(write_offset + 1, drain_offset)
+            return write_offset
+
+    def pending(self):
+        with self._locked():
+            write_offset, drain_offset = self._read_header()
+            return write_offset - drain_offset
+
+    def drain(self, handler, batch_size=1000):
+        """Pass pending records to handler in batches of [LogRecord].
+
+        The drain offset only advances after handler returns, so a failing handler (e.g. the
+        database is down) leaves the records in the log for the next drain. Returns the number
+        of records drained. Corrupt or undecodable records are skipped and counted in `skipped`.
+        """
+        drained = 0
+        # Only one drainer at a time, so records are never replayed twice
+        with self._draining():
+            while True:
+                with self._locked():
+                    write_offset, drain_offset = self._read_header()
+                    if drain_offset >= write_offset:
+                        self._maybe_reset(write_offset, drain_offset)
+                        return drained
+                    end = min(write_offset, drain_offset + batch_size)
+                    decoded = [(i, *self._decode(i)) for i in range(drain_offset, end)]
+
+                batch = [record for _, record, _ in decoded if record is not None]
+
+                # Appends carry on while the handler writes the batch
+                if batch:
+                    handler(batch)
+
+                with self._locked():
+                    # Re-read: appends may have moved the write offset meanwhile
+                    write_offset, _ = self._read_header()
+                    self._write_header(write_offset, end)
+                    self._map.flush(0, mmap.PAGESIZE)
+                # Counted once the drain offset has moved past them, not on every retry
+                for index, record, reason in decoded:
+                    if record is None:
+                        self._skip(index, reason)
+                drained += end - drain_offset
+
+    def _maybe_reset(self, write_offset, drain_offset):
+        """Once everything is drained, start again at the beginning of the file instead of growing it."""
+        if write_offset == 0:
+            return
+        self._map[HEADER_SIZE:HEADER_SIZE + write_offset * RECORD_SIZE] = b"\0" * (write_offset * RECORD_SIZE)
+        self._write_header(0, 0)
+        self._map.flush()
+
+    def flush(self):
+        """Force the mapped pages to disk (the OS does this lazily otherwise)."""
+        with self._locked():
+            self._map.flush()
+
+    def close(self):
+        with self._locked():
+            self._map.flush()
+            self._map.close()
+            self._map = None
+        os.close(self._fd)
+        os.close(self._drain_fd)
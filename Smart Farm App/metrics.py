@@ -0,0 +1,222 @@
+"""Low-overhead Prometheus-style metrics.
+
+Each worker process keeps its own counters, gauges and histograms in memory; nothing is shared
+or locked across processes on the hot path. When SMART_FARM_METRICS_DIR is set, every process
+also dumps its values to <dir>/metrics_<pid>.json (at most once per flush interval), and the
+/metrics endpoint sums the files of all workers into one exposition. Files of processes that no
+longer exist are deleted when they are collected, so the directory must not be shared between
+hosts or containers (PID namespaces).
+"""
+import bisect
+import functools
+import glob
+import inspect
+import json
+import os
+import threading
+import time
+
+
+# Default latency buckets, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_definitions = {}   # name -> (type, help, buckets)
+_values = {}        # (name, labels) -> float, for counters and gauges
+_histograms = {}    # (name, labels) -> [bucket counts..., sum, count]
+_lock = threading.Lock()
+
+_metrics_dir = os.environ.get('SMART_FARM_METRICS_DIR')
+_flush_interval = 1.0
+_last_flush = 0.0
+
+
+def describe(name, metric_type, help_text, buckets=None):
+    """Declare a metric: metric_type is "counter", "gauge" or "histogram"."""
+    _definitions[name] = (metric_type, help_text, tuple(buckets or DEFAULT_BUCKETS) if metric_type == "histogram" else None)
+
+
+def _key(name, labels):
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items())) if labels else ()
+
+
+def inc(name, amount=1.0, **labels):
+    """Increment a counter or gauge."""
+    key = _key(name, labels)
+    with _lock:
+        _values[key] = _values.get(key, 0.0) + amount
+    maybe_flush()
+
+
+def dec(name, amount=1.0, **labels):
+    inc(name, -amount, **labels)
+
+
+def set_value(name, value, **labels):
+    """Set a gauge."""
+    with _lock:
+        _values[_key(name, labels)] = float(value)
+
+
+def observe(name, value, **labels):
+    """Record one observation in a histogram."""
+    buckets = _definitions[name][2]
+    key = _key(name, labels)
+    index = bisect.bisect_left(buckets, value)
+    with _lock:
+        series = _histograms.get(key)
+        if series is None:
+            series = _histograms[key] = [0] * (len(buckets) + 2)
+        if index < len(buckets):
+            series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+    maybe_flush()
+
+
+def timed(histogram, errors=None, **labels):
+    """Decorator observing the duration of each call, and counting the calls that raise.
+
+    Works on coroutine functions too, timing until the coroutine completes.
+    """
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                except Exception:
+                    if errors:
+                        inc(errors, **labels)
+                    raise
+                finally:
+                    observe(histogram, time.perf_counter() - started, **labels)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                if errors:
+                    inc(errors, **labels)
+                raise
+            finally:
+                observe(histogram, time.perf_counter() - started, **labels)
+        return wrapper
+    return decorator
+
+
+def snapshot():
+    """Return this process's metric values in a JSON-serializable form."""
+    with _lock:
+        return {
+            "values": [[name, list(labels), value] for (name, labels), value in _values.items()],
+            "histograms": [[name, list(labels), list(series)] for (name, labels), series in _histograms.items()],
+        }
+
+
+def maybe_flush(force=False):
+    """Write this process's snapshot to the shared metrics directory, if one is configured."""
+    global _last_flush
+    if not _metrics_dir:
+        return
+    now = time.monotonic()
+    if not force and now - _last_flush < _flush_interval:
+        return
+    _last_flush = now
+
+    path = os.path.join(_metrics_dir, f"metrics_{os.getpid()}.json")
+    # Private to this process and thread, so two concurrent flushes never write the same file
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as snapshot_file:
+        json.dump(snapshot(), snapshot_file)
+    os.replace(tmp_path, path)  # Atomic, so readers never see a partial file
+
+
+def _pid_alive(pid):
+    if os.name == "nt":
+        return True  # os.kill would terminate the process there; stale files are only dropped on POSIX
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # Alive, owned by another user
+    return True
+
+
+def collect():
+    """Sum the snapshots of every worker process (or just this one without a metrics directory)."""
+    snapshots = {os.getpid(): snapshot()}
+    if _metrics_dir:
+        maybe_flush(force=True)
+        for path in glob.glob(os.path.join(_metrics_dir, "metrics_*.json")):
+            pid = int(os.path.basename(path)[len("metrics_"):-len(".json")])
+            if pid == os.getpid():
+                continue
+            if not _pid_alive(pid):
+                # A worker that exited or was restarted: its gauges (e.g. in-flight requests) are stale
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            try:
+                with open(path, "r") as snapshot_file:
+                    snapshots[pid] = json.load(snapshot_file)
+            except (OSError, ValueError):
+                continue
+
+    values, histograms = {}, {}
+    for data in snapshots.values():
+        for name, labels, value in data["values"]:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            values[key] = values.get(key, 0.0) + value
+        for name, labels, series in data["histograms"]:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            total = histograms.setdefault(key, [0] * len(series))
+            for i, count in enumerate(series):
+                total[i] += count
+    return values, histograms
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+
+def render():
+    """Render all metrics in the Prometheus text exposition format."""
+    values, histograms = collect()
+    lines = []
+    for name, (metric_type, help_text, buckets) in sorted(_definitions.items()):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        if metric_type == "histogram":
+            for (series_name, labels), series in sorted(histograms.items()):
+                if series_name != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets, series):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {series[-1]}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {series[-2]}")
+                lines.append(f"{name}_count{_format_labels(labels)} {series[-1]}")
+        else:
+            for (series_name, labels), value in sorted(values.items()):
+                if series_name == name:
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    """Forget all recorded values (the metric definitions are kept)."""
+    with _lock:
+        _values.clear()
+        _histograms.clear()
@@ -0,0 +1,70 @@
+from datetime import datetime
+import numpy as np
+import pytz
+
+
+# Sensor metrics stored on every SmartFarmData row
+METRICS = ("temperature", "humidity", "co2", "light_intensity")
+
+DEFAULT_FARM_ID = "default"
+
+# Database timestamps are naive and written in the farm's local time
+LOCAL_TZ = pytz.timezone('Asia/Bangkok')
+
+
+def to_float(value):
+    """Convert a stored metric value (saved as a string) to a float, or None if it is missing/invalid."""
+    if value is None or value == "":
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def to_epoch(dt):
+    """Convert a datetime to Unix seconds, treating naive values as GMT+7 local time."""
+    if dt is None:
+        return None
+    if dt.tzinfo is None:
+        dt = LOCAL_TZ.localize(dt)
+    return dt.timestamp()
+
+
+def from_epoch(ts):
+    """Convert Unix seconds back to a naive GMT+7 datetime, as stored in the database."""
+    return datetime.fromtimestamp(ts, LOCAL_TZ).replace(tzinfo=None)
+
+
+def datetimes_to_epoch(values):
+    """Convert a column of naive GMT+7 datetimes to a float64 array of Unix seconds (NaN for missing)."""
+    if isinstance(values, np.ndarray) and values.dtype.kind == "M":
+        as_datetime64 = values.astype("datetime64[us]")
+    else:
+        as_datetime64 = np.array([np.datetime64("NaT") if value is None else value for value in values], dtype="datetime64[us]")
+    # Asia/Bangkok has a fixed +7h offset, so one subtraction converts the whole column to UTC
+    offset = np.timedelta64(7 * 3600, "s")
+    seconds = (as_datetime64 - offset).astype("datetime64[us]").astype(np.int64) / 1e6
+    seconds[np.isnat(as_datetime64)] = np.nan
+    return seconds
+
+
+def column_to_array(values):
+    """Convert a column of stored metric values to a float64 NumPy array, with NaN for missing/invalid values."""
+    cleaned = [np.nan if value is None or value == "" else value for value in values]
+    try:
+        return np.array(cleaned, dtype=np.float64)
+    except (TypeError, ValueError):
+        # Some values are not numeric: fall back to converting them one by one
+        return np.array([np.nan if (number := to_float(value)) is None else number for value in values], dtype=np.float64)
+
+
+def reading_from_entry(entry):
+    """Build a plain reading dict from a SmartFarmData row, with numeric metric values."""
+    return {
+        "id": entry.id,
+        "farm_id": getattr(entry, "farm_id", None) or DEFAULT_FARM_ID,
+        "device_id": getattr(entry, "device_id", None),
+        "timestamp": to_epoch(entry.updated_time),
+        "values": {metric: to_float(getattr(entry, metric)) for metric in METRICS},
+    }
@@ -0,0 +1,121 @@
+"""Fixed-capacity, columnar in-memory buffer of the most recent readings per farm."""
+import threading
+
+import numpy as np
+
+from readings import METRICS
+
+
+class ReadingRingBuffer:
+    """Circular buffer of readings stored as typed arrays: float64 timestamps, float32 metric values."""
+
+    def __init__(self, capacity, metrics=METRICS):
+        self.capacity = capacity
+        self.metrics = metrics
+        self.timestamps = np.full(capacity, np.nan, dtype=np.float64)
+        self.values = {metric: np.full(capacity, np.nan, dtype=np.float32) for metric in metrics}
+        self.size = 0
+        self.head = 0          # Next slot to write
+        self.in_order = True   # False once a reading arrived older than the newest one
+        self.covered_since = None  # Every reading at or after this time is in the buffer (None: nothing yet)
+
+    def append(self, timestamp, values):
+        if self.size and timestamp < self.timestamps[(self.head - 1) % self.capacity]:
+            self.in_order = False
+
+        if self.covered_since is None:
+            self.covered_since = timestamp
+        overwriting = self.size == self.capacity
+        self.timestamps[self.head] = timestamp
+        for metric in self.metrics:
+            value = values.get(metric)
+            self.values[metric][self.head] = np.nan if value is None else value
+
+        self.head = (self.head + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+        if overwriting:
+            # The oldest reading was dropped: the buffer now only covers what it still holds
+            oldest = self.timestamps[self.head]
+            self.covered_since = oldest if self.covered_since is None else max(self.covered_since, oldest)
+
+    def _ordered_indices(self):
+        start = (self.head - self.size) % self.capacity
+        indices = (start + np.arange(self.size)) % self.capacity
+        if not self.in_order:
+            indices = indices[np.argsort(self.timestamps[indices], kind="stable")]
+        return indices
+
+    def covers(self, start_ts):
+        return self.covered_since is not None and start_ts >= self.covered_since
+
+    def window(self, start_ts, end_ts, metrics=None):
+        """Readings in [start_ts, end_ts), oldest first: (timestamps, {metric: float64 values})."""
+        indices = self._ordered_indices()
+        ts = self.timestamps[indices]
+        lo, hi = np.searchsorted(ts, [start_ts, end_ts], side="left")
+        selected = indices[lo:hi]
+        return self.timestamps[selected], {
+            metric: self.values[metric][selected].astype(np.float64) for metric in (metrics or self.metrics)
+        }
+
+    @property
+    def nbytes(self):
+        return self.timestamps.nbytes + sum(array.nbytes for array in self.values.values())
+
+
+class RecentReadings:
+    """One ReadingRingBuffer per farm, created on first use."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._buffers = {}
+        self._lock = threading.Lock()
+
+    def get(self, farm_id):
+        with self._lock:
+            return self._buffers.get(farm_id)
+
+    def get_or_create(self, farm_id, loader=None, complete_since=None):
+        """Return the farm's buffer; a new buffer is first filled by loader(capacity) -> (timestamps, {metric: values}).
+
+        When the loader returns fewer than capacity readings, it returned every reading since
+        complete_since (if given), so the buffer covers the range from then on.
+        """
+        with self._lock:
+            buffer = self._buffers.get(farm_id)
+            if buffer is not None:
+                return buffer
+
+            buffer = ReadingRingBuffer(self.capacity)
+            if loader is not None:
+                timestamps, columns = loader(self.capacity)
+                for i, timestamp in enumerate(timestamps.tolist()):
+                    buffer.append(timestamp, {metric: columns[metric][i] for metric in columns})
+                # Older rows may still exist elsewhere (e.g. archived), so coverage starts at the oldest loaded one
+                buffer.covered_since = timestamps[0] if len(timestamps) else None
+                if complete_since is not None and len(timestamps) < self.capacity:
+                    buffer.covered_since = complete_since
+            self._buffers[farm_id] = buffer
+            return buffer
+
+    def append(self, farm_id, timestamp, values, loader=None):
+        buffer = self.get_or_create(farm_id, loader)
+        with self._lock:
+            buffer.append(timestamp, values)
+
+    def window(self, farm_id, start_ts, end_ts, metrics=None):
+        """Readings of a farm in [start_ts, end_ts), or None if the buffer does not cover the whole range."""
+        with self._lock:
+            buffer = self._buffers.get(farm_id)
+            if buffer is None or not buffer.covers(start_ts):
+                return None
+            return buffer.window(start_ts, end_ts, metrics)
+
+    def memory_report(self):
+        with self._lock:
+            farms = {
+                farm_id: {"readings": buffer.size, "capacity": buffer.capacity, "bytes": buffer.nbytes}
+                for farm_id, buffer in self._buffers.items()
+            }
+        return {"farms": farms, "total_bytes": sum(farm["bytes"] for farm in farms.values())}
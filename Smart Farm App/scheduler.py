@@ -0,0 +1,239 @@
+"""Periodic ingestion: poll each farm's feed on its own cadence, from exactly one worker.
+
+Each poll reads the feed's history since the last data point ingested (a cursor kept in the
+database by the app), so readings published between polls are not lost, and a new leader
+resumes where the previous one stopped.
+
+Every app worker may run an IngestScheduler, but only the one holding the leader lock polls. The
+lock is a database advisory lock held by a dedicated connection (MySQL GET_LOCK, PostgreSQL
+pg_try_advisory_lock): if the leader's process or connection dies, the lock goes with it and
+another worker takes over at its next attempt. SQLite has no advisory locks, so a lock file next
+to the database is used instead (single host only).
+"""
+import heapq
+import os
+import random
+import threading
+import time
+import zlib
+from contextlib import nullcontext
+
+from sqlalchemy import text
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process use only
+    fcntl = None
+
+
+DEFAULT_SCHEDULE = {"interval": 60.0, "jitter": 0.1, "max_backoff": 600.0, "feed": None}
+
+
+class AdvisoryLock:
+    """Leader lock held by a dedicated database connection for as long as it stays open.
+
+    context returns a context manager the lock queries run in (the app passes app.app_context,
+    as the scheduler thread has none of its own).
+    """
+
+    def __init__(self, engine, name, context=None):
+        self.engine = engine
+        self.name = name
+        self.context = context or nullcontext
+        self._connection = None
+
+    def _query(self, sql, **params):
+        with self.context():
+            result = self._connection.execute(text(sql), params).scalar()
+            self._connection.commit()  # Don't sit in an open transaction between polls
+        return result
+
+    def acquire(self):
+        """Take (or confirm) leadership without waiting; True while it is held."""
+        if self._connection is not None:
+            try:
+                self._query("SELECT 1")
+                return True
+            except Exception:
+                # Connection lost, and the lock with it
+                self._connection.invalidate()
+                self._connection = None
+
+        self._connection = self.engine.connect()
+        try:
+            if self.engine.dialect.name == "postgresql":
+                acquired = self._query("SELECT pg_try_advisory_lock(:key)", key=zlib.crc32(self.name.encode("utf-8")))
+            else:
+                acquired = self._query("SELECT GET_LOCK(:name, 0)", name=self.name) == 1
+        except Exception:
+            self._connection.invalidate()
+            self._connection = None
+            raise
+        if not acquired:
+            self._connection.close()
+            self._connection = None
+        return bool(acquired)
+
+    def release(self):
+        if self._connection is None:
+            return
+        # Pooled connections outlive close(), so unlock explicitly
+        try:
+            if self.engine.dialect.name == "postgresql":
+                self._query("SELECT pg_advisory_unlock(:key)", key=zlib.crc32(self.name.encode("utf-8")))
+            else:
+                self._query("SELECT RELEASE_LOCK(:name)", name=self.name)
+            self._connection.close()
+        except Exception:
+            self._connection.invalidate()
+        self._connection = None
+
+
+class FileLock:
+    """Leader lock for databases without advisory locks: an exclusive flock on a file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    def acquire(self):
+        if self._fd is not None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        if fcntl is not None:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                return False
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._fd is not None:
+            os.close(self._fd)  # Closing the file drops the flock
+            self._fd = None
+
+
+def leader_lock(engine, name, lock_dir, context=None):
+    """The leader lock suited to the engine's database."""
+    if engine.dialect.name in ("mysql", "mariadb", "postgresql"):
+        return AdvisoryLock(engine, name, context)
+    return FileLock(os.path.join(lock_dir, f"{name}.lock"))
+
+
+class FarmSchedule:
+    def __init__(self, farm_id, interval, jitter=0.1, max_backoff=600.0, feed=None):
+        if interval <= 0:
+            raise ValueError(f"Poll interval of farm {farm_id} must be positive")
+        self.farm_id = farm_id
+        self.interval = float(interval)
+        self.jitter = float(jitter)
+        self.max_backoff = max(float(max_backoff), self.interval)
+        self.feed = feed
+        self.failures = 0
+        self.last_success = None
+        self.last_error = None
+
+    def next_delay(self, rng=random):
+        """Seconds until the next poll: the interval, doubled per consecutive failure up to max_backoff, +/- jitter."""
+        delay = min(self.interval * 2 ** self.failures, self.max_backoff)
+        return delay * (1 + rng.uniform(-self.jitter, self.jitter))
+
+    def to_dict(self):
+        return {
+            "farm_id": self.farm_id,
+            "interval": self.interval,
+            "jitter": self.jitter,
+            "max_backoff": self.max_backoff,
+            "feed": self.feed,
+            "failures": self.failures,
+            "last_success": self.last_success,
+            "last_error": self.last_error,
+        }
+
+
+class IngestScheduler:
+    """Runs poll(schedule) -> bool for every farm when it is due, while holding the leader lock.
+
+    Followers retry the lock every leader_retry seconds; the leader re-checks it at least as often.
+    """
+
+    def __init__(self, schedules, poll, lock, leader_retry=15.0, clock=time.time):
+        self.schedules = {schedule.farm_id: schedule for schedule in schedules}
+        self.poll = poll
+        self.lock = lock
+        self.leader_retry = leader_retry
+        self.clock = clock
+        self.is_leader = False
+        self._queue = []  # Heap of (due time, farm_id)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _become_leader(self):
+        # Spread the first polls over a jitter window, so farms don't all fire at once
+        now = self.clock()
+        self._queue = [
+            (now + random.uniform(0, schedule.interval * schedule.jitter), farm_id)
+            for farm_id, schedule in self.schedules.items()
+        ]
+        heapq.heapify(self._queue)
+        self.is_leader = True
+
+    def _check_leadership(self):
+        try:
+            leader = self.lock.acquire()
+        except Exception as e:
+            print(f"Ingest scheduler lock check failed: {str(e)}")
+            leader = False
+        if leader and not self.is_leader:
+            self._become_leader()
+        self.is_leader = leader
+        return leader
+
+    def run_due(self):
+        """Poll every farm that is due now; returns the seconds until the next one is."""
+        while self._queue and self._queue[0][0] <= self.clock():
+            _, farm_id = heapq.heappop(self._queue)
+            schedule = self.schedules[farm_id]
+            try:
+                ok = self.poll(schedule)
+                error = None if ok else "poll failed"
+            except Exception as e:
+                ok, error = False, str(e)
+            if ok:
+                schedule.failures = 0
+                schedule.last_success = self.clock()
+            else:
+                schedule.failures += 1
+                schedule.last_error = error
+            heapq.heappush(self._queue, (self.clock() + schedule.next_delay(), farm_id))
+        return self._queue[0][0] - self.clock() if self._queue else self.leader_retry
+
+    def run(self):
+        try:
+            while not self._stop.is_set():
+                if self._check_leadership():
+                    wait = self.run_due()
+                else:
+                    wait = self.leader_retry * random.uniform(0.5, 1.5)
+                self._stop.wait(max(0.0, min(wait, self.leader_retry)))
+        finally:
+            self.lock.release()
+            self.is_leader = False
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name="ingest-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def status(self):
+        due = {farm_id: due_time for due_time, farm_id in self._queue}
+        return {
+            "leader": self.is_leader,
+            "farms": [dict(schedule.to_dict(), next_run=due.get(farm_id)) for farm_id, schedule in self.schedules.items()],
+        }
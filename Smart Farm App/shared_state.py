@@ -0,0 +1,234 @@
+"""Key/value state shared by all worker processes through one memory-mapped file.
+
+Every worker maps the same file, so the latest readings, actuator states and rate-limit counters
+are the same in all of them without a database round trip.
+
+File layout: a 64-byte header (magic, version, slot count), then a fixed-size hash table of
+512-byte slots, probed linearly from the CRC32 of the key.
+    slot: sequence counter, key length, value length, expiry time, key (64 bytes), JSON value (up to 428 bytes)
+Keys are never removed, so probe chains stay intact; a key written with a ttl reads as missing once
+its expiry time has passed, and its slot is then reused for the next new key that probes past it.
+Keys longer than 64 bytes are stored as their first bytes plus a SHA-1 digest of the whole key.
+Writers serialize on an exclusive flock (where fcntl exists). Readers take no lock: the sequence
+counter is odd while a write is in progress, and a read is retried until it copies a slot whose
+counter was even and unchanged.
+"""
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process use only
+    fcntl = None
+
+
+MAGIC = b"SFSTATE1"
+VERSION = 2
+HEADER = struct.Struct("<8sII")
+HEADER_SIZE = 64
+SLOT = struct.Struct("<QHHd")  # Expiry is a Unix time, 0 for keys that never expire
+SLOT_SIZE = 512
+KEY_SIZE = 64
+DIGEST_SIZE = 40  # Hex SHA-1 that replaces the tail of long keys
+VALUE_OFFSET = SLOT.size + KEY_SIZE
+VALUE_SIZE = SLOT_SIZE - VALUE_OFFSET
+
+
+class StateFullError(Exception):
+    pass
+
+
+class SharedState:
+    def __init__(self, path, slots=4096):
+        self.path = path
+        self._lock = threading.Lock()
+        while True:
+            self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if self._open_locked(slots):
+                    break
+            except BaseException:
+                os.close(self._fd)
+                raise
+            os.close(self._fd)
+
+    def _open_locked(self, slots):
+        """Map the file at self._fd; False if it had to be replaced (or was meanwhile) and must be reopened."""
+        with self._locked_file():
+            # Another process may have replaced the file while this one waited for the lock
+            if os.fstat(self._fd).st_ino != os.stat(self.path).st_ino:
+                return False
+            os.lseek(self._fd, 0, os.SEEK_SET)
+            header = os.read(self._fd, HEADER.size)
+            if len(header) < HEADER.size:
+                # A new, empty file: nobody has it mapped yet
+                self._initialize(self._fd, slots)
+            else:
+                magic, version, stored_slots = HEADER.unpack(header)
+                if magic != MAGIC:
+                    raise ValueError(f"{self.path} is not a shared state file")
+                if version != VERSION:
+                    # The state is all transient: a file written by another version is replaced by
+                    # an empty one. Processes still running the old version keep their mapping of
+                    # the old file (truncating it under them would crash them with SIGBUS).
+                    temp_path = f"{self.path}.{os.getpid()}.tmp"
+                    self._create(temp_path, slots)
+                    os.replace(temp_path, self.path)
+                    return False
+                slots = stored_slots
+            self._map = mmap.mmap(self._fd, 0)
+            self.slots = slots
+            return True
+
+    @staticmethod
+    def _initialize(fd, slots):
+        os.ftruncate(fd, HEADER_SIZE + slots * SLOT_SIZE)
+        os.lseek(fd, 0, os.SEEK_SET)
+        os.write(fd, HEADER.pack(MAGIC, VERSION, slots))
+
+    def _create(self, path, slots):
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            self._initialize(fd, slots)
+        finally:
+            os.close(fd)
+
+    @contextmanager
+    def _locked_file(self):
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    @contextmanager
+    def _locked(self):
+        with self._lock, self._locked_file():
+            yield
+
+    def _offset(self, index):
+        return HEADER_SIZE + index * SLOT_SIZE
+
+    def _read(self, index):
+        """Consistent (key, raw value, expiry time) of a slot, or None if the slot is empty."""
+        start = self._offset(index)
+        while True:
+            seq = SLOT.unpack_from(self._map, start)[0]
+            if seq & 1:
+                time.sleep(0)  # A writer is in the middle of this slot
+                continue
+            data = self._map[start:start + SLOT_SIZE]
+            if SLOT.unpack_from(self._map, start)[0] != seq:
+                continue
+            _, key_length, value_length, expires = SLOT.unpack_from(data, 0)
+            if key_length == 0:
+                return None
+            key = data[SLOT.size:SLOT.size + key_length]
+            return key, data[VALUE_OFFSET:VALUE_OFFSET + value_length], expires
+
+    def _find(self, key_bytes, now=None):
+        """(index, raw value) of the key's live slot, or (index to store it at, None) if it is not stored.
+
+        The index is None when every slot holds a live key.
+        """
+        now = time.time() if now is None else now
+        index = zlib.crc32(key_bytes) % self.slots
+        reusable = None
+        for _ in range(self.slots):
+            slot = self._read(index)
+            if slot is None:
+                return (index if reusable is None else reusable), None
+            expired = 0 < slot[2] <= now
+            if slot[0] == key_bytes:
+                return index, (None if expired else slot[1])
+            if expired and reusable is None:
+                reusable = index
+            index = (index + 1) % self.slots
+        return reusable, None
+
+    def _write(self, index, key_bytes, value_bytes, expires):
+        start = self._offset(index)
+        seq = SLOT.unpack_from(self._map, start)[0]
+        struct.pack_into("<Q", self._map, start, seq + 1)
+        self._map[start + SLOT.size:start + SLOT.size + len(key_bytes)] = key_bytes
+        self._map[start + VALUE_OFFSET:start + VALUE_OFFSET + len(value_bytes)] = value_bytes
+        SLOT.pack_into(self._map, start, seq + 2, len(key_bytes), len(value_bytes), expires)
+
+    @staticmethod
+    def _encode_key(key):
+        key_bytes = key.encode("utf-8")
+        if not key_bytes:
+            raise ValueError("Key must not be empty")
+        if len(key_bytes) > KEY_SIZE:
+            # Keep a readable (and prefix-matchable) head, cut on a character boundary
+            head = key_bytes[:KEY_SIZE - DIGEST_SIZE - 1].decode("utf-8", "ignore").encode("utf-8")
+            key_bytes = head + b"#" + hashlib.sha1(key_bytes).hexdigest().encode("ascii")
+        return key_bytes
+
+    # Public API
+
+    def get(self, key, default=None, now=None):
+        _, raw = self._find(self._encode_key(key), now)
+        return default if raw is None else json.loads(raw)
+
+    def update(self, key, fn, default=None, ttl=None, now=None):
+        """Atomically replace the key's value with fn(current value or default); returns the new value.
+
+        With a ttl (seconds) the key expires that long after this write; without one it never does.
+        """
+        key_bytes = self._encode_key(key)
+        now = time.time() if now is None else now
+        with self._locked():
+            index, raw = self._find(key_bytes, now)
+            if index is None:
+                raise StateFullError(f"All {self.slots} slots of {self.path} are in use")
+            value = fn(default if raw is None else json.loads(raw))
+            value_bytes = json.dumps(value, separators=(",", ":")).encode("utf-8")
+            if len(value_bytes) > VALUE_SIZE:
+                raise ValueError(f"Value of {key!r} is larger than {VALUE_SIZE} bytes")
+            self._write(index, key_bytes, value_bytes, 0.0 if ttl is None else now + ttl)
+            return value
+
+    def set(self, key, value, ttl=None):
+        return self.update(key, lambda _: value, ttl=ttl)
+
+    def incr_window(self, key, window, now=None):
+        """Count a hit in the current fixed window of `window` seconds; returns the count so far.
+
+        The counter expires with its window, so keys such as client addresses don't fill the table.
+        """
+        now = time.time() if now is None else now
+        window_start = int(now // window * window)
+
+        def hit(counter):
+            if counter is None or counter["window"] != window_start:
+                return {"window": window_start, "count": 1}
+            return {"window": window_start, "count": counter["count"] + 1}
+
+        return self.update(key, hit, ttl=window_start + window - now, now=now)["count"]
+
+    def items(self, prefix="", now=None):
+        """{key: value} of every live key starting with prefix (long keys as stored, with their digest)."""
+        found = {}
+        now = time.time() if now is None else now
+        for index in range(self.slots):
+            slot = self._read(index)
+            if slot is not None and not 0 < slot[2] <= now:
+                key = slot[0].decode("utf-8")
+                if key.startswith(prefix):
+                    found[key] = json.loads(slot[1])
+        return found
+
+    def close(self):
+        with self._lock:
+            self._map.close()
+        os.close(self._fd)
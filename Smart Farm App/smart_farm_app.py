@@ -1,4 +1,4 @@
-from flask import Flask, jsonify, request, render_template, url_for, redirect, send_from_directory
+from flask import Flask, Blueprint, current_app, jsonify, request, render_template, url_for, redirect, send_from_directory, Response, stream_with_context, g, has_request_context, has_app_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin, login_user, LoginManager, login_required, logout_user, current_user
 from flask_wtf import FlaskForm
@@ -6,38 +6,318 @@ from wtforms import StringField, PasswordField, SubmitField
 from wtforms.validators import InputRequired, Length, ValidationError
 from flask_bcrypt import Bcrypt
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity, set_access_cookies, unset_jwt_cookies
-from datetime import datetime
+from datetime import datetime, timedelta
+from functools import wraps
+import time
 import pytz
 from flask_cors import CORS
+import click
+from sqlalchemy import event, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, object_session
+from sqlalchemy.engine import Engine
 import json
+import logging
 import os
 from Template import request_message as rq
+from cache import TTLCache
+from conf_cache import ConfigCache, validate_wifi_conf, validate_smf_conf
+from readings import METRICS, DEFAULT_FARM_ID, reading_from_entry, from_epoch, to_epoch, to_float, column_to_array, datetimes_to_epoch
+from timeseries import RESAMPLE_METHODS, make_grid, resample, describe, day_slices
+import numpy as np
+from alerts import AlertEngine, EventStream, ThresholdRule, DEFAULT_THRESHOLDS, OPERATORS
+from climate_control import ClimateController
+import metrics
+from anomaly import StreamingDetector, score_batch, format_flags
+from ring_buffer import RecentReadings
+import archive
+from ingest_log import IngestLog
+from scheduler import DEFAULT_SCHEDULE, FarmSchedule, IngestScheduler, leader_lock
+from shared_state import SharedState, StateFullError, VALUE_SIZE
+from command_queue import (QUEUED, SENT, ACKNOWLEDGED, FAILED, EXPIRED, SUPERSEDED, ACTIVE_STATES,
+                           SAFETY_PRIORITY, NORMAL_PRIORITY, ANY_DEVICE, retry_delay, plan_dispatch)
+import threading
+import uuid
+
+
+DEFAULT_SLOW_QUERY_THRESHOLD_MS = 100.0
+query_profile = {"slow_query_threshold_ms": DEFAULT_SLOW_QUERY_THRESHOLD_MS}
+logger = logging.getLogger(__name__)
+
+# Extensions are bound to the app in create_app; nothing connects to the database until first use
+db = SQLAlchemy()
+bcrypt = Bcrypt()
+jwt = JWTManager()  # Initialize JWT Manager
 
 
-app = Flask(__name__)
-CORS(app)
+# Login Manager Setup (Although we are using JWT, we still need this for user-related features like logout)
+login_manager = LoginManager()
+login_manager.login_view = 'smart_farm.login'
+
+# Routes, request hooks and CLI commands (flask migrate, archive, dedupe, poll, dispatch)
+bp = Blueprint('smart_farm', __name__, cli_group=None)
+
+
+def create_app(config=None):
+    """Build the Flask app. Creating it does no database or network I/O; run `flask migrate` to create the tables."""
+    app = Flask(__name__)
+    CORS(app)
+
+    # Unified Database Configuration
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('SMART_FARM_DATABASE_URI', 'mysql+mysqlconnector://root:@localhost/smart_farm_app')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SECRET_KEY'] = 'thisisasecretkey'
+
+    # Stateless JWT auth: protected routes only verify the token signature, no session or database lookup
+    app.config['JWT_STATELESS_AUTH'] = os.environ.get('SMART_FARM_JWT_STATELESS', '1') == '1'
+    app.config['USER_CACHE_TTL'] = int(os.environ.get('SMART_FARM_USER_CACHE_TTL', '300'))
+    app.config['USER_CACHE_SIZE'] = int(os.environ.get('SMART_FARM_USER_CACHE_SIZE', '1024'))
+
+    # Automatic climate control drives the actuators from ingested readings (off unless enabled)
+    app.config['CLIMATE_CONTROL_ENABLED'] = os.environ.get('SMART_FARM_CLIMATE_CONTROL', '0') == '1'
+
+    # Query profiling: log statements slower than the threshold, and (in debug mode, or when enabled)
+    # report the per-request query count and database time in X-DB-Query-Count / X-DB-Query-Time-Ms
+    app.config['SLOW_QUERY_THRESHOLD_MS'] = float(os.environ.get('SMART_FARM_SLOW_QUERY_MS', DEFAULT_SLOW_QUERY_THRESHOLD_MS))
+    app.config['QUERY_PROFILE_HEADERS'] = os.environ.get('SMART_FARM_QUERY_PROFILE_HEADERS', '0') == '1'
+
+    # Readings kept in memory per farm for recent-window queries (8640 = 12 hours at one reading per 5 s).
+    # The buffer only sees readings this process saves, so it is used only when this process is the
+    # single writer: one worker, with no separate poll or drain process
+    app.config['RING_BUFFER_CAPACITY'] = int(os.environ.get('SMART_FARM_RING_BUFFER_CAPACITY', '8640'))
+    app.config['RING_BUFFER_ENABLED'] = os.environ.get('SMART_FARM_SINGLE_WRITER', '0') == '1'
+
+    # Seconds after its end before a /data_statistics range is cached (must cover the ingest and backfill lag)
+    app.config['STATISTICS_CACHE_MIN_AGE'] = float(os.environ.get('SMART_FARM_STATISTICS_CACHE_MIN_AGE', '3600'))
+
+    # Cold history: whole months older than ARCHIVE_AFTER_DAYS move from the database to Parquet files
+    app.config['ARCHIVE_DIR'] = os.environ.get('SMART_FARM_ARCHIVE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'archive'))
+    app.config['ARCHIVE_AFTER_DAYS'] = int(os.environ.get('SMART_FARM_ARCHIVE_AFTER_DAYS', '90'))
+
+    # Fetched readings are appended to a memory-mapped log first, then drained into the database in bulk
+    app.config['INGEST_LOG_PATH'] = os.environ.get('SMART_FARM_INGEST_LOG', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ingest.log'))
+    app.config['INGEST_DRAIN_INTERVAL'] = float(os.environ.get('SMART_FARM_INGEST_DRAIN_INTERVAL', '5'))
+
+    # Periodic ingestion (0 disables it: data is then only fetched on refresh)
+    app.config['INGEST_POLL_INTERVAL'] = float(os.environ.get('SMART_FARM_INGEST_POLL_INTERVAL', '0'))
+    app.config['INGEST_POLL_JITTER'] = float(os.environ.get('SMART_FARM_INGEST_POLL_JITTER', '0.1'))
+    app.config['INGEST_POLL_MAX_BACKOFF'] = float(os.environ.get('SMART_FARM_INGEST_POLL_MAX_BACKOFF', '600'))
+    # Per-farm overrides, e.g. {"farm-a": {"interval": 30, "feed": "farm-a-out"}}
+    app.config['INGEST_FARMS'] = json.loads(os.environ.get('SMART_FARM_INGEST_FARMS', '{}'))
+
+    # State shared by all worker processes (latest readings, actuator states, rate limits) in a memory-mapped file
+    app.config['SHARED_STATE_PATH'] = os.environ.get('SMART_FARM_SHARED_STATE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'shared_state.bin'))
+    app.config['SHARED_STATE_SLOTS'] = int(os.environ.get('SMART_FARM_SHARED_STATE_SLOTS', '4096'))
+    # Failed and successful logins allowed per client address and minute (0 disables the limit)
+    app.config['LOGIN_RATE_LIMIT'] = int(os.environ.get('SMART_FARM_LOGIN_RATE_LIMIT', '10'))
+
+    # Actuator command queue: seconds between dispatcher passes (0 disables the dispatcher in this
+    # process), resends until a device acknowledges, and how long a command stays valid
+    app.config['COMMAND_DISPATCH_INTERVAL'] = float(os.environ.get('SMART_FARM_COMMAND_DISPATCH_INTERVAL', '1'))
+    app.config['COMMAND_MAX_ATTEMPTS'] = int(os.environ.get('SMART_FARM_COMMAND_MAX_ATTEMPTS', '5'))
+    app.config['COMMAND_RETRY_DELAY'] = float(os.environ.get('SMART_FARM_COMMAND_RETRY_DELAY', '10'))
+    app.config['COMMAND_RETRY_MAX_DELAY'] = float(os.environ.get('SMART_FARM_COMMAND_RETRY_MAX_DELAY', '60'))
+    app.config['COMMAND_TTL'] = float(os.environ.get('SMART_FARM_COMMAND_TTL', '300'))
+    # Minimum seconds between state feed fetches while commands wait for an acknowledgement
+    app.config['COMMAND_ACK_POLL_INTERVAL'] = float(os.environ.get('SMART_FARM_COMMAND_ACK_POLL_INTERVAL', '5'))
+
+    if config:
+        app.config.update(config)
+
+    # Queries outside an app context (e.g. the scheduler's leader lock) fall back to this app's threshold
+    query_profile["slow_query_threshold_ms"] = app.config['SLOW_QUERY_THRESHOLD_MS']
+
+    db.init_app(app)
+    bcrypt.init_app(app)
+    jwt.init_app(app)
+    login_manager.init_app(app)
+    app.register_blueprint(bp)
+    return app
+
+
+# Metrics: per-route latency, in-flight requests, database and message broker calls, ingestion
+metrics.describe("sf_http_request_duration_seconds", "histogram", "HTTP request latency by route, method and status.")
+metrics.describe("sf_http_requests_in_flight", "gauge", "HTTP requests currently being served.")
+metrics.describe("sf_db_queries_total", "counter", "SQL statements executed.")
+metrics.describe("sf_db_query_duration_seconds", "histogram", "SQL statement execution time.")
+metrics.describe("sf_broker_call_duration_seconds", "histogram", "Message broker call latency by call.")
+metrics.describe("sf_broker_errors_total", "counter", "Message broker calls that raised, by call.")
+metrics.describe("sf_rows_ingested_total", "counter", "Sensor readings saved to the database (rate() gives rows per second).")
+metrics.describe("sf_broker_budget_events_total", "counter", "Adafruit IO request budget decisions (granted, rejected, merged, throttled) by priority.")
+metrics.describe("sf_broker_budget_wait_seconds", "histogram", "Time broker calls waited for request budget.")
+metrics.describe("sf_broker_cache_reads_total", "counter", "Broker feed reads by feed and cache outcome (hit, shared in-flight request, miss).")
+metrics.describe("sf_shared_state_fallbacks_total", "counter", "Shared state writes kept per process instead, by error (table full, value too large).")
+metrics.describe("sf_actuator_state_reports_total", "counter", "Actuator state reports from devices that updated the state cache.")
+metrics.describe("sf_commands_total", "counter", "Actuator commands by command and lifecycle state reached.")
+metrics.describe("sf_command_sends_total", "counter", "Actuator command sends to the broker by command and result.")
+metrics.describe("sf_command_ack_seconds", "histogram", "Time from the first send of a command to its acknowledgement by a device.")
+metrics.describe("sf_ingest_log_skipped_total", "counter", "Ingest log records the drain skipped because they could not be decoded, by reason.")
+metrics.describe("sf_duplicate_readings_total", "counter", "Readings dropped because their (device, seq) was already stored.")
+metrics.describe("sf_ring_buffer_bytes", "gauge", "Memory used by the in-memory buffers of recent readings.")
+metrics.describe("sf_ring_buffer_hits_total", "counter", "Range queries answered from the recent readings buffer.")
+
+
+@bp.before_app_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    g.response_status = 500  # Replaced in after_request unless the view raised
+    metrics.inc("sf_http_requests_in_flight")
+
+
+@bp.after_app_request
+def record_response_status(response):
+    g.response_status = response.status_code
+    if current_app.debug or current_app.config['QUERY_PROFILE_HEADERS']:
+        response.headers['X-DB-Query-Count'] = str(g.get("query_count", 0))
+        response.headers['X-DB-Query-Time-Ms'] = f"{g.get('query_time', 0.0) * 1000:.2f}"
+    return response
+
 
+@bp.teardown_app_request
+def finish_request_metrics(exc):
+    started = g.pop("request_started", None)
+    if started is None:
+        return
+    metrics.dec("sf_http_requests_in_flight")
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    metrics.observe("sf_http_request_duration_seconds", time.perf_counter() - started,
+                    route=route, method=request.method, status=g.get("response_status", 500))
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def parameter_shape(parameters, executemany):
+    """Describe bound parameters by type only, so slow-query logs never contain the values."""
+    if executemany:
+        rows = list(parameters or [])
+        return f"{len(rows)} x {parameter_shape(rows[0], False)}" if rows else "[]"
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(f"{key}: {type(value).__name__}" for key, value in parameters.items()) + "}"
+    if isinstance(parameters, (list, tuple)):
+        return "(" + ", ".join(type(value).__name__ for value in parameters) + ")"
+    return type(parameters).__name__
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def record_query_metrics(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_started"].pop()
+    elapsed = time.perf_counter() - started
+    metrics.inc("sf_db_queries_total")
+    metrics.observe("sf_db_query_duration_seconds", elapsed)
+
+    # Per-request totals, to spot routes issuing many queries
+    if has_request_context():
+        g.query_count = g.get("query_count", 0) + 1
+        g.query_time = g.get("query_time", 0.0) + elapsed
+
+    # The listener runs for every engine, also in threads without an app context
+    if has_app_context():
+        threshold, log = current_app.config['SLOW_QUERY_THRESHOLD_MS'], current_app.logger
+    else:
+        threshold, log = query_profile["slow_query_threshold_ms"], logger
+    if elapsed * 1000 >= threshold:
+        route = request.path if has_request_context() else "-"
+        log.warning(
+            "Slow query (%.1f ms, route %s): %s -- params %s",
+            elapsed * 1000, route, " ".join(statement.split()), parameter_shape(parameters, executemany)
+        )
 
-# Unified Database Configuration
-app.config['SQLALCHEMY_DATABASE_URI'] = 'mysql+mysqlconnector://root:@localhost/smart_farm_app'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SECRET_KEY'] = 'thisisasecretkey'
 
-db = SQLAlchemy(app)
-bcrypt = Bcrypt(app)
-jwt = JWTManager(app)  # Initialize JWT Manager
+# Time every message broker call
+for _call in ("sf_send", "sf_recv_from_sfout", "sf_recv_from_wfout", "sf_recv_from_stout",
+              "sf_send_async", "sf_recv_from_sfout_async", "sf_recv_from_wfout_async", "sf_recv_from_stout_async"):
+    if hasattr(rq, _call):
+        setattr(rq, _call, metrics.timed("sf_broker_call_duration_seconds", "sf_broker_errors_total", call=_call.replace("_async", ""))(getattr(rq, _call)))
 
 
-# Login Manager Setup (Although we are using JWT, we still need this for user-related features like logout)
-login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = 'login'
+def record_budget_event(event, priority, wait):
+    metrics.inc("sf_broker_budget_events_total", event=event, priority=priority or "all")
+    if event == "granted" and wait > 0:
+        metrics.observe("sf_broker_budget_wait_seconds", wait, priority=priority)
+
+
+def record_feed_cache_event(event, feed):
+    metrics.inc("sf_broker_cache_reads_total", event=event, feed=feed)
+
+
+# In-process broker stand-ins (benchmarks/fake_broker.py) have no request budget or feed cache
+if hasattr(rq, "budget"):
+    rq.budget.on_event = record_budget_event
+    rq.feed_cache.on_event = record_feed_cache_event
+
+
+# In-process cache of user records, so repeated requests don't hit the database (created on first use)
+user_cache = None
+
+
+def get_user_cache():
+    global user_cache
+    if user_cache is None:
+        user_cache = TTLCache(maxsize=current_app.config['USER_CACHE_SIZE'], ttl=current_app.config['USER_CACHE_TTL'])
+    return user_cache
+
+
+class CachedUser(UserMixin):
+    """Detached, read-only copy of a User row that is safe to share between requests."""
+
+    def __init__(self, id, username):
+        self.id = id
+        self.username = username
+
+
+# Bumped in the shared state whenever a user changes, so every worker drops its cached users
+USERS_VERSION_KEY = "users:version"
+users_version = None  # Version the users in this process's cache were loaded at
+
+
+def get_cached_user(user_id):
+    """Return the user with the given ID from the cache, loading it from the database on a miss."""
+    global users_version
+    # Read the version first, so a change committed while loading clears the cache again
+    version = read_state(USERS_VERSION_KEY, 0)
+    if version != users_version:
+        get_user_cache().clear()
+        users_version = version
+
+    user = get_user_cache().get(user_id)
+    if user is None:
+        record = User.query.get(user_id)
+        if record is None:
+            return None
+        user = CachedUser(record.id, record.username)
+        get_user_cache().set(user_id, user)
+    return user
 
 
 # User Authentication Models and Forms
 @login_manager.user_loader # Call back user objects from the user ID
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return get_cached_user(int(user_id))
+
+
+# Resolve the JWT identity from the user ID claim, served from the cache
+@jwt.user_lookup_loader
+def user_lookup_callback(_jwt_header, jwt_data):
+    user_id = jwt_data.get("uid")
+    return get_cached_user(user_id) if user_id is not None else None
+
+
+def auth_required(session_fallback=False):
+    """Protect a route with a JWT in stateless mode, or with the login session (if requested) otherwise."""
+    def decorator(fn):
+        jwt_view = jwt_required()(fn)
+        session_view = login_required(fn) if session_fallback else fn
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if current_app.config['JWT_STATELESS_AUTH']:
+                return jwt_view(*args, **kwargs)
+            return session_view(*args, **kwargs)
+        return wrapper
+    return decorator
 
 
 # Flask WTForms
@@ -71,52 +351,763 @@ class User(db.Model, UserMixin):
     password = db.Column(db.String(80), nullable=False)
 
 
+# Updating or deleting a user through the ORM (bulk query updates and raw SQL are not seen) drops
+# the cached users in every worker once the change is committed
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def note_user_changed(mapper, connection, target):
+    object_session(target).info["users_changed"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def invalidate_changed_users(session):
+    if session.info.pop("users_changed", False):
+        users_changed()
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def forget_changed_users(session, previous_transaction):
+    session.info.pop("users_changed", None)
+
+
+def users_changed():
+    """Make every worker reload users from the database on their next lookup."""
+    update_state(USERS_VERSION_KEY, lambda version: version + 1, 0)
+
+
 # Smart Farm Data Model
 class SmartFarmData(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    farm_id = db.Column(db.String(50), nullable=False, default=DEFAULT_FARM_ID, index=True)
     updated_time = db.Column(db.DateTime, default=gmt7_now)
     co2 = db.Column(db.String(50), nullable=True)
     temperature = db.Column(db.String(50), nullable=True)
     humidity = db.Column(db.String(50), nullable=True)
     light_intensity = db.Column(db.String(50), nullable=True)
+    anomaly = db.Column(db.String(200), nullable=True)  # "metric:reason,..." for quarantined values
+    device_id = db.Column(db.String(32), nullable=True)
+    seq = db.Column(db.BigInteger, nullable=True)       # Device-side sequence number
+    device_time = db.Column(db.Float, nullable=True)    # Device clock (Unix seconds) when the reading was taken
+
+    # Each device reading is stored once; rows without a sequence number (NULL) are not constrained
+    __table_args__ = (db.UniqueConstraint('device_id', 'seq', name='uq_smart_farm_data_device_seq'),)
+
+
+# Position of the scheduled poll in each broker feed's history: the newest data point ingested
+class FeedCursor(db.Model):
+    feed = db.Column(db.String(128), primary_key=True)
+    created_epoch = db.Column(db.Float, nullable=False)
+    data_id = db.Column(db.String(64), nullable=False)
+
+
+# Parsed wifi_conf.json / smf_conf.json payloads, re-read only when the files change
+conf_cache = ConfigCache()
+
+
+# Threshold rule for server-side alerting
+class AlertRule(db.Model):
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    farm_id = db.Column(db.String(50), nullable=False, default=DEFAULT_FARM_ID, index=True)
+    metric = db.Column(db.String(50), nullable=False)
+    operator = db.Column(db.String(10), nullable=False, default="above")
+    threshold = db.Column(db.Float, nullable=False)
+    hysteresis = db.Column(db.Float, nullable=False, default=0.0)
+    min_duration = db.Column(db.Float, nullable=False, default=0.0)  # Seconds the breach must last
+    enabled = db.Column(db.Boolean, nullable=False, default=True)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "farm_id": self.farm_id,
+            "metric": self.metric,
+            "operator": self.operator,
+            "threshold": self.threshold,
+            "hysteresis": self.hysteresis,
+            "min_duration": self.min_duration,
+            "enabled": self.enabled,
+        }
+
+
+# Alert raised or cleared by a threshold rule
+class Alert(db.Model):
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    rule_id = db.Column(db.Integer, db.ForeignKey('alert_rule.id', ondelete='SET NULL'), nullable=True, index=True)
+    farm_id = db.Column(db.String(50), nullable=False, index=True)
+    metric = db.Column(db.String(50), nullable=False)
+    state = db.Column(db.String(10), nullable=False)  # "raised" or "cleared"
+    value = db.Column(db.Float, nullable=True)
+    threshold = db.Column(db.Float, nullable=True)
+    created_time = db.Column(db.DateTime, default=gmt7_now, index=True)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "rule_id": self.rule_id,
+            "farm_id": self.farm_id,
+            "metric": self.metric,
+            "state": self.state,
+            "value": self.value,
+            "threshold": self.threshold,
+            "created_time": self.created_time.strftime("%Y-%m-%d %H:%M:%S") if self.created_time else None,
+        }
+
+
+# Actuator command queued for the dispatcher (see command_queue.py); times are Unix seconds
+class ActuatorCommand(db.Model):
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    command_id = db.Column(db.String(32), nullable=False, unique=True)
+    device_id = db.Column(db.String(32), nullable=False, default=ANY_DEVICE)
+    name = db.Column(db.String(20), nullable=False)  # Key of ACTUATOR_COMMANDS
+    priority = db.Column(db.Integer, nullable=False, default=NORMAL_PRIORITY)
+    status = db.Column(db.String(12), nullable=False, default=QUEUED, index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.String(200), nullable=True)
+    created_time = db.Column(db.Float, nullable=False)
+    first_sent_time = db.Column(db.Float, nullable=True)
+    last_sent_time = db.Column(db.Float, nullable=True)
+    acknowledged_time = db.Column(db.Float, nullable=True)
+    finished_time = db.Column(db.Float, nullable=True)
+    next_attempt_time = db.Column(db.Float, nullable=False)  # Send (or resend) no earlier than this
+    expires_time = db.Column(db.Float, nullable=False)
+
+    @property
+    def actuator(self):
+        return ACTUATOR_COMMANDS[self.name][3]
+
+    def to_dict(self):
+        def elapsed_ms(start, end):
+            return None if start is None or end is None else round((end - start) * 1000, 1)
+
+        return {
+            "command_id": self.command_id,
+            "device_id": self.device_id,
+            "command": self.name,
+            "priority": self.priority,
+            "status": self.status,
+            "attempts": self.attempts,
+            "error": self.error,
+            "created_time": self.created_time,
+            "first_sent_time": self.first_sent_time,
+            "last_sent_time": self.last_sent_time,
+            "acknowledged_time": self.acknowledged_time,
+            "finished_time": self.finished_time,
+            "expires_time": self.expires_time,
+            "timings_ms": {
+                "queued": elapsed_ms(self.created_time, self.first_sent_time),
+                "acknowledgement": elapsed_ms(self.first_sent_time, self.acknowledged_time),
+                "total": elapsed_ms(self.created_time, self.finished_time),
+            },
+        }
+
+
+def upgrade_table(model):
+    """Add the columns, indexes and unique constraints of model that its existing table lacks.
+
+    create_all() only creates missing tables, so a database from an earlier release also needs
+    this, e.g. for SmartFarmData's farm_id, anomaly, device_id, seq and device_time columns and
+    its (device_id, seq) unique constraint (created as a unique index).
+    """
+    table = model.__table__
+    inspector = db.inspect(db.engine)
+    if not inspector.has_table(table.name):
+        return
+    dialect = db.engine.dialect
+    columns = {column["name"] for column in inspector.get_columns(table.name)}
+    indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+    indexes.update(constraint["name"] for constraint in inspector.get_unique_constraints(table.name))
+
+    with db.engine.begin() as connection:
+        for column in table.columns:
+            if column.name in columns:
+                continue
+            ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect)}"
+            if not column.nullable and column.default is not None and column.default.is_scalar:
+                # Existing rows need a value for a NOT NULL column
+                default = db.literal(column.default.arg).compile(dialect=dialect, compile_kwargs={"literal_binds": True})
+                ddl += f" DEFAULT {default} NOT NULL"
+            connection.execute(db.text(ddl))
+            print(f"Added column {table.name}.{column.name}")
+        for index in table.indexes:
+            if index.name not in indexes:
+                index.create(connection)
+                print(f"Added index {index.name}")
+        for constraint in table.constraints:
+            if isinstance(constraint, db.UniqueConstraint) and constraint.name not in indexes:
+                names = ", ".join(column.name for column in constraint.columns)
+                connection.execute(db.text(f"CREATE UNIQUE INDEX {constraint.name} ON {table.name} ({names})"))
+                print(f"Added unique index {constraint.name}")
 
 
 # Set up database function
 def setup_database():
-    """Initializes the database."""
+    """Initializes the database, or upgrades one from an earlier release (needs an app context)."""
+    db.create_all()
+    upgrade_table(SmartFarmData)
+
+    # Seed the default alert rules (the thresholds the dashboard pages used) on first run
+    if AlertRule.query.count() == 0:
+        for metric, threshold in DEFAULT_THRESHOLDS.items():
+            db.session.add(AlertRule(farm_id=DEFAULT_FARM_ID, metric=metric, operator="above", threshold=threshold))
+        db.session.commit()
+
+
+@bp.cli.command("migrate")
+def migrate_command():
+    """Create the database tables (or add the columns an earlier release lacks) and seed the default alert rules."""
+    setup_database()
+    click.echo("Database is up to date")
+
+
+# Ingestion hooks: callbacks run with each reading right after it is saved to the database
+ingest_listeners = []
+
+
+def register_ingest_listener(listener=None, first=False):
+    """Register a callback taking a reading dict (see readings.reading_from_entry).
+
+    Listeners registered with first=True run before the others, e.g. to quarantine bad values.
+    """
+    def register(fn):
+        if first:
+            ingest_listeners.insert(0, fn)
+        else:
+            ingest_listeners.append(fn)
+        return fn
+    return register(listener) if listener is not None else register
+
+
+def notify_ingest(entries):
+    """Pass freshly committed SmartFarmData rows to every ingestion listener."""
+    metrics.inc("sf_rows_ingested_total", len(entries))
+    for entry in entries:
+        reading = reading_from_entry(entry)
+        for listener in ingest_listeners:
+            # A failing listener must never make ingestion itself fail
+            try:
+                listener(reading)
+            except Exception as e:
+                print(f"Ingest listener {listener.__name__} failed: {str(e)}")
+
+
+# Streaming anomaly detection: runs first, so later listeners never see quarantined values
+anomaly_detector = StreamingDetector()
+
+
+@register_ingest_listener(first=True)
+def detect_anomalies(reading):
+    flags = anomaly_detector.score(reading["farm_id"], reading["values"], reading.get("device_id"))
+    if not flags:
+        return
+
+    reading["anomalies"] = flags
+    # The row keeps the raw values; listeners that mirror the database use raw_values
+    reading["raw_values"] = dict(reading["values"])
+    for metric in flags:
+        reading["values"][metric] = None
+
+    SmartFarmData.query.filter_by(id=reading["id"]).update({"anomaly": format_flags(flags)})
+    db.session.commit()
+
+
+# Columnar in-memory buffer of recent readings per farm, so recent-window queries skip the database
+recent_readings = None
+
+
+def get_recent_readings():
+    global recent_readings
+    if recent_readings is None:
+        recent_readings = RecentReadings(current_app.config['RING_BUFFER_CAPACITY'])
+    return recent_readings
+
+
+def load_latest_columns(farm_id, limit):
+    """Load the newest limit readings of a farm, oldest first, as columnar arrays."""
+    rows = (
+        SmartFarmData.query
+        .with_entities(SmartFarmData.updated_time, *[getattr(SmartFarmData, metric) for metric in METRICS])
+        .filter(SmartFarmData.farm_id == farm_id)
+        .order_by(SmartFarmData.updated_time.desc())
+        .limit(limit)
+        .all()
+    )[::-1]
+    if not rows:
+        return np.empty(0), {metric: np.empty(0) for metric in METRICS}
+
+    columns = list(zip(*rows))
+    return datetimes_to_epoch(columns[0]), {metric: column_to_array(columns[i + 1]) for i, metric in enumerate(METRICS)}
+
+
+def get_recent_buffer(farm_id):
+    """Return the farm's recent readings buffer, filling it from the database on first use."""
+    buffers = get_recent_readings()
+    buffer = buffers.get(farm_id)
+    if buffer is None:
+        # Only whole months older than ARCHIVE_AFTER_DAYS leave the database, so a fill with room to spare holds
+        # every reading since then
+        complete_since = time.time() - current_app.config['ARCHIVE_AFTER_DAYS'] * 86400
+        buffer = buffers.get_or_create(farm_id, loader=lambda capacity: load_latest_columns(farm_id, capacity),
+                                       complete_since=complete_since)
+        metrics.set_value("sf_ring_buffer_bytes", buffers.memory_report()["total_bytes"])
+    return buffer
+
+
+@register_ingest_listener
+def buffer_recent_reading(reading):
+    if not current_app.config['RING_BUFFER_ENABLED']:
+        return
+    if get_recent_readings().get(reading["farm_id"]) is None:
+        # The first fill loads this reading from the database along with the older ones
+        get_recent_buffer(reading["farm_id"])
+        return
+    # Same values as the stored row (and as a fill from the database), quarantined or not
+    get_recent_readings().append(reading["farm_id"], reading["timestamp"], reading.get("raw_values", reading["values"]))
+
+
+# State shared across worker processes, so every worker answers the same without a database round trip
+shared_state = None
+shared_state_lock = threading.Lock()
+
+
+def get_shared_state():
+    global shared_state
+    if shared_state is None:
+        with shared_state_lock:
+            if shared_state is None:
+                shared_state = SharedState(current_app.config['SHARED_STATE_PATH'], current_app.config['SHARED_STATE_SLOTS'])
+    return shared_state
+
+
+# Per-process stand-in for keys the shared state can't take (every slot live, or a value too large)
+local_state = TTLCache(maxsize=4096, ttl=3600)
+local_state_lock = threading.Lock()
+local_state_keys = set()  # Keys already reported as kept per process
+
+
+def update_state(key, fn, default=None, ttl=None):
+    """SharedState.update, falling back to this process's own copy if the shared table can't hold the key."""
+    try:
+        return get_shared_state().update(key, fn, default, ttl=ttl)
+    except (StateFullError, ValueError) as e:
+        metrics.inc("sf_shared_state_fallbacks_total", error=type(e).__name__)
+        with local_state_lock:
+            if key not in local_state_keys:
+                local_state_keys.add(key)
+                print(f"Shared state can't hold {key!r} ({str(e)}); other workers won't see it")
+            value = fn(local_state.get(key, default))
+            local_state.set(key, value, ttl)
+            return value
+
+
+def read_state(key, default=None):
+    value = get_shared_state().get(key)
+    return local_state.get(key, default) if value is None else value
+
+
+@register_ingest_listener
+def share_latest_reading(reading):
+    latest = {key: reading[key] for key in ("farm_id", "device_id", "timestamp", "values")}
+    for key in filter(None, ("latest:farm:" + reading["farm_id"], reading["device_id"] and "latest:device:" + reading["device_id"])):
+        # Readings may be drained out of order; keep the newest
+        update_state(key, lambda current: latest if current is None or current["timestamp"] <= latest["timestamp"] else current)
+
+
+def share_broker_budget(app):
+    """Make every worker draw Adafruit IO requests from one token bucket, kept in the shared state file."""
+    if not hasattr(rq, "budget"):
+        return
     with app.app_context():
-        db.create_all()   
-        
+        state = get_shared_state()
+    rq.budget.store = lambda fn: state.update("broker_budget", fn)
+
+
+def rate_limited(key, limit, window=60):
+    """Count a hit for key; True once more than limit hits fall in the current window (shared by all workers)."""
+    if limit <= 0:
+        return False
+    try:
+        count = get_shared_state().incr_window("rate:" + key, window)
+    except (StateFullError, ValueError) as e:
+        # Count in this process only: the limit then applies per worker
+        metrics.inc("sf_shared_state_fallbacks_total", error=type(e).__name__)
+        local_key = ("rate", key, int(time.time() // window))
+        with local_state_lock:
+            count = local_state.get(local_key, 0) + 1
+            local_state.set(local_key, count, window)
+    return count > limit
+
+
+def export_json(file_name, data):
+    """Write data to a JSON file atomically, so concurrent workers never leave a torn or mixed file."""
+    tmp_path = f"{file_name}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as json_file:
+        json.dump(data, json_file, indent=4)
+    os.replace(tmp_path, file_name)
+
+
+# Memory-mapped ingest log, so readings survive database outages and restarts
+ingest_log = None
+ingest_log_lock = threading.Lock()
+
+
+def get_ingest_log():
+    global ingest_log
+    with ingest_log_lock:
+        if ingest_log is None:
+            ingest_log = IngestLog(current_app.config['INGEST_LOG_PATH'])
+            ingest_log.on_skip = record_skipped_log_record
+        return ingest_log
+
+
+def record_skipped_log_record(index, reason):
+    print(f"Skipped {reason} ingest log record {index}")
+    metrics.inc("sf_ingest_log_skipped_total", reason=reason)
+
+
+def reading_id_error(farm_id, device_id):
+    """Why a reading's IDs can't be stored (longer than their database columns), or None."""
+    for name, value in (("farm_id", farm_id), ("device_id", device_id)):
+        if value is not None and len(value) > SmartFarmData.__table__.c[name].type.length:
+            return f"{name} is longer than {SmartFarmData.__table__.c[name].type.length} characters"
+    return None
+
+
+def format_metric(value):
+    """Format a logged metric value the way readings are stored in the database."""
+    return None if value is None else f"{value:g}"
+
+
+def reading_time(record):
+    """updated_time of a logged reading.
+
+    Readings without a sequence number are identified by (farm_id, updated_time), so their time is
+    kept to the second, the resolution a MySQL DATETIME column stores.
+    """
+    if record.device_id and record.seq is not None:
+        return from_epoch(record.timestamp)
+    return from_epoch(int(record.timestamp))
+
+
+def reading_key(record):
+    """(device_id, seq) of a reading, or (farm_id, updated_time) if it has no sequence number."""
+    if record.device_id and record.seq is not None:
+        return (record.device_id, record.seq)
+    return (record.farm_id, reading_time(record))
+
+
+def drop_duplicate_readings(batch):
+    """Remove records whose key (see reading_key) is already stored, or repeated within the batch."""
+    seqs_by_device = {}
+    times_by_farm = {}
+    for record in batch:
+        if record.device_id and record.seq is not None:
+            seqs_by_device.setdefault(record.device_id, set()).add(record.seq)
+        else:
+            times_by_farm.setdefault(record.farm_id, set()).add(reading_time(record))
+
+    # One query per device and per farm in the batch (usually just one)
+    seen = set()
+    for device_id, seqs in seqs_by_device.items():
+        stored = SmartFarmData.query.with_entities(SmartFarmData.seq).filter(
+            SmartFarmData.device_id == device_id, SmartFarmData.seq.in_(seqs)
+        )
+        seen.update((device_id, seq) for (seq,) in stored)
+    for farm_id, times in times_by_farm.items():
+        stored = SmartFarmData.query.with_entities(SmartFarmData.updated_time).filter(
+            SmartFarmData.farm_id == farm_id, SmartFarmData.seq.is_(None), SmartFarmData.updated_time.in_(times)
+        )
+        seen.update((farm_id, updated_time) for (updated_time,) in stored)
+
+    unique = []
+    for record in batch:
+        key = reading_key(record)
+        if key in seen:
+            continue
+        seen.add(key)
+        unique.append(record)
+
+    if len(unique) < len(batch):
+        metrics.inc("sf_duplicate_readings_total", len(batch) - len(unique))
+    return unique
+
+
+# Attempts at a batch insert that keeps colliding with readings other workers store concurrently
+SAVE_ATTEMPTS = 3
+
+
+def save_logged_readings(batch):
+    """Insert a batch of ingest log records into the database in one transaction.
+
+    Readings that carry a device sequence number are stored at most once per (device_id, seq),
+    readings without one at most once per (farm_id, updated_time). If another worker stores some
+    of the same readings meanwhile, the insert is retried without them, so every reading that is
+    saved also reaches the ingest listeners. Returns the number of readings inserted.
+    """
+    for attempt in range(SAVE_ATTEMPTS):
+        batch = drop_duplicate_readings(batch)
+        if not batch:
+            return 0
+
+        entries = [
+            SmartFarmData(
+                farm_id=record.farm_id,
+                updated_time=reading_time(record),
+                device_id=record.device_id,
+                seq=record.seq,
+                device_time=record.device_time,
+                **{metric: format_metric(record.values[metric]) for metric in METRICS}
+            )
+            for record in batch
+        ]
+        try:
+            db.session.add_all(entries)
+            db.session.commit()
+        except IntegrityError:
+            # Another worker stored some of these readings meanwhile: drop them and insert the rest
+            db.session.rollback()
+            if attempt == SAVE_ATTEMPTS - 1:
+                raise
+            continue
+        except Exception:
+            db.session.rollback()
+            raise
+        notify_ingest(entries)
+        return len(entries)
+
+
+def drain_ingest_log():
+    """Replay pending ingest log records into the database.
+
+    Returns (inserted, skipped): how many readings were saved and how many were dropped as duplicates.
+    """
+    counts = [0, 0]
+
+    def save(batch):
+        inserted = save_logged_readings(batch)
+        counts[0] += inserted
+        counts[1] += len(batch) - inserted
+
+    get_ingest_log().drain(save)
+    return tuple(counts)
+
+
+def run_ingest_drainer(app):
+    while True:
+        time.sleep(app.config['INGEST_DRAIN_INTERVAL'])
+        try:
+            with app.app_context():
+                drain_ingest_log()
+        except Exception as e:
+            print(f"Ingest log drain failed, will retry: {str(e)}")
+
+
+def start_ingest_drainer(app):
+    """Replay what a previous run left in the ingest log, then keep draining it in the background."""
+    with app.app_context():
+        try:
+            drain_ingest_log()
+        except Exception as e:
+            print(f"Ingest log replay failed, will retry: {str(e)}")
+    if app.config['INGEST_DRAIN_INTERVAL'] > 0:
+        threading.Thread(target=run_ingest_drainer, args=(app,), name="ingest-drainer", daemon=True).start()
+
+
+def remove_duplicate_runs(dry_run=False, chunk_size=10000):
+    """Delete rows that repeat the previous row of the same farm, as left by re-polling the broker.
+
+    Rows with a device sequence number are only duplicates of a row with the same sequence number.
+    Returns the number of duplicate rows found.
+    """
+    columns_wanted = [SmartFarmData.id, SmartFarmData.farm_id, SmartFarmData.device_id, SmartFarmData.seq] + [getattr(SmartFarmData, metric) for metric in METRICS]
+    previous = {}  # farm_id -> key of the last row kept
+    duplicate_ids = []
+    last_id = 0
+
+    # Walk the table in id order, one chunk at a time
+    while True:
+        rows = SmartFarmData.query.with_entities(*columns_wanted).filter(SmartFarmData.id > last_id).order_by(SmartFarmData.id).limit(chunk_size).all()
+        if not rows:
+            break
+        for row in rows:
+            key = tuple(row[2:])
+            if previous.get(row.farm_id) == key:
+                duplicate_ids.append(row.id)
+            else:
+                previous[row.farm_id] = key
+        last_id = rows[-1].id
+
+    if not dry_run:
+        for offset in range(0, len(duplicate_ids), 1000):
+            SmartFarmData.query.filter(SmartFarmData.id.in_(duplicate_ids[offset:offset + 1000])).delete(synchronize_session=False)
+            db.session.commit()
+    return len(duplicate_ids)
+
+
+@bp.cli.command("dedupe")
+@click.option("--dry-run", is_flag=True, help="Only count the duplicate rows.")
+def dedupe_command(dry_run):
+    """Remove runs of duplicate SmartFarmData rows."""
+    count = remove_duplicate_runs(dry_run=dry_run)
+    click.echo(f"{count} duplicate rows {'found' if dry_run else 'removed'}")
+
+
+# Parquet archive of cold history
+
+def next_month(dt):
+    return dt.replace(year=dt.year + dt.month // 12, month=dt.month % 12 + 1, day=1)
+
+
+def archive_cold_data(older_than_days=None):
+    """Move the rows of every month that ended more than older_than_days ago into the Parquet archive."""
+    days = current_app.config['ARCHIVE_AFTER_DAYS'] if older_than_days is None else older_than_days
+    cutoff = gmt7_now().replace(tzinfo=None) - timedelta(days=days)
+    # Only whole months are archived
+    boundary = cutoff.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    root = current_app.config['ARCHIVE_DIR']
+    columns_wanted = [SmartFarmData.id, SmartFarmData.updated_time] + [getattr(SmartFarmData, metric) for metric in METRICS] + [SmartFarmData.anomaly]
+
+    summary = []
+    farm_ids = [farm_id for (farm_id,) in db.session.query(SmartFarmData.farm_id).filter(SmartFarmData.updated_time < boundary).distinct()]
+    for farm_id in farm_ids:
+        oldest = db.session.query(func.min(SmartFarmData.updated_time)).filter(SmartFarmData.farm_id == farm_id).scalar()
+        month_start = oldest.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+        while month_start < boundary:
+            month_end = next_month(month_start)
+            in_month = (
+                SmartFarmData.farm_id == farm_id,
+                SmartFarmData.updated_time >= month_start,
+                SmartFarmData.updated_time < month_end,
+            )
+            rows = SmartFarmData.query.with_entities(*columns_wanted).filter(*in_month).order_by(SmartFarmData.id).all()
+            if rows:
+                columns = list(zip(*rows))
+                archive.write_month(root, farm_id, month_start.year, month_start.month, {
+                    "id": columns[0],
+                    "updated_time": columns[1],
+                    **{metric: column_to_array(columns[i + 2]) for i, metric in enumerate(METRICS)},
+                    "anomaly": columns[-1],
+                })
+
+                # The file is safely on disk: drop exactly the archived rows from the database
+                SmartFarmData.query.filter(*in_month, SmartFarmData.id <= columns[0][-1]).delete(synchronize_session=False)
+                db.session.commit()
+                summary.append({"farm_id": farm_id, "month": month_start.strftime("%Y-%m"), "rows": len(rows)})
+            month_start = month_end
+
+    return summary
+
+
+@bp.cli.command("archive")
+@click.option("--older-than-days", type=int, default=None, help="Archive months that ended before this many days ago.")
+def archive_command(older_than_days):
+    """Move cold SmartFarmData months to the Parquet archive."""
+    for item in archive_cold_data(older_than_days):
+        click.echo(f"{item['farm_id']} {item['month']}: {item['rows']} rows archived")
+
+
+def load_archived_columns(farm_id, start, end, metrics_wanted=METRICS):
+    """Archived readings of a farm in [start, end) as columnar arrays, or None if nothing is archived there."""
+    archived = archive.read_range(current_app.config['ARCHIVE_DIR'], farm_id, start, end, ("updated_time",) + tuple(metrics_wanted))
+    if archived["updated_time"].size == 0:
+        return None
+    return datetimes_to_epoch(archived["updated_time"]), {metric: archived[metric] for metric in metrics_wanted}
+
+
+# Server-side threshold alerting
+alert_engine = AlertEngine()
+alert_stream = EventStream()
+# Every change to the rules bumps a version in the shared state; each worker reloads its engine
+# when the version differs from the one it loaded (None: not loaded yet)
+ALERT_RULES_VERSION_KEY = "alert_rules:version"
+alert_rules_version = None
+
+
+def reload_alert_rules(version=None):
+    """Load the enabled rules from the database into the alert engine."""
+    global alert_rules_version
+    # Read the version first, so a change committed while loading triggers another reload
+    version = read_state(ALERT_RULES_VERSION_KEY, 0) if version is None else version
+    rules = [
+        ThresholdRule(rule.id, rule.farm_id, rule.metric, rule.operator, rule.threshold, rule.hysteresis, rule.min_duration)
+        for rule in AlertRule.query.filter_by(enabled=True).all()
+    ]
+    alert_engine.load_rules(rules)
+    alert_rules_version = version
+
+
+def alert_rules_changed():
+    """Make every worker reload the rules before its next evaluation, this one right away."""
+    update_state(ALERT_RULES_VERSION_KEY, lambda version: version + 1, 0)
+    reload_alert_rules()
+
+
+@register_ingest_listener
+def evaluate_alerts(reading):
+    """Evaluate a reading against the alert rules, storing and streaming any alert it triggers."""
+    version = read_state(ALERT_RULES_VERSION_KEY, 0)
+    if version != alert_rules_version:
+        reload_alert_rules(version)
+
+    events = alert_engine.evaluate(reading["farm_id"], reading["timestamp"], reading["values"])
+    if not events:
+        return
+
+    for event in events:
+        db.session.add(Alert(
+            rule_id=event["rule_id"],
+            farm_id=event["farm_id"],
+            metric=event["metric"],
+            state=event["state"],
+            value=event["value"],
+            threshold=event["threshold"],
+            created_time=from_epoch(event["timestamp"])
+        ))
+    db.session.commit()
+
+    for event in events:
+        alert_stream.publish(event)
+
 
 
 # Send request messages to Message broker functions
 
-def request_wifi_change():
-    """Send a request message to the message broker to change Wi-Fi credentials, including the wifi_conf.json file contents."""
+def send_config_file(file_name, msg_key, success_message, validator):
+    """Publish the contents of a config file next to this script to the message broker under msg_key.
+
+    The file is parsed and checked with validator once per change (keyed on mtime and size), and
+    the publish is skipped when the content matches the last version any worker sent successfully.
+    """
     # Get the absolute path to the current script's directory
     script_dir = os.path.dirname(os.path.abspath(__file__))
-    conf_file_path = os.path.join(script_dir, "wifi_conf.json")
+    conf_file_path = os.path.join(script_dir, file_name)
 
-    # Check if the wifi_conf.json file exists
-    if not os.path.exists(conf_file_path):
+    # Read and validate the file (served from the cache while it is unchanged)
+    try:
+        conf_data, digest = conf_cache.load(conf_file_path, validator)
+    except FileNotFoundError:
         return {
             "status": "error",
-            "message": "wifi_conf.json file not found."
+            "message": f"{file_name} file not found."
         }, 404
-
-    # Read Wi-Fi credentials from the wifi_conf.json file
-    try:
-        with open(conf_file_path, "r") as conf_file:
-            wifi_credentials = json.load(conf_file)
     except Exception as e:
         return {
             "status": "error",
-            "message": f"Failed to read wifi_conf.json: {str(e)}"
+            "message": f"Failed to read {file_name}: {str(e)}"
         }, 500
 
+    # Nothing to do if the device already received this exact content
+    sent_key = "config_sent:" + file_name
+    if read_state(sent_key) == digest:
+        return {
+            "status": "success",
+            "message": f"{file_name} is unchanged since the last request, nothing sent.",
+            "sent": False,
+            msg_key: conf_data
+        }, 200
+
     # Prepare the message for the message broker
     msg = {
-        "wifi_credentials": wifi_credentials  # Include the file's contents
+        msg_key: conf_data  # Include the file's contents
     }
 
     # Send the message to the message broker
@@ -128,140 +1119,407 @@ def request_wifi_change():
             "message": f"Failed to send message to the message broker: {str(e)}"
         }, 500
 
+    update_state(sent_key, lambda current: digest)
+
     return {
         "status": "success",
-        "message": "Wi-Fi change request sent successfully, including wifi_conf.json contents.",
-        "wifi_credentials": wifi_credentials
+        "message": success_message,
+        "sent": True,
+        msg_key: conf_data
     }, 200
 
 
+def request_wifi_change():
+    """Send a request message to the message broker to change Wi-Fi credentials, including the wifi_conf.json file contents."""
+    return send_config_file(
+        "wifi_conf.json",
+        "wifi_credentials",
+        "Wi-Fi change request sent successfully, including wifi_conf.json contents.",
+        validate_wifi_conf
+    )
+
+
 def request_environmental_change():
     """Send a request message to the message broker to change the environmental condition, including the smf_conf.json file contents."""
-    # Get the absolute path to the current script's directory
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    conf_file_path = os.path.join(script_dir, "smf_conf.json")
-
-    # Check if the smf_conf.json file exists
-    if not os.path.exists(conf_file_path):
-        return {
-            "status": "error",
-            "message": "smf_conf.json file not found."
-        }, 404
+    return send_config_file(
+        "smf_conf.json",
+        "smf_conf",
+        "Environmental condition change request sent successfully, including smf_conf.json contents.",
+        validate_smf_conf
+    )
 
-    # Read environmental settings from the smf_conf.json file
-    try:
-        with open(conf_file_path, "r") as conf_file:
-            smf_conf = json.load(conf_file)
-    except Exception as e:
-        return {
-            "status": "error",
-            "message": f"Failed to read smf_conf.json: {str(e)}"
-        }, 500
 
-    # Prepare the message for the message broker
-    msg = {
-        "smf_conf": smf_conf  
+# Actuator commands: name -> (broker message, success message, action for the error message, actuator, state)
+ACTUATOR_COMMANDS = {
+    "open_window": ("win_open", "Open window successfully!", "open window", "window", "open"),
+    "close_window": ("win_close", "Close window successfully!", "close window", "window", "closed"),
+    "light_on": ("light_open", "Turn light on successfully!", "turn light on", "light", "on"),
+    "light_off": ("light_close", "Turn light off successfully!", "turn light off", "light", "off"),
+    "open_fan": ("fan_open", "Open fan successfully!", "open fan", "fan", "on"),
+    "close_fan": ("fan_close", "Close fan successfully!", "close fan", "fan", "off"),
+}
+ACTUATORS = ("fan", "window", "light")
+
+
+MAX_TRACKED_DEVICES = 16
+
+
+def track_device(device_ids, device_id):
+    """device_ids with device_id moved last (most recent), keeping as many of the newest as fit one shared state value."""
+    device_ids = ([i for i in device_ids if i != device_id] + [device_id])[-MAX_TRACKED_DEVICES:]
+    while len(device_ids) > 1 and len(json.dumps(device_ids, separators=(",", ":")).encode("utf-8")) > VALUE_SIZE:
+        device_ids = device_ids[1:]
+    return device_ids
+
+
+def record_actuator_command(name):
+    """Remember the state an actuator was last commanded to, for every worker (pending until a device reports it)."""
+    actuator, state = ACTUATOR_COMMANDS[name][3:]
+    commanded = {"state": state, "command": name, "time": time.time()}
+    update_state("commanded:" + actuator, lambda _: commanded)
+
+
+def state_report_is_newer(report, current):
+    if current is None:
+        return True
+    # Seq (boot count << 32 | counter) orders reports across reboots, unlike the device clock
+    if report["seq"] is not None and current["seq"] is not None:
+        return report["seq"] > current["seq"]
+    return report["received_at"] >= current["received_at"]
+
+
+def apply_state_report(report):
+    """Cache a device's actuator state report ({"Device", "State", "Seq", "Time"}) unless a newer one is cached.
+
+    Device reports are the authoritative actuator states. Returns True if the cache was updated.
+    """
+    device_id = report.get("Device")
+    reported = report.get("State")
+    if not device_id or not isinstance(reported, dict):
+        return False
+    entry = {
+        "state": {actuator: reported.get(actuator) for actuator in ACTUATORS},
+        "seq": report.get("Seq"),
+        "device_time": report.get("Time"),
+        "received_at": time.time(),
+        "cause": report.get("Cause"),
     }
+    stored = update_state("device_state:" + device_id, lambda current: entry if state_report_is_newer(entry, current) else current)
+    if stored is not entry:
+        return False
+    # Most recently reporting devices last
+    update_state("devices", lambda device_ids: track_device(device_ids, device_id), default=[])
+    metrics.inc("sf_actuator_state_reports_total")
+    return True
 
-    # Send the message to the message broker
-    try:
-        rq.sf_send(topic=rq.IN_CHANNEL, msg=msg)
-    except Exception as e:
-        return {
-            "status": "error",
-            "message": f"Failed to send message to the message broker: {str(e)}"
-        }, 500
 
-    return {
-        "status": "success",
-        "message": "Environmental condition change request sent successfully, including smf_conf.json contents.",
-        "smf_conf": smf_conf
-    }, 200
+def apply_state_message(message):
+    """Apply a state report as received from the broker (JSON text); True if the cache was updated."""
+    return bool(message) and apply_state_report(json.loads(message))
 
 
-def open_smart_farm_window():
+def retrieve_actuator_states():
+    """Fetch the newest state report from the broker into the cache."""
     try:
-        rq.sf_send(topic=rq.IN_CHANNEL, msg="win_open")
-        return {
-            "status": "success",
-            "message": "Open window successfully!"
-        }
+        updated = apply_state_message(rq.sf_recv_from_stout(topic=rq.STATE_CHANNEL))
     except Exception as e:
         return {
             "status": "error",
-            "message": f"Failed to open window: {str(e)}"
+            "message": f"Failed to retrieve actuator states: {str(e)}"
         }
+    return {
+        "status": "success",
+        "updated": updated
+    }
 
 
-def close_smart_farm_window():
-    try:
-        rq.sf_send(topic=rq.IN_CHANNEL, msg="win_close")
-        return {
-            "status": "success",
-            "message": "Close window successfully!"
-        }
-    except Exception as e:
-        return {
-            "status": "error",
-            "message": f"Failed to close window: {str(e)}"
-        }
-    
+def device_reports():
+    """{device_id: last state report} of the devices tracked in the state cache."""
+    devices = {device_id: read_state("device_state:" + device_id) for device_id in read_state("devices", [])}
+    return {device_id: report for device_id, report in devices.items() if report is not None}
 
-def light_on():
-    try:
-        rq.sf_send(topic=rq.IN_CHANNEL, msg="light_open")
-        return {
-            "status": "success",
-            "message": "Turn light on successfully!"
-        }
-    except Exception as e:
-        return {
-            "status": "error",
-            "message": f"Failed to turn light on: {str(e)}"
-        }
-    
 
-def light_off():
-    try:
-        rq.sf_send(topic=rq.IN_CHANNEL, msg="light_close")
-        return {
-            "status": "success",
-            "message": "Turn light off successfully!"
+def latest_report(reports):
+    return max(reports.values(), key=lambda report: report["received_at"]) if reports else None
+
+
+def actuator_states():
+    """Cached states, without any device round trip: ({actuator: summary}, {device_id: last report}).
+
+    Each actuator summary has the newest reported state, the last command sent, and whether that
+    command is still pending (not yet reported back by a device).
+    """
+    devices = device_reports()
+    latest = latest_report(devices)
+
+    actuators = {}
+    for actuator in ACTUATORS:
+        commanded = read_state("commanded:" + actuator)
+        reported = latest["state"].get(actuator) if latest else None
+        confirmed = latest is not None and commanded is not None and reported == commanded["state"] and latest["received_at"] >= commanded["time"]
+        actuators[actuator] = {
+            "state": reported,
+            "commanded": commanded,
+            "pending": commanded is not None and not confirmed,
         }
-    except Exception as e:
+    return actuators, devices
+
+
+def actuator_response(name, error=None):
+    _, success_message, action = ACTUATOR_COMMANDS[name][:3]
+    if error is not None:
         return {
             "status": "error",
-            "message": f"Failed to turn light off: {str(e)}"
+            "message": f"Failed to {action}: {str(error)}"
         }
+    return {
+        "status": "success",
+        "message": success_message
+    }
 
 
-def open_smart_farm_fan():
+def send_actuator_command(name):
     try:
-        rq.sf_send(topic=rq.IN_CHANNEL, msg="fan_open")
-        return {
-            "status": "success",
-            "message": "Open fan successfully!"
-        }
+        rq.sf_send(topic=rq.IN_CHANNEL, msg=ACTUATOR_COMMANDS[name][0])
     except Exception as e:
-        return {
-            "status": "error",
-            "message": f"Failed to open fan: {str(e)}"
-        }
+        return actuator_response(name, e)
+    record_actuator_command(name)
+    return actuator_response(name)
+
+
+# Safety commands overtake the others in the queue (there is no heater on this prototype)
+COMMAND_PRIORITIES = {"close_window": SAFETY_PRIORITY}
+
+
+def enqueue_actuator_command(name, device_id=ANY_DEVICE, priority=None):
+    """Store a command for the dispatcher and wake it up; returns the ActuatorCommand."""
+    now = time.time()
+    # A newer command for the same actuator makes the pending ones moot (open then close = close)
+    actuator = ACTUATOR_COMMANDS[name][3]
+    same_actuator = [other for other, command in ACTUATOR_COMMANDS.items() if command[3] == actuator]
+    pending = ActuatorCommand.query.filter(ActuatorCommand.device_id == device_id,
+                                           ActuatorCommand.name.in_(same_actuator),
+                                           ActuatorCommand.status.in_(ACTIVE_STATES)).all()
+    for command in pending:
+        command.status = SUPERSEDED
+        command.finished_time = now
+        metrics.inc("sf_commands_total", command=command.name, status=SUPERSEDED)
+
+    command = ActuatorCommand(
+        command_id=uuid.uuid4().hex,
+        device_id=device_id,
+        name=name,
+        priority=COMMAND_PRIORITIES.get(name, NORMAL_PRIORITY) if priority is None else priority,
+        status=QUEUED,
+        created_time=now,
+        next_attempt_time=now,
+        expires_time=now + current_app.config['COMMAND_TTL'],
+    )
+    db.session.add(command)
+    db.session.commit()
+    metrics.inc("sf_commands_total", command=name, status=QUEUED)
+    command_dispatch_wakeup.set()
+    return command
 
 
-def close_smart_farm_fan():
+def queue_actuator_command(name, device_id=ANY_DEVICE):
+    """Queue an actuator command; the response carries its id and where to poll its status."""
     try:
-        rq.sf_send(topic=rq.IN_CHANNEL, msg="fan_close")
-        return {
-            "status": "success",
-            "message": "Close fan successfully!"
-        }
+        command = enqueue_actuator_command(name, device_id)
     except Exception as e:
-        return {
-            "status": "error",
-            "message": f"Failed to close fan: {str(e)}"
-        }
-    
+        db.session.rollback()
+        return actuator_response(name, e)
+    return {
+        "status": "accepted",
+        "message": f"Request to {ACTUATOR_COMMANDS[name][2]} queued",
+        "command": command.to_dict(),
+        "status_url": f"/commands/{command.command_id}",
+    }
+
+
+def open_smart_farm_window(device_id=ANY_DEVICE):
+    return queue_actuator_command("open_window", device_id)
+
+
+def close_smart_farm_window(device_id=ANY_DEVICE):
+    return queue_actuator_command("close_window", device_id)
+
+
+def light_on(device_id=ANY_DEVICE):
+    return queue_actuator_command("light_on", device_id)
+
+
+def light_off(device_id=ANY_DEVICE):
+    return queue_actuator_command("light_off", device_id)
+
+
+def open_smart_farm_fan(device_id=ANY_DEVICE):
+    return queue_actuator_command("open_fan", device_id)
+
+
+def close_smart_farm_fan(device_id=ANY_DEVICE):
+    return queue_actuator_command("close_fan", device_id)
+
+
+# Dispatcher: sends queued commands and tracks them until a device reports the commanded state
+command_dispatch_wakeup = threading.Event()
+last_ack_poll = 0.0
+
+
+def command_acknowledgement(command, reports):
+    """Time of the state report confirming the command, or None if no device confirmed it yet."""
+    report = latest_report(reports) if command.device_id == ANY_DEVICE else reports.get(command.device_id)
+    if report is None or command.first_sent_time is None or report["received_at"] < command.first_sent_time:
+        return None
+    actuator, state = ACTUATOR_COMMANDS[command.name][3:]
+    return report["received_at"] if report["state"].get(actuator) == state else None
+
+
+def transition_command(command, seen, **values):
+    """Update the command unless it changed since it was seen as (status, attempts); True if this worker did."""
+    status, attempts = seen
+    updated = ActuatorCommand.query.filter_by(id=command.id, status=status, attempts=attempts) \
+        .update(values, synchronize_session=False)
+    db.session.commit()
+    return updated == 1
+
+
+def finish_command(command, seen, status, finished_time, **values):
+    if transition_command(command, seen, status=status, finished_time=finished_time, **values):
+        metrics.inc("sf_commands_total", command=command.name, status=status)
+        return True
+    return False
+
+
+def dispatch_commands():
+    """One dispatcher pass (needs an app context): acknowledge, expire, fail and send commands.
+
+    Returns the number of commands sent. Safe to run in several workers at once: each change is a
+    conditional update, so only one worker sends a given attempt of a command.
+    """
+    global last_ack_poll
+    config = current_app.config
+    active = ActuatorCommand.query.filter(ActuatorCommand.status.in_(ACTIVE_STATES)).all()
+    if not active:
+        return 0
+
+    # Commits reload the rows, so compare-and-set against the state they were loaded in
+    seen = {command.id: (command.status, command.attempts) for command in active}
+    now = time.time()
+    if any(status == SENT for status, _ in seen.values()) and now - last_ack_poll >= config['COMMAND_ACK_POLL_INTERVAL']:
+        last_ack_poll = now
+        retrieve_actuator_states()
+    reports = device_reports()
+    pending = []
+    for command in active:
+        acknowledged_time = command_acknowledgement(command, reports) if seen[command.id][0] == SENT else None
+        if acknowledged_time is None:
+            pending.append(command)
+        elif finish_command(command, seen[command.id], ACKNOWLEDGED, acknowledged_time, acknowledged_time=acknowledged_time):
+            metrics.observe("sf_command_ack_seconds", acknowledged_time - command.first_sent_time)
+
+    sent = 0
+    for action, command in plan_dispatch(pending, now, config['COMMAND_MAX_ATTEMPTS']):
+        if action == "expire":
+            finish_command(command, seen[command.id], EXPIRED, now)
+        elif action == "fail":
+            finish_command(command, seen[command.id], FAILED, now, error=f"Not acknowledged after {command.attempts} attempts")
+        else:
+            attempts = seen[command.id][1] + 1
+            next_attempt = now + retry_delay(attempts, config['COMMAND_RETRY_DELAY'], config['COMMAND_RETRY_MAX_DELAY'])
+            if not transition_command(command, seen[command.id], status=SENT, attempts=attempts, last_sent_time=now,
+                                      next_attempt_time=next_attempt, first_sent_time=command.first_sent_time or now):
+                continue
+            result = send_actuator_command(command.name)
+            metrics.inc("sf_command_sends_total", command=command.name, result=result["status"])
+            if result["status"] == "error":
+                # Retried at next_attempt like an unacknowledged send
+                ActuatorCommand.query.filter_by(id=command.id).update({"error": result["message"][:200]}, synchronize_session=False)
+                db.session.commit()
+            sent += 1
+    return sent
+
+
+def run_command_dispatcher(app):
+    while True:
+        command_dispatch_wakeup.wait(app.config['COMMAND_DISPATCH_INTERVAL'])
+        command_dispatch_wakeup.clear()
+        try:
+            with app.app_context():
+                dispatch_commands()
+        except Exception as e:
+            print(f"Command dispatch failed, will retry: {str(e)}")
+
+
+def start_command_dispatcher(app):
+    if app.config['COMMAND_DISPATCH_INTERVAL'] > 0:
+        threading.Thread(target=run_command_dispatcher, args=(app,), name="command-dispatcher", daemon=True).start()
+
+
+@bp.cli.command("dispatch")
+@click.option("--once", is_flag=True, help="Run a single dispatcher pass.")
+def dispatch_command(once):
+    """Run the actuator command dispatcher in the foreground (e.g. as a sidecar process)."""
+    if once:
+        click.echo(f"Sent {dispatch_commands()} command(s)")
+        return
+    run_command_dispatcher(current_app._get_current_object())
+
+
+# Closed-loop climate control, driving the actuator functions above from each ingested reading.
+# Every farm gets its own controller, so one farm's readings never switch another farm's actuators.
+CLIMATE_ACTIONS = {
+    "fan": (open_smart_farm_fan, close_smart_farm_fan),
+    "window": (open_smart_farm_window, close_smart_farm_window),
+    "light": (light_on, light_off),
+}
+climate_controllers = {}  # farm_id -> ClimateController
+climate_setpoints = {}  # Settings posted for all farms, applied on top of the defaults
+climate_controllers_lock = threading.Lock()
+
+
+def get_climate_controller(farm_id):
+    with climate_controllers_lock:
+        controller = climate_controllers.get(farm_id)
+        if controller is None:
+            controller = ClimateController(CLIMATE_ACTIONS)
+            controller.configure(climate_setpoints)
+            climate_controllers[farm_id] = controller
+        return controller
+
+
+def configure_climate_control(setpoints, farm_id=None):
+    """Update the setpoints of one farm, or of every farm (including those not seen yet)."""
+    if farm_id is not None:
+        get_climate_controller(farm_id).configure(setpoints)
+        return
+    # Check the settings on a scratch controller first, so bad input changes no farm
+    ClimateController(CLIMATE_ACTIONS).configure(setpoints)
+    with climate_controllers_lock:
+        for name, conf in setpoints.items():
+            climate_setpoints.setdefault(name, {}).update(conf)
+        for controller in climate_controllers.values():
+            controller.configure(setpoints)
+
+
+def climate_control_state(farm_id=None):
+    if farm_id is not None:
+        return get_climate_controller(farm_id).state()
+    with climate_controllers_lock:
+        controllers = dict(climate_controllers)
+    return {farm: controller.state() for farm, controller in controllers.items()}
+
+
+@register_ingest_listener
+def run_climate_control(reading):
+    if not current_app.config['CLIMATE_CONTROL_ENABLED']:
+        return
+    controller = get_climate_controller(reading["farm_id"])
+    device_id = reading.get("device_id") or ANY_DEVICE
+    for command in controller.process(reading["timestamp"], reading["values"], device_id):
+        print(f"Climate control: {reading['farm_id']} {command['actuator']} {command['command']} "
+              f"({command['metric']}={command['value']})")
+
 
 
 # Receive request messages from Message broker functions
@@ -273,7 +1531,11 @@ def request_wifi_info():
 
     # Request the Wi-Fi information from the wfout channel in the broker
     wifi_info = rq.sf_recv_from_wfout(topic=rq.WIFI_CHANNEL)  # Assuming the feed storing Wi-Fi data is called 'wifi_info'
+    return save_wifi_info(wifi_info)
 
+
+def save_wifi_info(wifi_info):
+    """Parse the Wi-Fi information received from the broker and save it to a JSON file."""
     # Check if the Wi-Fi data was received
     if wifi_info:
         # Convert JSON string to Python object
@@ -289,8 +1551,7 @@ def request_wifi_info():
         print(f"Current Wi-Fi Information: {wifi_data}")
         
         # Save to a JSON file
-        with open('current_wifi_info.json', 'w') as f:
-            json.dump(wifi_data, f, indent=4)
+        export_json('current_wifi_info.json', wifi_data)
         
         return {
             "status": "success",
@@ -304,117 +1565,290 @@ def request_wifi_info():
         }
     
 
-def retrieve_and_save_smart_farm_data():
-    """Retrieve data from the message broker, save it to the database, and export it to a JSON file."""
+def retrieve_and_save_smart_farm_data(topic=None, farm_id=None):
+    """Retrieve data from the message broker, save it to the database, and export it to a JSON file.
+
+    farm_id is used for readings that don't name their farm.
+    """
     try:
         # Retrieve data from the broker
-        broker_data = rq.sf_recv_from_sfout(topic=rq.OUT_CHANNEL)  # Assuming "smart_farm_data" is the broker topic/feed
-        
+        topic = topic or rq.OUT_CHANNEL
+        broker_data = rq.sf_recv_from_sfout(topic=topic)
+    except Exception as e:
+        return {
+            "status": "error",
+            "message": f"An error occurred: {str(e)}"
+        }
+    # Re-polling the same data point gives the same timestamp, so readings without Seq are not saved twice
+    return save_smart_farm_data(broker_data, farm_id, rq.published_time(topic, broker_data))
+
+
+def parse_broker_message(broker_data):
+    """The readings (a list of dicts) in a broker message; raises ValueError saying what is wrong."""
+    # Parse the data (assuming it comes in JSON format)
+    try:
+        parsed_data = json.loads(broker_data)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Failed to parse broker data: {str(e)}")
+
+    # Ensure data is in list format
+    if isinstance(parsed_data, dict):
+        return [parsed_data]  # Wrap the single dictionary in a list
+    if isinstance(parsed_data, list):
+        return parsed_data
+    raise ValueError("Unexpected data format received from the broker. Expected a dictionary or a list of dictionaries.")
+
+
+def log_readings(log, data_list, farm_id, received_at):
+    """Append broker readings to the ingest log; returns (saved data, rejected readings)."""
+    saved_data = []
+    rejected = []
+    for data in data_list:
+        # Readings from newer firmware also carry the actuator states
+        if data.get("State"):
+            apply_state_report(data)
+
+        co2 = data.get("CO2")
+        temperature = data.get("Temperature")
+        humidity = data.get("Humidity")
+        light_intensity = data.get("Light_0x5C")
+        reading_farm_id = data.get("farm_id") or farm_id or DEFAULT_FARM_ID
+
+        # Too-long IDs would fail the database insert for good: reject the reading now
+        error = reading_id_error(reading_farm_id, data.get("Device"))
+        if error is None:
+            # Append each item to the ingest log first, so it survives a database failure
+            try:
+                log.append(received_at, reading_farm_id, {
+                    "co2": to_float(co2),
+                    "temperature": to_float(temperature),
+                    "humidity": to_float(humidity),
+                    "light_intensity": to_float(light_intensity)
+                }, device_id=data.get("Device"), seq=data.get("Seq"), device_time=to_float(data.get("Time")))
+            except ValueError as e:
+                error = str(e)
+        if error is not None:
+            rejected.append({"device_id": data.get("Device"), "message": error})
+            continue
+        # saved_data.append({"co2": co2}, {"temperature": temperature}, {"humidity": humidity}, {"light_intensity": light_intensity}) 
+
+        saved_data.append({
+            "co2": co2,
+            "temperature": temperature,
+            "humidity": humidity,
+            "light_intensity": light_intensity
+        })
+    return saved_data, rejected
+
+
+def finish_saving(log, saved_data, rejected):
+    """Drain the ingest log into the database, export the saved data to a JSON file and build the response."""
+    # Write everything pending in the log to the database in bulk
+    inserted = skipped = 0
+    try:
+        inserted, skipped = drain_ingest_log()
+        if skipped:
+            message = f"Smart farm data retrieved: {inserted} new readings saved to the database, {skipped} duplicates skipped, exported to a JSON file."
+        else:
+            message = "Smart farm data retrieved, saved to the database, and exported to a JSON file."
+    except Exception as e:
+        message = f"Smart farm data retrieved and logged; the database write will be retried ({str(e)})."
+
+    # Export the saved data to a JSON file
+    output_file = "smf_data_from_sensor.json"
+    export_json(output_file, saved_data)
+
+    return {
+        "status": "success",
+        "message": message,
+        "inserted": inserted,
+        "skipped": skipped,
+        "pending": log.pending(),
+        "rejected": rejected,
+        "data": saved_data,
+        "exported_file": os.path.abspath(output_file)  # Return the absolute path to the file
+    }
+
+
+def save_smart_farm_data(broker_data, farm_id=None, received_at=None):
+    """Save the readings of a broker message to the database and export them to a JSON file.
+
+    received_at is when the message was published (Unix seconds), if known; else the time of the call.
+    """
+    try:
         if not broker_data:
             return {
                 "status": "error",
                 "message": "Failed to retrieve data from the message broker."
             }
-        
-        # Parse the data (assuming it comes in JSON format)
-        try:
-            parsed_data = json.loads(broker_data)
-        except json.JSONDecodeError as e:
-            return {
-                "status": "error",
-                "message": f"Failed to parse broker data: {str(e)}",
-                "broker_data": broker_data
-            }
 
-        # Ensure data is in list format
-        if isinstance(parsed_data, dict):
-            data_list = [parsed_data]  # Wrap the single dictionary in a list
-        elif isinstance(parsed_data, list):
-            data_list = parsed_data
-        else:
+        try:
+            data_list = parse_broker_message(broker_data)
+        except ValueError as e:
             return {
                 "status": "error",
-                "message": "Unexpected data format received from the broker. Expected a dictionary or a list of dictionaries.",
+                "message": str(e),
                 "broker_data": broker_data
             }
 
-        saved_data = []
-
-        for data in data_list:
-            co2 = data.get("CO2")
-            temperature = data.get("Temperature")
-            humidity = data.get("Humidity")
-            light_intensity = data.get("Light_0x5C")
-            
-            # Add a new record to the database for each item
-            new_entry = SmartFarmData(
-                co2=co2,
-                temperature=temperature,
-                humidity=humidity,
-                light_intensity=light_intensity
-            )
+        log = get_ingest_log()
+        saved_data, rejected = log_readings(log, data_list, farm_id, time.time() if received_at is None else received_at)
+        return finish_saving(log, saved_data, rejected)
 
-            db.session.add(new_entry)
-            # saved_data.append({"co2": co2}, {"temperature": temperature}, {"humidity": humidity}, {"light_intensity": light_intensity}) 
-
-            saved_data.append({
-                "co2": co2,
-                "temperature": temperature,
-                "humidity": humidity,
-                "light_intensity": light_intensity
-            })
+    except Exception as e:
+        return {
+            "status": "error",
+            "message": f"An error occurred: {str(e)}"
+        }
 
-        db.session.commit()
 
-        # Export the saved data to a JSON file
-        output_file = "smf_data_from_sensor.json"
-        with open(output_file, "w") as json_file:
-            json.dump(saved_data, json_file, indent=4)
+def retrieve_feed_history(feed=None, farm_id=None):
+    """Save every data point published to a feed since the last one ingested from it.
 
+    The position is kept in the database (FeedCursor), so a new scheduler leader resumes where the
+    previous one stopped. A feed without a cursor starts from its newest data point. Readings are
+    timestamped with the time their data point was published, not the time of the poll.
+    """
+    feed = feed or rq.OUT_CHANNEL
+    try:
+        cursor = db.session.get(FeedCursor, feed)
+        if cursor is None:
+            points = rq.recv_history(feed, limit=1, max_pages=1)
+        else:
+            points = rq.recv_history(feed, start_time=cursor.created_epoch)
+    except Exception as e:
         return {
-            "status": "success",
-            "message": "Smart farm data retrieved, saved to the database, and exported to a JSON file.",
-            "data": saved_data,
-            "exported_file": os.path.abspath(output_file)  # Return the absolute path to the file
+            "status": "error",
+            "message": f"An error occurred: {str(e)}"
         }
 
+    try:
+        log = get_ingest_log()
+        saved_data, rejected = [], []
+        newest = None if cursor is None else (cursor.created_epoch, cursor.data_id)
+        for point in points:
+            key = (rq.point_time(point), str(point["id"]))
+            # start_time is inclusive: skip what the cursor already covers
+            if cursor is not None and key <= (cursor.created_epoch, cursor.data_id):
+                continue
+            try:
+                saved, rejected_here = log_readings(log, parse_broker_message(point["value"]), farm_id, key[0])
+                saved_data += saved
+                rejected += rejected_here
+            except ValueError as e:
+                rejected.append({"data_id": key[1], "message": str(e)})
+            newest = max(newest, key) if newest is not None else key
+
+        # The readings are in the ingest log, so the cursor can move past them
+        if newest is not None and (cursor is None or newest > (cursor.created_epoch, cursor.data_id)):
+            db.session.merge(FeedCursor(feed=feed, created_epoch=newest[0], data_id=newest[1]))
+            db.session.commit()
+        return finish_saving(log, saved_data, rejected)
+
     except Exception as e:
+        db.session.rollback()
         return {
             "status": "error",
             "message": f"An error occurred: {str(e)}"
         }
 
 
+# Periodic ingestion
+
+metrics.describe("sf_ingest_polls_total", "counter", "Scheduled broker polls by farm and outcome.")
+
+ingest_scheduler = None
+
+
+def ingest_schedules():
+    """FarmSchedule per farm from INGEST_FARMS (default farm only if empty); farms with interval 0 are skipped."""
+    defaults = dict(DEFAULT_SCHEDULE,
+                    interval=current_app.config['INGEST_POLL_INTERVAL'],
+                    jitter=current_app.config['INGEST_POLL_JITTER'],
+                    max_backoff=current_app.config['INGEST_POLL_MAX_BACKOFF'])
+    farms = current_app.config['INGEST_FARMS'] or {DEFAULT_FARM_ID: {}}
+    schedules = []
+    for farm_id, overrides in farms.items():
+        settings = dict(defaults, **overrides)
+        if settings["interval"] > 0:
+            schedules.append(FarmSchedule(farm_id, settings["interval"], settings["jitter"], settings["max_backoff"], settings["feed"]))
+    return schedules
+
+
+def poll_farm(app, schedule):
+    with app.app_context():
+        result = retrieve_feed_history(schedule.feed, farm_id=schedule.farm_id)
+        states = retrieve_actuator_states()
+    if states["status"] != "success":
+        print(f"Actuator state poll failed: {states['message']}")
+    metrics.inc("sf_ingest_polls_total", farm=schedule.farm_id, status=result["status"])
+    if result["status"] != "success":
+        print(f"Scheduled poll of farm {schedule.farm_id} failed: {result['message']}")
+    return result["status"] == "success"
+
+
+def get_ingest_scheduler():
+    """The ingest scheduler, or None if no farm has a poll interval (needs an app context)."""
+    global ingest_scheduler
+    if ingest_scheduler is None:
+        schedules = ingest_schedules()
+        if schedules:
+            app = current_app._get_current_object()
+            lock = leader_lock(db.engine, "smart_farm_ingest_scheduler", os.path.dirname(app.config['INGEST_LOG_PATH']),
+                               context=app.app_context)
+            ingest_scheduler = IngestScheduler(schedules, lambda schedule: poll_farm(app, schedule), lock)
+    return ingest_scheduler
+
+
+def start_ingest_scheduler(app):
+    """Start polling in the background; safe to call in every worker, only the leader polls."""
+    with app.app_context():
+        scheduler = get_ingest_scheduler()
+    if scheduler is not None:
+        scheduler.start()
+    return scheduler
+
+
+@bp.cli.command("poll")
+def poll_command():
+    """Run the ingest scheduler in the foreground (e.g. as a sidecar process)."""
+    scheduler = get_ingest_scheduler()
+    if scheduler is None:
+        click.echo("No farm has a poll interval; set SMART_FARM_INGEST_POLL_INTERVAL or SMART_FARM_INGEST_FARMS")
+        return
+    scheduler.run()
+
+
 def connect_successfully():
     try:
         # Simulate receiving a status from the WiFi channel
         connect_status = rq.sf_recv_from_wfout(topic=rq.WIFI_CHANNEL)
-        
-        # Check the connection status (you can modify the condition based on your implementation)
-        if connect_status == "1":
-            response = {
-                "message": "Connected successfully",
-                "status_code": 200
-            }
-        else:
-            response = {
-                "message": "Failed to connect",
-                "status_code": 500
-            }
     except Exception as e:
         # Handle exceptions and provide an error response
-        response = {
+        return {
             "message": f"Error: {str(e)}",
             "status_code": 500
         }
-    
-    return response
+    return connect_status_response(connect_status)
+
+
+def connect_status_response(connect_status):
+    # Check the connection status (you can modify the condition based on your implementation)
+    if connect_status == "1":
+        return {
+            "message": "Connected successfully",
+            "status_code": 200
+        }
+    return {
+        "message": "Failed to connect",
+        "status_code": 500
+    }
 
 
 
 # JWT Authentication API routes
 
-@app.route('/')
+@bp.route('/')
 def home():
     response = {
         "status": "success",
@@ -423,7 +1857,7 @@ def home():
     return jsonify(response)
 
 
-@app.route('/login', methods=['POST'])
+@bp.route('/login', methods=['POST'])
 def login():
     # Parse JSON data from the request body
     data = request.get_json()
@@ -439,14 +1873,25 @@ def login():
             "message": "Username and password are required."
         }), 400
 
+    # Throttle password guessing, across all workers
+    if rate_limited("login:" + (request.remote_addr or "-"), current_app.config['LOGIN_RATE_LIMIT']):
+        return jsonify({
+            "status": "error",
+            "message": "Too many login attempts, try again in a minute."
+        }), 429
+
     # Query the database for the user
     user = User.query.filter_by(username=username).first()
 
     # Verify the user's existence and password
     if user and bcrypt.check_password_hash(user.password, password):
-        # Generate JWT token
-        access_token = create_access_token(identity=user.username)
-        login_user(user)
+        # Generate JWT token, carrying the user ID so later requests need no database lookup
+        access_token = create_access_token(identity=user.username, additional_claims={"uid": user.id})
+        get_user_cache().set(user.id, CachedUser(user.id, user.username))
+
+        # The login session is only needed when stateless JWT auth is disabled
+        if not current_app.config['JWT_STATELESS_AUTH']:
+            login_user(user)
 
         return jsonify({
             "status": "success",
@@ -461,7 +1906,7 @@ def login():
     }), 401
 
 
-@app.route('/register', methods=['POST'])
+@bp.route('/register', methods=['POST'])
 def register():
     # Parse JSON data
     if request.is_json:
@@ -492,8 +1937,8 @@ def register():
     return jsonify({"status": "error", "message": "Invalid request format."}), 400
 
 
-@app.route('/logout', methods=['POST'])
-@login_required
+@bp.route('/logout', methods=['POST'])
+@auth_required(session_fallback=True)
 def logout():
     # Create a response object with a success message
     response = jsonify({
@@ -502,19 +1947,53 @@ def logout():
     })
     # Unset the JWT cookies in the response
     unset_jwt_cookies(response)
-    # Log out the user
-    logout_user()
+    # Log out the user (only a session login has server-side state to clear)
+    if current_user.is_authenticated:
+        logout_user()
     return response, 200
 
 
 
 # Smart Farm Data API Routes
 
-@app.route('/data_retrieval', methods=['GET']) # Retrieve data from Database
-# @jwt_required() 
+def archived_rows(farm_id, start, end):
+    """Archived rows of a farm in [start, end), newest first, in the /data_retrieval row format."""
+    archived = archive.read_range(current_app.config['ARCHIVE_DIR'], farm_id, start, end, ("updated_time",) + METRICS)
+    times = archived["updated_time"].astype("datetime64[s]").astype(str)
+    rows = []
+    for i in range(times.size - 1, -1, -1):
+        row = {"updated_time": times[i].replace("T", " ")}
+        for metric in METRICS:
+            value = archived[metric][i]
+            row[metric] = None if np.isnan(value) else f"{value:g}"
+        rows.append(row)
+    return rows
+
+
+@bp.route('/data_retrieval', methods=['GET']) # Retrieve data from Database
+@auth_required()
 def data_retrieval():
+    # With start/end, only that range of one farm is returned; without them, every row of every farm.
+    # Both include the rows moved to the Parquet archive
+    query = SmartFarmData.query
+    if request.args.get("start") or request.args.get("end"):
+        try:
+            start, end = parse_time_range()
+        except ValueError:
+            return jsonify({"status": "error", "message": "Invalid start or end time."}), 400
+        farm_id = request.args.get("farm_id", DEFAULT_FARM_ID)
+        query = query.filter(SmartFarmData.farm_id == farm_id, SmartFarmData.updated_time >= start, SmartFarmData.updated_time < end)
+        archived_data = archived_rows(farm_id, start, end)
+    else:
+        # Archived months are older than any row left in the database, so they go after them, newest first
+        archived_data = sorted(
+            (row for farm_id in archive.archived_farms(current_app.config['ARCHIVE_DIR'])
+             for row in archived_rows(farm_id, datetime.min, datetime.max)),
+            key=lambda row: row["updated_time"], reverse=True
+        )
+
     # Retrieve all Smart Farm data from the database
-    all_data = SmartFarmData.query.order_by(SmartFarmData.updated_time.desc()).all()
+    all_data = query.order_by(SmartFarmData.updated_time.desc()).all()
     
     # Prepare the response
     response = {
@@ -528,7 +2007,7 @@ def data_retrieval():
                 "light_intensity": item.light_intensity,
             } 
             for item in all_data
-        ]
+        ] + archived_data
     }
 
     # Define the file path for exporting
@@ -536,8 +2015,7 @@ def data_retrieval():
 
     # Write the response data to the JSON file
     try:
-        with open(file_path, "w") as json_file:
-            json.dump(response, json_file, indent=4)
+        export_json(file_path, response)
     except Exception as e:
         return jsonify({
             "status": "error",
@@ -547,8 +2025,8 @@ def data_retrieval():
     return jsonify(response)
 
 
-@app.route('/data_simulation', methods=['POST'])
-# @jwt_required()
+@bp.route('/data_simulation', methods=['POST'])
+@auth_required()
 def data_simulation():
     # Retrieve incoming data
     incoming_data = request.get_json()
@@ -561,6 +2039,7 @@ def data_simulation():
 
     # Insert new row into the database
     new_entry = SmartFarmData(
+        farm_id=incoming_data.get("farm_id") or DEFAULT_FARM_ID,
         temperature=temperature,
         humidity=humidity,
         co2=co2,
@@ -568,6 +2047,7 @@ def data_simulation():
     )
     db.session.add(new_entry)
     db.session.commit()
+    notify_ingest([new_entry])
 
     # Retrieve all data for response
     all_data = SmartFarmData.query.order_by(SmartFarmData.updated_time.desc()).all()
@@ -584,8 +2064,7 @@ def data_simulation():
 
     # Save the response_data to a JSON file
     try:
-        with open("smf_conf.json", "w") as json_file:
-            json.dump(response_data, json_file, indent=4)
+        export_json("smf_conf.json", response_data)
     except Exception as e:
         return jsonify({
             "status": "error",
@@ -603,89 +2082,587 @@ def data_simulation():
 
 # Message broker interactions API routes
 
-@app.route('/request_wifi_change', methods=['POST'])
-# @jwt_required()  
+@bp.route('/request_wifi_change', methods=['POST'])
+@auth_required()
 def request_wifi_change_api():
     """API endpoint to request a Wi-Fi password change."""
     response, status_code = request_wifi_change()
     return jsonify(response), status_code
 
 
-@app.route('/request_wifi_info', methods=['GET'])
-# @jwt_required()  
+@bp.route('/request_wifi_info', methods=['GET'])
+@auth_required()
 def wifi_info():
     response = request_wifi_info()
     return jsonify(response)
 
 
-@app.route('/retrieve_sensor_data', methods=['POST']) # Retrieve data from the sensors of the Smart Farm prototype
-# @jwt_required()  
+@bp.route('/retrieve_sensor_data', methods=['POST']) # Retrieve data from the sensors of the Smart Farm prototype
+@auth_required()
 def retrieve_sensor_data():
     """API endpoint to retrieve data from the message broker and save it to the database."""
     response = retrieve_and_save_smart_farm_data()
     return jsonify(response)
 
 
-@app.route('/request_environment_control', methods=['POST'])
-# @jwt_required() 
+@bp.route('/ingest_schedule', methods=['GET'])
+@auth_required()
+def ingest_schedule_status():
+    """State of the periodic ingestion in this worker."""
+    scheduler = ingest_scheduler
+    if scheduler is None:
+        return jsonify({"status": "success", "enabled": False, "farms": []})
+    return jsonify(dict(scheduler.status(), status="success", enabled=True))
+
+
+@bp.route('/request_environment_control', methods=['POST'])
+@auth_required()
 def request_environment_control():
     """API route to send a control message with smart farm data."""
     # Call the function to send the message
-    response = request_environmental_change()
-    return jsonify(response)
+    response, status_code = request_environmental_change()
+    return jsonify(response), status_code
+
+
+def requested_device_id():
+    return request.args.get("device_id") or ANY_DEVICE
+
 
+def actuator_route(response):
+    """202 Accepted with the queued command, or the error response."""
+    if response["status"] != "accepted":
+        return jsonify(response)
+    return jsonify(response), 202, {"Location": response["status_url"]}
 
-@app.route('/open_window', methods=['POST'])
-# @jwt_required()  
+
+@bp.route('/open_window', methods=['POST'])
+@auth_required()
 def open_window():
-    status_code = open_smart_farm_window()
-    return status_code
+    return actuator_route(open_smart_farm_window(requested_device_id()))
 
 
-@app.route('/close_window', methods=['POST'])
-# @jwt_required()  
+@bp.route('/close_window', methods=['POST'])
+@auth_required()
 def close_window():
-    status_code = close_smart_farm_window()
-    return  status_code
+    return actuator_route(close_smart_farm_window(requested_device_id()))
 
 
-@app.route('/light_on', methods=['POST'])
-# @jwt_required()  
+@bp.route('/light_on', methods=['POST'])
+@auth_required()
 def turn_light_on():
-    status_code = light_on()
-    return status_code
+    return actuator_route(light_on(requested_device_id()))
 
 
-@app.route('/light_off', methods=['POST'])
-# @jwt_required()  
+@bp.route('/light_off', methods=['POST'])
+@auth_required()
 def turn_light_off():
-    status_code = light_off()
-    return status_code
+    return actuator_route(light_off(requested_device_id()))
 
 
-@app.route('/open_fan', methods=['POST'])
-# @jwt_required()  
+@bp.route('/open_fan', methods=['POST'])
+@auth_required()
 def open_fan():
-    status_code = open_smart_farm_fan()
-    return status_code
+    return actuator_route(open_smart_farm_fan(requested_device_id()))
 
 
-@app.route('/close_fan', methods=['POST'])
-# @jwt_required()  
+@bp.route('/close_fan', methods=['POST'])
+@auth_required()
 def close_fan():
-    status_code = close_smart_farm_fan()
-    return  status_code
-
-
-@app.route('/connect_status', methods=['GET'])
-# @jwt_required
+    return actuator_route(close_smart_farm_fan(requested_device_id()))
+
+
+@bp.route('/broker_budget', methods=['GET'])
+@auth_required()
+def broker_budget():
+    """Adafruit IO request budget left (tokens) and its settings."""
+    return jsonify({"status": "success", "budget": rq.budget.status() if hasattr(rq, "budget") else None})
+
+
+@bp.route('/commands', methods=['GET'])
+@auth_required()
+def list_commands():
+    """Most recent actuator commands, optionally filtered by ?status= and ?device_id=."""
+    query = ActuatorCommand.query
+    if request.args.get("status"):
+        query = query.filter_by(status=request.args["status"])
+    if request.args.get("device_id"):
+        query = query.filter_by(device_id=request.args["device_id"])
+    limit = min(request.args.get("limit", 50, type=int), 500)
+    commands = query.order_by(ActuatorCommand.id.desc()).limit(limit).all()
+    return jsonify({"status": "success", "commands": [command.to_dict() for command in commands]})
+
+
+@bp.route('/commands/<command_id>', methods=['GET'])
+@auth_required()
+def command_status(command_id):
+    """Lifecycle of one actuator command: state, attempts and timings."""
+    command = ActuatorCommand.query.filter_by(command_id=command_id).first()
+    if command is None:
+        return jsonify({"status": "error", "message": "Command not found"}), 404
+    return jsonify({"status": "success", "command": command.to_dict()})
+
+
+@bp.route('/actuator_states', methods=['GET'])
+@auth_required()
+def get_actuator_states():
+    """Actuator states as last reported by the devices, served from the state cache."""
+    actuators, devices = actuator_states()
+    return jsonify({"status": "success", "actuators": actuators, "devices": devices})
+
+
+@bp.route('/retrieve_actuator_states', methods=['POST'])
+@auth_required()
+def retrieve_actuator_states_api():
+    """Pull the newest state report from the broker into the cache."""
+    return jsonify(retrieve_actuator_states())
+
+
+@bp.route('/latest_reading', methods=['GET'])
+@auth_required()
+def latest_reading():
+    """Newest reading of a farm, or of a device with ?device_id=, without a database query."""
+    device_id = request.args.get('device_id')
+    key = "latest:device:" + device_id if device_id else "latest:farm:" + request.args.get('farm_id', DEFAULT_FARM_ID)
+    reading = read_state(key)
+    if reading is None:
+        return jsonify({"status": "error", "message": "No reading received yet."}), 404
+    reading["updated_time"] = from_epoch(reading["timestamp"]).isoformat()
+    return jsonify({"status": "success", "data": reading})
+
+
+@bp.route('/connect_status', methods=['GET'])
+@auth_required()
 def connect_status():
     response = connect_successfully()
     return jsonify(response)
 
 
+# Alerting API routes
+
+@bp.route('/alert_rules', methods=['GET'])
+@auth_required()
+def list_alert_rules():
+    rules = AlertRule.query.order_by(AlertRule.farm_id, AlertRule.metric).all()
+    return jsonify({
+        "status": "success",
+        "data": [rule.to_dict() for rule in rules]
+    })
+
+
+@bp.route('/alert_rules', methods=['POST'])
+@auth_required()
+def create_alert_rule():
+    data = request.get_json() or {}
+
+    metric = data.get("metric")
+    operator = data.get("operator", "above")
+    if metric not in DEFAULT_THRESHOLDS or operator not in OPERATORS:
+        return jsonify({"status": "error", "message": "Invalid metric or operator."}), 400
+
+    try:
+        rule = AlertRule(
+            farm_id=data.get("farm_id") or DEFAULT_FARM_ID,
+            metric=metric,
+            operator=operator,
+            threshold=float(data["threshold"]),
+            hysteresis=float(data.get("hysteresis", 0)),
+            min_duration=float(data.get("min_duration", 0)),
+            enabled=bool(data.get("enabled", True))
+        )
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"status": "error", "message": "A numeric threshold is required."}), 400
+
+    db.session.add(rule)
+    db.session.commit()
+    alert_rules_changed()
+
+    return jsonify({"status": "success", "data": rule.to_dict()}), 201
+
+
+@bp.route('/alert_rules/<int:rule_id>', methods=['DELETE'])
+@auth_required()
+def delete_alert_rule(rule_id):
+    rule = AlertRule.query.get(rule_id)
+    if rule is None:
+        return jsonify({"status": "error", "message": "Alert rule not found."}), 404
+
+    db.session.delete(rule)
+    db.session.commit()
+    alert_rules_changed()
+
+    return jsonify({"status": "success", "message": "Alert rule deleted."})
+
+
+@bp.route('/alerts', methods=['GET'])
+@auth_required()
+def list_alerts():
+    query = Alert.query
+    farm_id = request.args.get("farm_id")
+    if farm_id:
+        query = query.filter_by(farm_id=farm_id)
+    limit = min(request.args.get("limit", 100, type=int), 1000)
+
+    alerts = query.order_by(Alert.created_time.desc(), Alert.id.desc()).limit(limit).all()
+    return jsonify({
+        "status": "success",
+        "data": [alert.to_dict() for alert in alerts]
+    })
+
+
+@bp.route('/alerts/stream', methods=['GET'])
+@auth_required()
+def alert_event_stream():
+    """Server-sent event stream of alerts as they are raised and cleared."""
+    last_seq = request.args.get("since", alert_stream.last_seq, type=int)
+
+    def generate(seq):
+        while True:
+            events = alert_stream.since(seq, timeout=15)
+            if not events:
+                # Keep-alive comment, so proxies don't drop an idle connection
+                yield ": keep-alive\n\n"
+                continue
+            for seq, event in events:
+                yield f"id: {seq}\nevent: alert\ndata: {json.dumps(event)}\n\n"
+
+    return Response(stream_with_context(generate(last_seq)), mimetype="text/event-stream")
+
+
+# Climate control API routes
+
+@bp.route('/climate_control', methods=['GET'])
+@auth_required()
+def climate_control_status():
+    """State of one farm's loops with ?farm_id=, otherwise of every farm that sent readings."""
+    farm_id = request.args.get("farm_id")
+    response = {
+        "status": "success",
+        "enabled": current_app.config['CLIMATE_CONTROL_ENABLED'],
+    }
+    if farm_id:
+        response["farm_id"] = farm_id
+        response["actuators"] = climate_control_state(farm_id)
+    else:
+        response["farms"] = climate_control_state()
+    return jsonify(response)
+
+
+@bp.route('/climate_control', methods=['POST'])
+@auth_required()
+def climate_control_update():
+    """Enable/disable the control loop and update actuator setpoints, of one farm when farm_id is given."""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"status": "error", "message": "Expected a JSON object"}), 400
+    farm_id = data.get("farm_id")
+    if farm_id is not None and not isinstance(farm_id, str):
+        return jsonify({"status": "error", "message": "farm_id must be a string"}), 400
+    if "enabled" in data and not isinstance(data["enabled"], bool):
+        return jsonify({"status": "error", "message": "enabled must be true or false"}), 400
+
+    if "setpoints" in data:
+        try:
+            configure_climate_control(data["setpoints"], farm_id)
+        except (TypeError, ValueError) as e:
+            return jsonify({"status": "error", "message": f"Invalid setpoints: {str(e)}"}), 400
+
+    if "enabled" in data:
+        current_app.config['CLIMATE_CONTROL_ENABLED'] = data["enabled"]
+
+    response = {
+        "status": "success",
+        "enabled": current_app.config['CLIMATE_CONTROL_ENABLED'],
+    }
+    if farm_id:
+        response["farm_id"] = farm_id
+        response["actuators"] = climate_control_state(farm_id)
+    else:
+        response["farms"] = climate_control_state()
+    return jsonify(response)
+
+
+# Metrics endpoint (Prometheus text format)
+
+@bp.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+def parse_gmt7(value):
+    """Parse an ISO 8601 time into the naive GMT+7 datetimes the database stores; one with an offset is converted."""
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(pytz.timezone('Asia/Bangkok')).replace(tzinfo=None)
+    return parsed
+
+
+def parse_time_range(default_hours=24):
+    """Read the start/end query parameters (ISO 8601, GMT+7 unless they carry an offset), defaulting to the last default_hours."""
+    end = request.args.get("end")
+    start = request.args.get("start")
+    end = parse_gmt7(end) if end else gmt7_now().replace(tzinfo=None)
+    start = parse_gmt7(start) if start else end - timedelta(hours=default_hours)
+    return start, end
+
+
+def load_metric_columns(farm_id, start, end, metrics_wanted=METRICS):
+    """Load the readings of a farm in [start, end) as columnar arrays: (timestamps, {metric: values}).
+
+    Served from the recent readings buffer when it is enabled and covers the range, from the
+    database otherwise.
+    """
+    if current_app.config['RING_BUFFER_ENABLED']:
+        get_recent_buffer(farm_id)
+        recent = get_recent_readings().window(farm_id, to_epoch(start), to_epoch(end), metrics_wanted)
+        if recent is not None:
+            metrics.inc("sf_ring_buffer_hits_total")
+            return recent
+
+    rows = (
+        SmartFarmData.query
+        .with_entities(SmartFarmData.updated_time, *[getattr(SmartFarmData, metric) for metric in metrics_wanted])
+        .filter(SmartFarmData.farm_id == farm_id, SmartFarmData.updated_time >= start, SmartFarmData.updated_time < end)
+        .order_by(SmartFarmData.updated_time)
+        .all()
+    )
+    if rows:
+        columns = list(zip(*rows))
+        timestamps = datetimes_to_epoch(columns[0])
+        values = {metric: column_to_array(columns[i + 1]) for i, metric in enumerate(metrics_wanted)}
+    else:
+        timestamps, values = np.empty(0), {metric: np.empty(0) for metric in metrics_wanted}
+
+    # Older parts of the range may have been moved to the Parquet archive
+    archived = load_archived_columns(farm_id, start, end, metrics_wanted)
+    if archived is not None:
+        timestamps = np.concatenate([archived[0], timestamps])
+        values = {metric: np.concatenate([archived[1][metric], values[metric]]) for metric in metrics_wanted}
+        order = np.argsort(timestamps, kind="stable")
+        timestamps, values = timestamps[order], {metric: column[order] for metric, column in values.items()}
+
+    return timestamps, values
+
+
+def parse_metrics_arg():
+    """Read the comma-separated metrics query parameter (all metrics by default)."""
+    wanted = request.args.get("metrics")
+    if not wanted:
+        return METRICS
+    wanted = tuple(metric.strip() for metric in wanted.split(","))
+    if any(metric not in METRICS for metric in wanted):
+        raise ValueError("Unknown metric")
+    return wanted
+
+
+def array_to_json(values, digits=3):
+    """Round a float array for the response, with None in place of NaN."""
+    rounded = np.round(values, digits)
+    return [None if value != value else value for value in rounded.tolist()]
+
+
+# Time-series API routes
+
+@bp.route('/data_recent', methods=['GET'])
+@auth_required()
+def data_recent():
+    """Readings of the last few hours (default 3), served from memory when possible."""
+    hours = request.args.get("hours", 3, type=float)
+    farm_id = request.args.get("farm_id", DEFAULT_FARM_ID)
+    end = gmt7_now().replace(tzinfo=None)
+    start = end - timedelta(hours=hours)
+    # Include readings stamped up to a minute ahead, in case of clock skew
+    timestamps, columns = load_metric_columns(farm_id, start, end + timedelta(minutes=1))
+
+    data = {metric: array_to_json(columns[metric]) for metric in METRICS}
+    data["updated_time"] = [from_epoch(ts).strftime("%Y-%m-%d %H:%M:%S") for ts in timestamps.tolist()]
+
+    return jsonify({
+        "status": "success",
+        "data": data,
+        "buffer": get_recent_readings().memory_report()
+    })
+
+
+@bp.route('/data_resample', methods=['GET'])
+@auth_required()
+def data_resample():
+    """Resample a range of readings onto a regular grid (interval in seconds)."""
+    try:
+        start, end = parse_time_range()
+        metrics_wanted = parse_metrics_arg()
+        interval = request.args.get("interval", 60, type=float)
+        method = request.args.get("method", "ffill")
+        max_gap = request.args.get("max_gap", type=float)
+        if method not in RESAMPLE_METHODS or interval <= 0:
+            raise ValueError("Invalid method or interval")
+        grid = make_grid(to_epoch(start), to_epoch(end), interval)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": f"Invalid parameters: {str(e)}"}), 400
+
+    if grid.size > 100000:
+        return jsonify({"status": "error", "message": "Too many grid points, use a larger interval."}), 400
+
+    farm_id = request.args.get("farm_id", DEFAULT_FARM_ID)
+    timestamps, columns = load_metric_columns(farm_id, start, end, metrics_wanted)
+
+    data = {
+        metric: array_to_json(resample(timestamps, columns[metric], grid, method, max_gap))
+        for metric in metrics_wanted
+    }
+    data["time"] = [from_epoch(ts).strftime("%Y-%m-%d %H:%M:%S") for ts in grid.tolist()]
+
+    return jsonify({
+        "status": "success",
+        "method": method,
+        "interval": interval,
+        "rows_used": int(timestamps.size),
+        "data": data
+    })
+
+
+# Statistics of closed past ranges never change, so they are cached per (range, metric, options).
+# A range only counts as closed once its end is older than STATISTICS_CACHE_MIN_AGE: readings still
+# in the ingest log or backfilled from the feed history can arrive that late
+statistics_cache = TTLCache(maxsize=512, ttl=3600)
+
+
+def parse_number_list(name, default):
+    values = request.args.get(name)
+    if not values:
+        return default
+    return tuple(float(value) for value in values.split(","))
+
+
+@bp.route('/data_statistics', methods=['GET'])
+@auth_required()
+def data_statistics():
+    """Percentiles, histogram and fraction of time above thresholds per metric, optionally per day.
+
+    Thresholds are given per metric, e.g. ?above=humidity:80,temperature:30
+    """
+    try:
+        start, end = parse_time_range()
+        metrics_wanted = parse_metrics_arg()
+        percentiles = parse_number_list("percentiles", (5, 50, 95))
+        bins = request.args.get("bins", 20, type=int)
+        max_gap = request.args.get("max_gap", 600, type=float)
+        group = request.args.get("group", "none")
+        thresholds = {}
+        for item in filter(None, request.args.get("above", "").split(",")):
+            metric, value = item.split(":")
+            if metric not in METRICS:
+                raise ValueError("Unknown metric")
+            thresholds.setdefault(metric, []).append(float(value))
+        if group not in ("none", "day") or bins <= 0 or any(not 0 <= q <= 100 for q in percentiles):
+            raise ValueError("Invalid group, bins or percentiles")
+    except ValueError as e:
+        return jsonify({"status": "error", "message": f"Invalid parameters: {str(e)}"}), 400
+
+    farm_id = request.args.get("farm_id", DEFAULT_FARM_ID)
+    closed_range = end <= gmt7_now().replace(tzinfo=None) - timedelta(seconds=current_app.config['STATISTICS_CACHE_MIN_AGE'])
+
+    def cache_key(metric):
+        return (farm_id, start, end, metric, percentiles, bins, tuple(thresholds.get(metric, ())), max_gap, group)
+
+    result = {}
+    missing = []
+    for metric in metrics_wanted:
+        cached = statistics_cache.get(cache_key(metric)) if closed_range else None
+        if cached is not None:
+            result[metric] = cached
+        else:
+            missing.append(metric)
+
+    if missing:
+        # One query loads every metric still needed; each is then summarized in vectorized passes
+        timestamps, columns = load_metric_columns(farm_id, start, end, tuple(missing))
+        for metric in missing:
+            options = dict(percentiles=percentiles, bins=bins, thresholds=thresholds.get(metric, ()), max_gap=max_gap)
+            if group == "day":
+                stats = [
+                    dict(describe(timestamps[s:e], columns[metric][s:e], **options),
+                         day=from_epoch(day_start).strftime("%Y-%m-%d"))
+                    for day_start, s, e in day_slices(timestamps)
+                ]
+            else:
+                stats = describe(timestamps, columns[metric], **options)
+            result[metric] = stats
+            if closed_range:
+                statistics_cache.set(cache_key(metric), stats)
+
+    return jsonify({
+        "status": "success",
+        "start": start.strftime("%Y-%m-%d %H:%M:%S"),
+        "end": end.strftime("%Y-%m-%d %H:%M:%S"),
+        "group": group,
+        "data": result
+    })
+
+
+# Anomaly detection API routes
+
+@bp.route('/anomalies', methods=['GET'])
+@auth_required()
+def score_anomalies():
+    """Score a historical range in batch; with mark=1 the flags are also saved on the rows."""
+    try:
+        start, end = parse_time_range()
+    except ValueError:
+        return jsonify({"status": "error", "message": "Invalid start or end time."}), 400
+    window = request.args.get("window", 60, type=int)
+    farm_id = request.args.get("farm_id", DEFAULT_FARM_ID)
+
+    # Ordered by device, so each device's readings are scored as a series of their own
+    rows = (
+        SmartFarmData.query
+        .with_entities(SmartFarmData.id, SmartFarmData.updated_time, SmartFarmData.device_id,
+                       *[getattr(SmartFarmData, metric) for metric in METRICS])
+        .filter(SmartFarmData.farm_id == farm_id, SmartFarmData.updated_time >= start, SmartFarmData.updated_time < end)
+        .order_by(SmartFarmData.device_id, SmartFarmData.updated_time, SmartFarmData.id)
+        .all()
+    )
+    columns = list(zip(*rows)) if rows else [()] * (len(METRICS) + 3)
+    device_starts = [0] + [i for i in range(1, len(rows)) if columns[2][i] != columns[2][i - 1]] + [len(rows)]
+
+    flags = {}
+    counts = {metric: 0 for metric in METRICS}
+    for i, metric in enumerate(METRICS):
+        values = column_to_array(columns[i + 3])
+        for first, last in zip(device_starts, device_starts[1:]):
+            reasons = score_batch(values[first:last], metric, window=window)
+            flagged = reasons != ""
+            counts[metric] += int(flagged.sum())
+            for index in flagged.nonzero()[0]:
+                flags.setdefault(first + int(index), {})[metric] = reasons[index]
+
+    flagged_rows = [
+        {
+            "id": columns[0][index],
+            "updated_time": columns[1][index].strftime("%Y-%m-%d %H:%M:%S") if columns[1][index] else None,
+            "anomaly": format_flags(row_flags),
+        }
+        for index, row_flags in sorted(flags.items(), key=lambda item: (columns[1][item[0]] or datetime.min, columns[0][item[0]]))
+    ]
+
+    if request.args.get("mark") == "1" and flagged_rows:
+        db.session.execute(
+            SmartFarmData.__table__.update()
+            .where(SmartFarmData.__table__.c.id == db.bindparam("row_id"))
+            .values(anomaly=db.bindparam("flags")),
+            [{"row_id": row["id"], "flags": row["anomaly"]} for row in flagged_rows]
+        )
+        db.session.commit()
+
+    return jsonify({
+        "status": "success",
+        "rows_scored": len(rows),
+        "counts": counts,
+        "data": flagged_rows
+    })
+
+
 # Serve static file function
-@app.route('/static/iot/templates/<path:path>')
+@bp.route('/static/iot/templates/<path:path>')
 def send_report(path):
     # Using request args for path will expose you to directory traversal attacks
     return send_from_directory('./static/iot/templates', path)
@@ -694,6 +2671,19 @@ def send_report(path):
 
 
 
+def start_background_workers(app):
+    """Start the ingest drainer, scheduler and command dispatcher; call once per worker process after create_app."""
+    share_broker_budget(app)  # Before anything calls the broker
+    start_ingest_drainer(app)  # Replay readings left in the ingest log
+    start_ingest_scheduler(app)  # Poll the broker periodically, if configured
+    start_command_dispatcher(app)  # Send queued actuator commands
+
+
 if __name__ == '__main__':
-    setup_database()  # Initialize the database
+    # Create the tables first with: flask --app smart_farm_app migrate
+    # The development server is a single process, the only writer, so recent reads can come from memory
+    app = create_app({'RING_BUFFER_ENABLED': os.environ.get('SMART_FARM_SINGLE_WRITER', '1') == '1'})
+    # The debug reloader runs this file in a watcher process too: only the serving child starts the workers
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_workers(app)
     app.run(debug=True)
@@ -78,13 +78,29 @@ function initializeChart() {
 }
 
 /**
- * Fetch data for all parameters and update the dashboard overview and chart.
+ * Turn the columns returned by /data_recent into one object per reading, oldest first.
+ * @param {Object} columns - {updated_time: [...], temperature: [...], ...}
+ * @returns {Array} - Array of {time, temperature, humidity, co2, light_intensity}.
+ */
+function columnsToRows(columns) {
+  return columns.updated_time.map((time, i) => ({
+    time: time,
+    temperature: columns.temperature[i],
+    humidity: columns.humidity[i],
+    co2: columns.co2[i],
+    light_intensity: columns.light_intensity[i],
+  }));
+}
+
+/**
+ * Fetch the recent readings (served from the server's memory buffer when enabled)
+ * and update the dashboard overview and chart.
  */
 async function fetchData() {
   try {
-    console.log("Fetching data for all parameters...");
+    console.log("Fetching recent data for all parameters...");
 
-    const response = await fetch(`${API_BASE_URL}/data_retrieval`, {
+    const response = await fetch(`${API_BASE_URL}/data_recent`, {
       method: "GET",
       headers: {
         "Content-Type": "application/json",
@@ -99,9 +115,10 @@ async function fetchData() {
     const serverData = await response.json();
     console.log("Received data from server:", serverData);
 
-    if (serverData.data && Array.isArray(serverData.data)) {
-      updateOverview(serverData.data);
-      updateChart(serverData.data);
+    if (serverData.data && Array.isArray(serverData.data.updated_time)) {
+      const rows = columnsToRows(serverData.data);
+      updateOverview(rows);
+      updateChart(rows);
     } else {
       console.warn("Unexpected server response:", serverData);
       alert("Invalid data format received from the server.");
@@ -16,7 +16,10 @@ async function fetchHistoryData() {
         console.log(`Fetching history data with filter: ${currentFilter}...`);
         const response = await fetch(`${API_BASE_URL}/data_retrieval`, {
             method: "GET",
-            headers: { "Content-Type": "application/json" },
+            headers: {
+                "Content-Type": "application/json",
+                "Authorization": `Bearer ${localStorage.getItem("access_token")}`,
+            },
         });
 
         if (!response.ok) {
@@ -19,7 +19,7 @@ document.getElementById('signin-form').addEventListener('submit', async function
 
     if (response.ok) {
       // Login success, you can store the JWT token 
-      localStorage.setItem('auth_token', data.token);
+      localStorage.setItem('access_token', data.token);
       window.location.href = 'dashboard.html'; // Redirect to dashboard 
     } else {
       // Show error message
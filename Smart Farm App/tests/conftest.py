@@ -0,0 +1,33 @@
+import os
+import sys
+
+import pytest
+
+# The app's modules are imported by name from the project directory, as smart_farm_app.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """The API on a fresh SQLite database, with its state files in tmp_path and tables created."""
+    import smart_farm_app as sfa
+
+    # Process-wide state created on first use
+    for name in ("user_cache", "recent_readings", "shared_state", "ingest_log", "ingest_scheduler", "alert_rules_version", "users_version"):
+        monkeypatch.setattr(sfa, name, None)
+    monkeypatch.setattr(sfa, "alert_engine", sfa.AlertEngine())
+    app = sfa.create_app({
+        "TESTING": True,
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'smart_farm.db'}",
+        "SHARED_STATE_PATH": str(tmp_path / "shared_state.bin"),
+        "INGEST_LOG_PATH": str(tmp_path / "ingest.log"),
+        "ARCHIVE_DIR": str(tmp_path / "archive"),
+    })
+    with app.app_context():
+        sfa.setup_database()
+    yield app
+    with app.app_context():
+        sfa.db.session.remove()
+        sfa.db.engine.dispose()
+    if sfa.shared_state is not None:
+        sfa.shared_state.close()
@@ -0,0 +1,78 @@
+from alerts import AlertEngine, ThresholdRule
+
+
+def states(events):
+    return [(event["rule_id"], event["state"]) for event in events]
+
+
+def test_alert_is_raised_once_and_cleared_past_the_hysteresis():
+    engine = AlertEngine([ThresholdRule(1, "farm", "temperature", "above", 30, hysteresis=2)])
+    steps = [engine.evaluate("farm", t, {"temperature": value}) for t, value in enumerate([31, 32, 29, 27.5])]
+    assert [states(events) for events in steps] == [[(1, "raised")], [], [], [(1, "cleared")]]
+
+
+def test_breach_must_last_min_duration():
+    engine = AlertEngine([ThresholdRule(1, "farm", "humidity", "below", 40, min_duration=60)])
+    assert engine.evaluate("farm", 0, {"humidity": 35}) == []
+    assert engine.evaluate("farm", 30, {"humidity": 45}) == []  # Recovered: the timer restarts
+    assert engine.evaluate("farm", 40, {"humidity": 35}) == []
+    assert states(engine.evaluate("farm", 100, {"humidity": 35})) == [(1, "raised")]
+
+
+def test_rules_only_see_their_own_farm_and_metric():
+    engine = AlertEngine([
+        ThresholdRule(1, "a", "temperature", "above", 30),
+        ThresholdRule(2, "b", "temperature", "above", 30),
+        ThresholdRule(3, "a", "co2", "above", 1000),
+    ])
+    assert states(engine.evaluate("a", 0, {"temperature": 35, "co2": 500})) == [(1, "raised")]
+    assert states(engine.evaluate("b", 0, {"co2": 5000, "humidity": 99})) == []
+    assert engine.rule_count() == 3
+
+
+def test_reloading_keeps_the_state_of_remaining_rules():
+    rule = ThresholdRule(1, "farm", "temperature", "above", 30)
+    engine = AlertEngine([rule])
+    engine.evaluate("farm", 0, {"temperature": 35})
+    engine.load_rules([rule, ThresholdRule(2, "farm", "temperature", "above", 33)])
+    assert states(engine.evaluate("farm", 1, {"temperature": 35})) == [(2, "raised")]
+
+
+def call(app, view, method, path, **kwargs):
+    with app.test_request_context(path, method=method, json=kwargs.pop("json", None)):
+        response = view.__wrapped__(**kwargs)
+    return response if isinstance(response, tuple) else (response, 200)
+
+
+def reading(value, timestamp=0):
+    return {"farm_id": "farm", "device_id": None, "timestamp": timestamp, "values": {"co2": value}}
+
+
+def test_rules_created_and_deleted_through_the_api_apply(app):
+    import smart_farm_app as sfa
+
+    response, code = call(app, sfa.create_alert_rule, "POST", "/alert_rules",
+                          json={"farm_id": "farm", "metric": "co2", "threshold": 800})
+    assert code == 201
+    rule_id = response.get_json()["data"]["id"]
+    with app.app_context():
+        sfa.evaluate_alerts(reading(900))
+        assert [alert.rule_id for alert in sfa.Alert.query.all()] == [rule_id]
+
+    assert call(app, sfa.delete_alert_rule, "DELETE", f"/alert_rules/{rule_id}", rule_id=rule_id)[1] == 200
+    assert sfa.alert_engine.rule_count() == len(sfa.DEFAULT_THRESHOLDS)
+    assert call(app, sfa.delete_alert_rule, "DELETE", f"/alert_rules/{rule_id}", rule_id=rule_id)[1] == 404
+
+
+def test_rules_changed_by_another_worker_are_reloaded(app):
+    import smart_farm_app as sfa
+
+    with app.app_context():
+        sfa.evaluate_alerts(reading(900))  # Loads the seeded rules
+        # Another worker adds a rule: the row and a new version in the shared state file
+        sfa.db.session.add(sfa.AlertRule(farm_id="farm", metric="co2", operator="above", threshold=800))
+        sfa.db.session.commit()
+        sfa.get_shared_state().update(sfa.ALERT_RULES_VERSION_KEY, lambda version: version + 1, 0)
+
+        sfa.evaluate_alerts(reading(900, timestamp=1))
+        assert sfa.Alert.query.count() == 1
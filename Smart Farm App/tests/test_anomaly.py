@@ -0,0 +1,67 @@
+import numpy as np
+
+from anomaly import StreamingDetector, score_batch
+
+
+def feed(detector, values, farm_id="farm", device_id="dev", metric="temperature"):
+    return [detector.score(farm_id, {metric: value}, device_id).get(metric) for value in values]
+
+
+def noisy(level, count, spread=0.2):
+    return [level + spread * ((i % 5) - 2) / 2 for i in range(count)]
+
+
+def test_spike_is_flagged_and_does_not_move_the_baseline():
+    detector = StreamingDetector()
+    feed(detector, noisy(25.0, 30))
+    assert feed(detector, [60.0]) == ["spike"]
+    assert feed(detector, noisy(25.0, 5)) == [None] * 5
+
+
+def test_level_shift_is_accepted_after_a_run_of_spikes():
+    detector = StreamingDetector(shift_count=5)
+    feed(detector, noisy(25.0, 30))
+    flags = feed(detector, noisy(32.0, 20))
+    assert flags[:4] == ["spike"] * 4
+    assert flags[4:] == [None] * 16
+
+
+def test_spikes_in_alternating_directions_are_not_a_level_shift():
+    detector = StreamingDetector(shift_count=3)
+    feed(detector, noisy(25.0, 30))
+    assert feed(detector, [40.0, 10.0, 40.0, 10.0, 40.0, 10.0]) == ["spike"] * 6
+
+
+def test_light_at_zero_all_night_is_not_stuck():
+    detector = StreamingDetector(stuck_count=12)
+    flags = feed(detector, [0.0] * 200, metric="light_intensity")
+    assert set(flags) == {None}
+
+
+def test_constant_temperature_is_stuck():
+    detector = StreamingDetector(stuck_count=12)
+    flags = feed(detector, [21.5] * 20)
+    assert flags[:11] == [None] * 11
+    assert flags[11:] == ["stuck"] * 9
+
+
+def test_interleaved_devices_keep_separate_baselines():
+    detector = StreamingDetector()
+    flags = []
+    for cool, warm in zip(noisy(18.0, 40), noisy(30.0, 40)):
+        flags += feed(detector, [cool], device_id="north")
+        flags += feed(detector, [warm], device_id="south")
+    assert set(flags) == {None}
+    assert feed(detector, [30.0], device_id="north") == ["spike"]
+
+
+def test_out_of_range_is_flagged():
+    detector = StreamingDetector()
+    assert feed(detector, [200.0]) == ["out_of_range"]
+
+
+def test_batch_skips_the_stuck_rule_for_light():
+    reasons = score_batch(np.zeros(100), "light_intensity", stuck_count=12)
+    assert set(reasons) == {""}
+    reasons = score_batch(np.full(100, 21.5), "temperature", stuck_count=12)
+    assert reasons[11] == "stuck"
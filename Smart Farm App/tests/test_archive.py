@@ -0,0 +1,51 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+pytest.importorskip("pyarrow")
+
+import archive
+from readings import METRICS
+
+
+def month_columns(ids, start=datetime(2024, 1, 1)):
+    return {
+        "id": ids,
+        "updated_time": [start + timedelta(minutes=i) for i in ids],
+        **{metric: np.array([float(i) for i in ids]) for metric in METRICS},
+        "anomaly": [None] * len(ids),
+    }
+
+
+def read_month(root):
+    return archive.read_range(str(root), "farm", datetime(2024, 1, 1), datetime(2024, 2, 1))
+
+
+def test_writing_the_same_rows_again_is_idempotent(tmp_path):
+    assert archive.write_month(str(tmp_path), "farm", 2024, 1, month_columns([1, 2, 3])) == 3
+    assert archive.write_month(str(tmp_path), "farm", 2024, 1, month_columns([1, 2, 3])) == 3
+    assert list(read_month(tmp_path)["id"]) == [1, 2, 3]
+
+
+def test_extending_a_month_keeps_one_copy_of_overlapping_ids(tmp_path):
+    archive.write_month(str(tmp_path), "farm", 2024, 1, month_columns([1, 2, 3]))
+    assert archive.write_month(str(tmp_path), "farm", 2024, 1, month_columns([3, 4, 5])) == 5
+    rows = read_month(tmp_path)
+    assert list(rows["id"]) == [1, 2, 3, 4, 5]
+    assert list(rows["temperature"]) == [1.0, 2.0, 3.0, 4.0, 5.0]
+
+
+def test_rewritten_rows_replace_the_archived_copy(tmp_path):
+    archive.write_month(str(tmp_path), "farm", 2024, 1, month_columns([1, 2]))
+    updated = month_columns([2])
+    updated["anomaly"] = ["temperature:spike"]
+    archive.write_month(str(tmp_path), "farm", 2024, 1, updated)
+    assert list(read_month(tmp_path)["anomaly"]) == [None, "temperature:spike"]
+
+
+def test_archived_farms_lists_quoted_farm_ids(tmp_path):
+    archive.write_month(str(tmp_path), "farm/north", 2024, 1, month_columns([1]))
+    archive.write_month(str(tmp_path), "farm", 2024, 1, month_columns([1]))
+    assert archive.archived_farms(str(tmp_path)) == ["farm", "farm/north"]
+    assert archive.archived_farms(str(tmp_path / "missing")) == []
@@ -0,0 +1,55 @@
+import pytest
+
+from Template import request_message as rq
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def bucket(clock, per_minute=60, burst=5, reserve=0.0):
+    return rq.TokenBucket(per_minute, burst, reserve, clock=clock)
+
+
+def test_bucket_starts_full_and_refills_at_the_rate(clock):
+    budget = bucket(clock, per_minute=60, burst=2)
+    assert [budget.try_take(rq.TELEMETRY) for _ in range(2)] == [0, 0]
+    assert budget.try_take(rq.TELEMETRY) == pytest.approx(1.0)
+    clock.now += 1
+    assert budget.try_take(rq.TELEMETRY) == 0
+    clock.now += 3600  # Never refills past the burst size
+    assert budget.status()["tokens"] == 2
+
+
+def test_telemetry_leaves_the_reserve_to_control(clock):
+    budget = bucket(clock, burst=5, reserve=3)
+    assert [budget.try_take(rq.TELEMETRY) for _ in range(3)] == [0, 0, pytest.approx(1.0)]
+    assert [budget.try_take(rq.CONTROL) for _ in range(4)] == [0, 0, 0, pytest.approx(1.0)]
+
+
+def test_empty_budget_rejects_without_waiting(clock):
+    budget = bucket(clock, burst=1)
+    events = []
+    budget.on_event = lambda event, priority, wait: events.append((event, priority))
+    budget.acquire(rq.TELEMETRY)
+    with pytest.raises(rq.BudgetExceeded):
+        budget.acquire(rq.TELEMETRY)
+    assert events == [("granted", rq.TELEMETRY), ("rejected", rq.TELEMETRY)]
+
+
+def test_throttling_blocks_every_priority_until_retry_after(clock):
+    budget = bucket(clock, burst=5)
+    budget.throttled(30)
+    clock.now += 29
+    assert budget.try_take(rq.CONTROL) == pytest.approx(1.0)
+    clock.now += 1
+    assert budget.try_take(rq.CONTROL) == 0
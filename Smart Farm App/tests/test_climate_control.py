@@ -0,0 +1,44 @@
+import pytest
+
+from climate_control import DEFAULT_SETPOINTS, ClimateController
+
+
+def recording_actions(calls):
+    def action(name, command):
+        def run(*args):
+            calls.append((name, command) + args)
+            return {"status": "success"}
+        return run
+    return {name: (action(name, "on"), action(name, "off")) for name in DEFAULT_SETPOINTS}
+
+
+def test_partial_setpoints_for_a_new_loop_start_from_the_defaults():
+    controller = ClimateController(recording_actions([]), setpoints={})
+    controller.configure({"fan": {"setpoint": 28}})
+    config = controller.state()["fan"]
+    assert config["setpoint"] == 28
+    assert config["metric"] == DEFAULT_SETPOINTS["fan"]["metric"]
+    assert config["min_on"] == DEFAULT_SETPOINTS["fan"]["min_on"]
+
+
+@pytest.mark.parametrize("setpoints", [
+    [1],
+    {"fan": 5},
+    {"heater": {}},
+    {"fan": {"setpoint": 28}, "window": {"setpoint": "high"}},
+    {"fan": {"bogus": 1}},
+    {"fan": {"min_off": -1}},
+])
+def test_invalid_setpoints_change_no_loop(setpoints):
+    controller = ClimateController(recording_actions([]))
+    before = controller.state()
+    with pytest.raises((TypeError, ValueError)):
+        controller.configure(setpoints)
+    assert controller.state() == before
+
+
+def test_process_passes_its_arguments_to_the_actions():
+    calls = []
+    controller = ClimateController(recording_actions(calls), setpoints={"fan": {}})
+    controller.process(0, {"temperature": 35.0}, "dev1")
+    assert calls == [("fan", "on", "dev1")]
@@ -0,0 +1,74 @@
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from command_queue import (QUEUED, SENT, SAFETY_PRIORITY, NORMAL_PRIORITY,
+                           plan_dispatch, retry_delay)
+
+
+def command(id, device_id="dev", actuator="fan", priority=NORMAL_PRIORITY, status=QUEUED, attempts=0,
+            next_attempt_time=0, expires_time=1000):
+    return SimpleNamespace(id=id, device_id=device_id, actuator=actuator, priority=priority, status=status,
+                           attempts=attempts, next_attempt_time=next_attempt_time, expires_time=expires_time)
+
+
+def plan(commands, now=100, max_attempts=3):
+    return [(action, command.id) for action, command in plan_dispatch(commands, now, max_attempts)]
+
+
+def test_one_command_per_actuator_in_priority_then_id_order():
+    commands = [command(1), command(2), command(3, priority=SAFETY_PRIORITY), command(4, device_id="other")]
+    assert sorted(plan(commands)) == [("send", 3), ("send", 4)]
+
+
+def test_unacknowledged_head_holds_back_its_actuator():
+    commands = [command(1, status=SENT, attempts=1, next_attempt_time=150), command(2)]
+    assert plan(commands) == []
+    assert plan(commands, now=150) == [("send", 1)]
+
+
+def test_unacknowledged_command_does_not_hold_back_other_actuators():
+    commands = [command(1, actuator="fan", status=SENT, attempts=1, next_attempt_time=150),
+                command(2, actuator="light"), command(3, actuator="window")]
+    assert sorted(plan(commands)) == [("send", 2), ("send", 3)]
+
+
+def test_expired_commands_are_dropped_and_the_next_one_goes_out():
+    commands = [command(1, expires_time=100), command(2)]
+    assert plan(commands) == [("expire", 1), ("send", 2)]
+
+
+def test_command_fails_after_max_attempts():
+    commands = [command(1, status=SENT, attempts=3), command(2)]
+    assert plan(commands, max_attempts=3) == [("fail", 1), ("send", 2)]
+    assert plan(commands, max_attempts=4) == [("send", 1)]
+
+
+def test_retry_delay_doubles_up_to_the_maximum():
+    delays = [retry_delay(attempts, base=2, max_delay=10, jitter=0) for attempts in range(6)]
+    assert delays == [2, 2, 4, 8, 10, 10]
+
+
+@pytest.mark.parametrize("attempts", [1, 3, 10])
+def test_retry_delay_jitter_stays_within_bounds(attempts):
+    rng = random.Random(7)
+    nominal = min(2 * 2 ** (attempts - 1), 30)
+    for _ in range(200):
+        assert nominal * 0.8 <= retry_delay(attempts, base=2, max_delay=30, jitter=0.2, rng=rng) <= nominal * 1.2
+
+
+def test_dispatcher_sends_other_actuators_while_one_is_never_acknowledged(app, monkeypatch):
+    import smart_farm_app as sfa
+
+    sent = []
+    monkeypatch.setattr(sfa, "send_actuator_command", lambda name: sent.append(name) or {"status": "success"})
+    monkeypatch.setattr(sfa, "retrieve_actuator_states", lambda: None)  # No state report: nothing is acknowledged
+    with app.app_context():
+        sfa.enqueue_actuator_command("open_fan")
+        sfa.enqueue_actuator_command("light_on")
+        assert sfa.dispatch_commands() == 2
+        assert sfa.dispatch_commands() == 0  # The fan waits for its retry delay
+        statuses = {command.name: command.status for command in sfa.ActuatorCommand.query.all()}
+    assert sent == ["open_fan", "light_on"]
+    assert statuses == {"open_fan": SENT, "light_on": SENT}
@@ -0,0 +1,93 @@
+import json
+import os
+
+import pytest
+
+import smart_farm_app as sfa
+from conf_cache import ConfigCache, ConfigError, validate_smf_conf, validate_wifi_conf
+from Template import request_message as rq
+
+WIFI = [{"wifi_name": "farm", "password": "secret", "activate": 1}, {"wifi_name": "office", "password": "", "activate": 0}]
+
+
+def write(path, data, indent=None):
+    path.write_text(json.dumps(data, indent=indent))
+
+
+def test_load_detects_content_changes_but_not_formatting(tmp_path):
+    path = tmp_path / "wifi_conf.json"
+    cache = ConfigCache()
+    write(path, WIFI)
+    data, digest = cache.load(str(path), validate_wifi_conf)
+    assert data == WIFI
+
+    # Reformatted: re-read (the size changed) but the same digest
+    write(path, WIFI, indent=2)
+    assert cache.load(str(path), validate_wifi_conf)[1] == digest
+
+    changed = [dict(WIFI[0], activate=0), dict(WIFI[1], activate=1)]
+    write(path, changed)
+    os.utime(path, ns=(1, 1))
+    data, new_digest = cache.load(str(path), validate_wifi_conf)
+    assert data == changed and new_digest != digest
+
+
+@pytest.mark.parametrize("data, error", [
+    ({"wifi_name": "farm", "password": "secret", "activate": 1}, "non-empty list"),
+    ([], "non-empty list"),
+    ([{"wifi_name": "farm", "activate": 1}], "missing password"),
+    ([dict(WIFI[0], ssid="farm")], "unexpected ssid"),
+    ([dict(WIFI[0], activate="1")], "activate must be 0 or 1"),
+    ([dict(WIFI[0], wifi_name="")], "wifi_name must be"),
+    ([WIFI[0], dict(WIFI[1], activate=1)], "more than one network"),
+])
+def test_invalid_wifi_conf_is_rejected(data, error):
+    with pytest.raises(ConfigError, match=error):
+        validate_wifi_conf(data)
+
+
+def test_smf_conf_needs_known_keys_and_a_metric():
+    entry = {"updated_time": "2024-01-01T00:00:00", "temperature": "25", "humidity": "60"}
+    assert validate_smf_conf([entry]) == [entry]
+    assert validate_smf_conf(entry) == entry
+    with pytest.raises(ConfigError, match="unexpected pressure"):
+        validate_smf_conf([dict(entry, pressure="1013")])
+    with pytest.raises(ConfigError, match="at least one of"):
+        validate_smf_conf({"updated_time": "2024-01-01T00:00:00"})
+    with pytest.raises(ConfigError):
+        validate_smf_conf("temperature")
+
+
+def test_unchanged_config_is_sent_once_across_workers(app, tmp_path, monkeypatch):
+    # Config files are read next to the app module
+    monkeypatch.setattr(sfa, "__file__", str(tmp_path / "smart_farm_app.py"))
+    sent = []
+    monkeypatch.setattr(rq, "sf_send", lambda topic, msg: sent.append(msg))
+    write(tmp_path / "wifi_conf.json", WIFI)
+
+    with app.app_context():
+        response, status = sfa.request_wifi_change()
+        assert status == 200 and response["sent"]
+
+        # Another worker, with its own parse cache, sees the digest in the shared state
+        monkeypatch.setattr(sfa, "conf_cache", ConfigCache())
+        response, status = sfa.request_wifi_change()
+        assert status == 200 and not response["sent"]
+        assert len(sent) == 1
+
+        write(tmp_path / "wifi_conf.json", WIFI[:1])
+        assert sfa.request_wifi_change()[0]["sent"]
+        assert len(sent) == 2
+
+
+def test_invalid_config_is_not_sent(app, tmp_path, monkeypatch):
+    monkeypatch.setattr(sfa, "__file__", str(tmp_path / "smart_farm_app.py"))
+    sent = []
+    monkeypatch.setattr(rq, "sf_send", lambda topic, msg: sent.append(msg))
+    write(tmp_path / "wifi_conf.json", [{"wifi_name": "farm"}])
+
+    with app.app_context():
+        response, status = sfa.request_wifi_change()
+    assert status == 500
+    assert "missing password, activate" in response["message"]
+    assert sent == []
@@ -0,0 +1,139 @@
+import json
+import threading
+
+import pytest
+
+from Template import request_message as rq
+
+
+class FakeAdafruitIO:
+    """requests stand-in: feeds keep their last value, and a command to sfinp updates the state feed."""
+
+    def __init__(self):
+        self.feeds = {rq.IN_CHANNEL: "", rq.STATE_CHANNEL: "fan off"}
+        self.gets = 0
+        self.timeouts = []
+
+    def post(self, url, data=None, headers=None, timeout=None):
+        self.timeouts.append(timeout)
+        value = json.loads(data)["value"]
+        self.feeds[rq.IN_CHANNEL] = value
+        if value == "fan_open":
+            self.feeds[rq.STATE_CHANNEL] = "fan on"
+        return Response(None)
+
+    def get(self, url, headers=None, timeout=None):
+        self.timeouts.append(timeout)
+        self.gets += 1
+        feed = url.split("/feeds/")[1].split("/")[0]
+        return Response(self.feeds[feed])
+
+
+class Response:
+    status_code = 200
+    headers = {}
+
+    def __init__(self, value):
+        self.value = value
+
+    def json(self):
+        return {"value": self.value}
+
+    def raise_for_status(self):
+        pass
+
+
+@pytest.fixture
+def broker(monkeypatch):
+    fake = FakeAdafruitIO()
+    monkeypatch.setattr(rq, "requests", fake)
+    monkeypatch.setattr(rq, "budget", rq.TokenBucket(6000, 100))
+    monkeypatch.setattr(rq, "feed_cache", rq.FeedCache({}, default_ttl=60))
+    return fake
+
+
+def test_reads_within_the_ttl_are_cached(broker):
+    assert rq.sf_recv_from_stout() == "fan off"
+    assert rq.sf_recv_from_stout() == "fan off"
+    assert broker.gets == 1
+
+
+def test_read_after_write_returns_the_new_value(broker):
+    assert rq.sf_recv_from_sfout(topic=rq.IN_CHANNEL) == ""
+    rq.sf_send(rq.IN_CHANNEL, "light_open")
+    assert rq.sf_recv_from_sfout(topic=rq.IN_CHANNEL) == "light_open"
+
+
+def test_command_invalidates_the_state_feed(broker):
+    assert rq.sf_recv_from_stout() == "fan off"
+    rq.sf_send(rq.IN_CHANNEL, "fan_open")
+    assert rq.sf_recv_from_stout() == "fan on"
+
+
+def test_fetch_overtaken_by_invalidate_is_not_cached():
+    cache = rq.FeedCache({}, default_ttl=60)
+    started, release = threading.Event(), threading.Event()
+    values = iter(["old", "new"])
+
+    def slow_fetch():
+        started.set()
+        release.wait(5)
+        return next(values)
+
+    reader = threading.Thread(target=cache.get, args=("stout", slow_fetch))
+    reader.start()
+    started.wait(5)
+    cache.invalidate("stout")
+    release.set()
+    reader.join(5)
+    assert cache.get("stout", lambda: next(values)) == "new"
+
+
+def test_broker_calls_have_a_timeout(broker):
+    rq.sf_recv_from_stout()
+    rq.sf_send(rq.IN_CHANNEL, "fan_open")
+    assert broker.timeouts == [rq.AIO_TIMEOUT, rq.AIO_TIMEOUT]
+
+
+def shared_read(cache, leader_fetch):
+    """Start a fetch in a thread, then read the same feed; returns (the read's error, leader thread)."""
+    started = threading.Event()
+
+    def fetch():
+        started.set()
+        return leader_fetch()
+
+    leader = threading.Thread(target=lambda: pytest.raises(Exception, cache.get, "stout", fetch))
+    leader.start()
+    started.wait(5)
+    with pytest.raises(Exception) as error:
+        cache.get("stout", lambda: "unused")
+    return error.value, leader
+
+
+def test_waiters_get_the_error_of_a_failed_fetch():
+    release = threading.Event()
+
+    def failing_fetch():
+        release.wait(5)
+        raise ConnectionError("broker down")
+
+    cache = rq.FeedCache({}, default_ttl=60)
+    threading.Timer(0.1, release.set).start()
+    error, leader = shared_read(cache, failing_fetch)
+    leader.join(5)
+    assert isinstance(error, ConnectionError)
+
+
+def test_waiters_give_up_on_a_hung_fetch():
+    release = threading.Event()
+
+    def hung_fetch():
+        release.wait(5)
+        raise TimeoutError("read timed out")
+
+    cache = rq.FeedCache({}, default_ttl=60, wait_timeout=0.05)
+    error, leader = shared_read(cache, hung_fetch)
+    assert isinstance(error, TimeoutError)
+    release.set()
+    leader.join(5)
@@ -0,0 +1,92 @@
+import json
+from datetime import datetime
+
+import smart_farm_app as sfa
+from ingest_log import LogRecord
+from Template import request_message as rq
+
+VALUES = {"co2": 400.0, "temperature": 25.0, "humidity": 60.0, "light_intensity": 100.0}
+MESSAGE = json.dumps({"CO2": 400, "Temperature": 25, "Humidity": 60, "Light_0x5C": 100})
+
+
+def stored_count():
+    return sfa.SmartFarmData.query.count()
+
+
+def test_repolled_reading_without_seq_is_skipped_and_reported(app, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with app.app_context():
+        first = sfa.save_smart_farm_data(MESSAGE, received_at=1700000000.25)
+        assert (first["inserted"], first["skipped"]) == (1, 0)
+        assert "saved to the database" in first["message"]
+
+        # The same data point polled again
+        second = sfa.save_smart_farm_data(MESSAGE, received_at=1700000000.25)
+        assert (second["inserted"], second["skipped"]) == (0, 1)
+        assert "0 new readings saved" in second["message"]
+        assert "1 duplicates skipped" in second["message"]
+        assert stored_count() == 1
+
+        # A later data point is a new reading
+        sfa.save_smart_farm_data(MESSAGE, received_at=1700000005)
+        assert stored_count() == 2
+
+
+def test_readings_without_seq_are_deduped_within_a_batch_per_farm(app):
+    with app.app_context():
+        inserted = sfa.save_logged_readings([
+            LogRecord(1700000000.1, "farm-a", VALUES, None, None, None),
+            LogRecord(1700000000.6, "farm-a", VALUES, None, None, None),
+            LogRecord(1700000000.1, "farm-b", VALUES, None, None, None),
+        ])
+        assert inserted == 2
+        times = {row.updated_time for row in sfa.SmartFarmData.query}
+        assert times == {sfa.from_epoch(1700000000)}
+
+
+def test_readings_with_seq_are_deduped_on_device_and_seq(app):
+    with app.app_context():
+        assert sfa.save_logged_readings([LogRecord(1700000000, "farm-a", VALUES, "dev", 1, None)]) == 1
+        # Same timestamp, different seq: both kept; a repeated seq is not
+        assert sfa.save_logged_readings([
+            LogRecord(1700000000, "farm-a", VALUES, "dev", 1, None),
+            LogRecord(1700000000, "farm-a", VALUES, "dev", 2, None),
+        ]) == 1
+        assert stored_count() == 2
+
+
+def add_row(farm_id, co2, device_id=None, seq=None):
+    sfa.db.session.add(sfa.SmartFarmData(
+        farm_id=farm_id, updated_time=datetime(2024, 1, 1), co2=co2, temperature="25",
+        humidity="60", light_intensity="100", device_id=device_id, seq=seq,
+    ))
+
+
+def test_remove_duplicate_runs_deletes_repeats_of_the_previous_row_per_farm(app):
+    with app.app_context():
+        add_row("farm-a", "400")
+        add_row("farm-b", "400")   # Another farm in between does not break the run
+        add_row("farm-a", "400")   # Duplicate
+        add_row("farm-a", "410")
+        add_row("farm-a", "400")   # Same as an earlier row, but not the previous one
+        add_row("farm-a", "400", device_id="dev", seq=1)
+        add_row("farm-a", "400", device_id="dev", seq=2)  # Different seq: a new reading
+        sfa.db.session.commit()
+
+        assert sfa.remove_duplicate_runs(dry_run=True) == 1
+        assert stored_count() == 7
+
+        assert sfa.remove_duplicate_runs(chunk_size=2) == 1
+        assert stored_count() == 6
+        assert [row.co2 for row in sfa.SmartFarmData.query.filter_by(farm_id="farm-a").order_by(sfa.SmartFarmData.id)] == ["400", "410", "400", "400", "400"]
+        assert sfa.remove_duplicate_runs() == 0
+
+
+def test_published_time_is_only_known_for_the_last_point_read():
+    rq.remember_point("feed", {"value": "a", "created_epoch": "1700000000"})
+    assert rq.published_time("feed", "a") == 1700000000.0
+    assert rq.published_time("feed", "b") is None
+
+    # A point without a creation time forgets the previous one
+    rq.remember_point("feed", {"value": "a"})
+    assert rq.published_time("feed", "a") is None
@@ -0,0 +1,89 @@
+import struct
+import zlib
+
+import pytest
+
+from ingest_log import ID_SIZE, RECORD_MARKER, RECORD_SIZE, IngestLog
+
+
+@pytest.fixture
+def log(tmp_path):
+    log = IngestLog(str(tmp_path / "ingest.log"))
+    yield log
+    log.close()
+
+
+def drain_all(log):
+    drained = []
+    log.drain(drained.extend)
+    return drained
+
+
+def test_round_trip(log):
+    log.append(100.0, "farm-a", {"temperature": 21.5, "co2": None}, device_id="dev1", seq=7, device_time=99.5)
+    log.append(101.0, "farm-a", {"humidity": 55.0})
+    first, second = drain_all(log)
+    assert first.farm_id == "farm-a" and first.device_id == "dev1" and first.seq == 7 and first.device_time == 99.5
+    assert first.values["temperature"] == 21.5 and first.values["co2"] is None
+    assert second.device_id is None and second.seq is None and second.device_time is None
+    assert log.pending() == 0
+
+
+@pytest.mark.parametrize("farm_id, device_id", [
+    ("greenhouse-north-wing-bay-17", "esp32-240ac400512e"),  # Longer than the old 16-byte fields
+    ("온실-북쪽", "센서-🌱-1"),
+    ("f" * ID_SIZE, "d" * ID_SIZE),
+])
+def test_long_and_non_ascii_ids_round_trip(log, farm_id, device_id):
+    log.append(100.0, farm_id, {"temperature": 20.0}, device_id=device_id)
+    (record,) = drain_all(log)
+    assert (record.farm_id, record.device_id) == (farm_id, device_id)
+
+
+def test_over_limit_ids_are_rejected(log):
+    with pytest.raises(ValueError):
+        log.append(100.0, "f" * (ID_SIZE + 1), {})
+    with pytest.raises(ValueError):
+        log.append(100.0, "farm", {}, device_id="é" * (ID_SIZE // 2 + 1))
+    assert log.pending() == 0
+
+
+def test_undecodable_record_is_skipped_and_counted(log):
+    skipped = []
+    log.on_skip = lambda index, reason: skipped.append((index, reason))
+    for i in range(3):
+        log.append(100.0 + i, "farm", {"temperature": 20.0 + i}, device_id="dev")
+    # Corrupt the farm_id of the middle record into invalid UTF-8, with a matching CRC
+    start = 64 + RECORD_SIZE
+    log._map[start + 17:start + 19] = b"\xff\xfe"
+    struct.pack_into("<B3xI", log._map, start, RECORD_MARKER, zlib.crc32(log._map[start + 8:start + RECORD_SIZE]))
+
+    records = drain_all(log)
+    assert [record.timestamp for record in records] == [100.0, 102.0]
+    assert skipped == [(1, "undecodable")]
+    assert log.skipped == 1 and log.pending() == 0
+
+
+def test_failed_handler_leaves_records_and_skips_are_counted_once(log):
+    log.append(100.0, "farm", {})
+    log._map[64 + 8] ^= 0xFF  # Break the CRC of the first record
+    log.append(101.0, "farm", {})
+
+    def failing(batch):
+        raise RuntimeError("database down")
+
+    with pytest.raises(RuntimeError):
+        log.drain(failing)
+    assert log.skipped == 0 and log.pending() == 2
+    assert [record.timestamp for record in drain_all(log)] == [101.0]
+    assert log.skipped == 1
+
+
+def test_reopen_recovers_appended_records(tmp_path):
+    path = str(tmp_path / "ingest.log")
+    log = IngestLog(path)
+    log.append(100.0, "farm", {"temperature": 20.0}, device_id="dev")
+    log.close()
+    log = IngestLog(path)
+    assert [record.device_id for record in drain_all(log)] == ["dev"]
+    log.close()
@@ -0,0 +1,27 @@
+from sqlalchemy import text
+
+import metrics
+import smart_farm_app as sfa
+
+
+def query_count():
+    return sum(value for name, labels, value in metrics.snapshot()["values"] if name == "sf_db_queries_total")
+
+
+def test_query_outside_an_app_context_is_counted(app):
+    with app.app_context():
+        engine = sfa.db.engine
+    before = query_count()
+    with engine.connect() as connection:
+        assert connection.execute(text("select 1")).scalar() == 1
+    assert query_count() == before + 1
+
+
+def test_slow_query_outside_an_app_context_is_logged(app, caplog, monkeypatch):
+    with app.app_context():
+        engine = sfa.db.engine
+    monkeypatch.setitem(sfa.query_profile, "slow_query_threshold_ms", 0)
+    with caplog.at_level("WARNING", logger=sfa.__name__):
+        with engine.connect() as connection:
+            connection.execute(text("select 1"))
+    assert "Slow query" in caplog.text
@@ -0,0 +1,87 @@
+import math
+
+import numpy as np
+
+from ring_buffer import ReadingRingBuffer, RecentReadings
+
+
+def fill(buffer, timestamps):
+    for timestamp in timestamps:
+        buffer.append(timestamp, {"temperature": float(timestamp), "humidity": None})
+
+
+def test_window_is_half_open_and_oldest_first():
+    buffer = ReadingRingBuffer(10)
+    fill(buffer, [1, 2, 3, 4, 5])
+    timestamps, values = buffer.window(2, 5)
+    assert timestamps.tolist() == [2, 3, 4]
+    assert values["temperature"].dtype == np.float64
+    assert values["temperature"].tolist() == [2.0, 3.0, 4.0]
+    assert all(math.isnan(value) for value in values["humidity"])
+
+
+def test_wraparound_keeps_the_newest_capacity_readings():
+    buffer = ReadingRingBuffer(4)
+    fill(buffer, range(1, 8))
+    assert buffer.size == 4
+    assert buffer.window(0, 100)[0].tolist() == [4, 5, 6, 7]
+    # Dropped readings are no longer covered
+    assert buffer.covered_since == 4
+    assert not buffer.covers(3) and buffer.covers(4)
+
+
+def test_out_of_order_readings_come_back_sorted():
+    buffer = ReadingRingBuffer(4)
+    fill(buffer, [10, 30, 20, 40, 25])
+    assert buffer.window(0, 100)[0].tolist() == [20, 25, 30, 40]
+
+
+def test_memory_is_fixed_by_the_capacity():
+    buffer = ReadingRingBuffer(100)
+    before = buffer.nbytes
+    fill(buffer, range(1000))
+    assert buffer.nbytes == before == 100 * (8 + 4 * len(buffer.metrics))
+
+
+def test_recent_readings_only_answer_covered_ranges():
+    recent = RecentReadings(capacity=3)
+    assert recent.window("farm", 0, 10) is None
+
+    def loader(capacity):
+        return np.array([5.0, 6.0]), {"temperature": np.array([50.0, 60.0])}
+
+    recent.append("farm", 7, {"temperature": 70.0}, loader)
+    assert recent.window("farm", 4, 10) is None  # Older rows may exist in the database
+    assert recent.window("farm", 5, 10)[0].tolist() == [5, 6, 7]
+    recent.append("farm", 8, {"temperature": 80.0})
+    assert recent.window("farm", 5, 10) is None  # Reading 5 was dropped
+    assert recent.window("farm", 6, 10)[1]["temperature"].tolist() == [60.0, 70.0, 80.0]
+    assert recent.memory_report()["farms"]["farm"]["readings"] == 3
+
+
+def test_data_recent_is_served_from_the_buffer_of_a_single_writer(app):
+    import metrics
+    import smart_farm_app as sfa
+    from ingest_log import LogRecord
+
+    def hits():
+        return sum(value for name, _, value in metrics.snapshot()["values"] if name == "sf_ring_buffer_hits_total")
+
+    app.config['RING_BUFFER_ENABLED'] = True
+    with app.app_context():
+        now = sfa.to_epoch(sfa.gmt7_now().replace(tzinfo=None))
+        for i in range(3):
+            values = {"temperature": 20.0 + i, "humidity": 50.0, "co2": 500.0, "light_intensity": 0.0}
+            sfa.save_logged_readings([LogRecord(now - 60 + i, sfa.DEFAULT_FARM_ID, values, "dev", i, None)])
+    before = hits()
+    with app.test_request_context("/data_recent"):
+        data = sfa.data_recent.__wrapped__().get_json()["data"]
+    assert hits() == before + 1
+    assert data["temperature"] == [20.0, 21.0, 22.0]
+
+
+def test_fill_with_room_to_spare_covers_from_complete_since():
+    recent = RecentReadings(capacity=3)
+    recent.get_or_create("farm", lambda capacity: (np.array([5.0]), {"temperature": np.array([50.0])}), complete_since=1)
+    assert recent.window("farm", 1, 10)[0].tolist() == [5]
+    assert recent.window("farm", 0, 10) is None
@@ -0,0 +1,65 @@
+import threading
+
+import pytest
+from sqlalchemy import create_engine, event
+
+import smart_farm_app as sfa  # Installs the query listeners on every engine
+from scheduler import AdvisoryLock, FarmSchedule, IngestScheduler
+
+
+@pytest.fixture
+def lock_engine(tmp_path):
+    """A SQLite engine with MySQL-style GET_LOCK/RELEASE_LOCK, held per connection."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'locks.db'}")
+    holders = {}
+    guard = threading.Lock()
+
+    @event.listens_for(engine, "connect")
+    def add_lock_functions(dbapi_connection, _):
+        def get_lock(name, timeout):
+            with guard:
+                if holders.setdefault(name, dbapi_connection) is dbapi_connection:
+                    return 1
+                return 0
+
+        def release_lock(name):
+            with guard:
+                if holders.get(name) is dbapi_connection:
+                    del holders[name]
+                    return 1
+                return 0
+
+        dbapi_connection.create_function("GET_LOCK", 2, get_lock)
+        dbapi_connection.create_function("RELEASE_LOCK", 1, release_lock)
+
+    yield engine
+    engine.dispose()
+
+
+def scheduler(lock):
+    return IngestScheduler([FarmSchedule("farm", interval=60)], lambda schedule: True, lock)
+
+
+@pytest.mark.parametrize("with_app_context", [False, True])
+def test_only_one_scheduler_leads_and_the_lock_passes_on_release(app, lock_engine, with_app_context):
+    context = app.app_context if with_app_context else None
+    first = scheduler(AdvisoryLock(lock_engine, "ingest", context))
+    second = scheduler(AdvisoryLock(lock_engine, "ingest", context))
+
+    assert first._check_leadership() is True
+    assert first._check_leadership() is True  # Confirmed on the held connection
+    assert second._check_leadership() is False
+
+    first.lock.release()
+    assert second._check_leadership() is True
+    second.lock.release()
+
+
+def test_leadership_is_checked_from_a_thread_without_app_context(app, lock_engine):
+    leader = scheduler(AdvisoryLock(lock_engine, "ingest", app.app_context))
+    results = []
+    thread = threading.Thread(target=lambda: results.append(leader._check_leadership()))
+    thread.start()
+    thread.join()
+    assert results == [True]
+    leader.lock.release()
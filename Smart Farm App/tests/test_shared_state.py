@@ -0,0 +1,114 @@
+import struct
+
+import pytest
+
+from shared_state import HEADER, KEY_SIZE, MAGIC, SharedState, StateFullError
+
+
+@pytest.fixture
+def state(tmp_path):
+    state = SharedState(str(tmp_path / "state.bin"), slots=8)
+    yield state
+    state.close()
+
+
+def test_set_get_and_update(state):
+    state.set("latest:farm:a", {"temperature": 21.5})
+    assert state.get("latest:farm:a") == {"temperature": 21.5}
+    assert state.update("counter", lambda value: value + 1, default=0) == 1
+    assert state.update("counter", lambda value: value + 1, default=0) == 2
+    assert state.get("missing", "default") == "default"
+
+
+def test_full_table_raises(state):
+    for i in range(8):
+        state.set(f"key{i}", i)
+    with pytest.raises(StateFullError):
+        state.set("one-too-many", 0)
+    assert state.get("key3") == 3
+
+
+def test_expired_keys_free_their_slots(state):
+    for i in range(8):
+        state.incr_window(f"rate:login:10.0.0.{i}", 60, now=1000.0)
+    with pytest.raises(StateFullError):
+        state.update("rate:login:10.0.1.1", lambda _: 1, now=1010.0)
+    # Next window: the old counters have expired and their slots are reused
+    assert state.incr_window("rate:login:10.0.1.1", 60, now=1080.0) == 1
+    assert state.get("rate:login:10.0.0.1", now=1080.0) is None
+    assert list(state.items("rate:", now=1080.0)) == ["rate:login:10.0.1.1"]
+
+
+def test_window_counter_counts_and_resets(state):
+    assert [state.incr_window("rate:x", 60, now=t) for t in (0.0, 10.0, 59.0)] == [1, 2, 3]
+    assert state.incr_window("rate:x", 60, now=61.0) == 1
+
+
+def test_expired_key_in_a_probe_chain_does_not_hide_later_keys(state):
+    state.update("short", lambda _: 1, ttl=1, now=0.0)
+    for i in range(7):
+        state.set(f"key{i}", i)
+    # Whatever order the keys probed in, each stays reachable after "short" expires
+    assert all(state.get(f"key{i}") == i for i in range(7))
+    state.set("new", "value")
+    assert state.get("new") == "value"
+    assert all(state.get(f"key{i}") == i for i in range(7))
+
+
+@pytest.mark.parametrize("key", ["latest:device:" + "d" * 100, "latest:device:" + "温室" * 30])
+def test_long_keys_are_stored_by_digest(state, key):
+    state.set(key, "reading")
+    assert state.get(key) == "reading"
+    assert state.get(key[:-1]) is None
+    (stored,) = state.items("latest:device:")
+    assert len(stored.encode("utf-8")) <= KEY_SIZE
+
+
+def test_file_from_an_older_version_starts_empty(tmp_path):
+    path = tmp_path / "state.bin"
+    path.write_bytes(HEADER.pack(MAGIC, 1, 8) + b"\0" * (64 - HEADER.size) + b"\xff" * 8 * 512)
+    state = SharedState(str(path), slots=8)
+    assert state.items() == {}
+    state.set("key", 1)
+    assert state.get("key") == 1
+    assert struct.unpack_from("<I", path.read_bytes(), 8)[0] == 2
+    state.close()
+
+
+def test_old_file_is_replaced_not_truncated_under_its_readers(tmp_path):
+    import mmap
+    import os
+
+    path = tmp_path / "state.bin"
+    path.write_bytes(HEADER.pack(MAGIC, 1, 8) + b"\0" * (64 - HEADER.size) + b"\xff" * 8 * 512)
+    # A worker of the old release still has the file mapped
+    fd = os.open(path, os.O_RDWR)
+    old_map = mmap.mmap(fd, 0)
+    old_inode = os.fstat(fd).st_ino
+
+    state = SharedState(str(path), slots=8)
+    assert os.stat(path).st_ino != old_inode
+    assert old_map[-1] == 0xff  # Still readable: no SIGBUS
+    old_map.close()
+    os.close(fd)
+
+    # A second process of the new release opens the replacement as is
+    state.set("key", 1)
+    other = SharedState(str(path), slots=8)
+    assert other.get("key") == 1
+    other.close()
+    state.close()
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["state.bin"]
+
+
+def test_tracked_devices_fit_one_shared_value(app):
+    import smart_farm_app as sfa
+
+    with app.app_context():
+        for i in range(sfa.MAX_TRACKED_DEVICES + 4):
+            device_id = f"device-{i:02d}-" + "x" * 22  # 32 characters, the longest the database stores
+            assert sfa.apply_state_report({"Device": device_id, "State": {"fan": "on"}, "Seq": i})
+        tracked = sfa.get_shared_state().get("devices")
+    assert sfa.local_state.get("devices") is None  # Nothing fell back to per-process state
+    assert tracked[-1].startswith(f"device-{sfa.MAX_TRACKED_DEVICES + 3:02d}")
+    assert 1 < len(tracked) <= sfa.MAX_TRACKED_DEVICES
@@ -0,0 +1,46 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import smart_farm_app as sfa
+from cache import TTLCache
+
+
+def statistics(app, **args):
+    with app.test_request_context("/data_statistics", query_string=args):
+        response = sfa.data_statistics.__wrapped__()
+    response, code = response if isinstance(response, tuple) else (response, 200)
+    return code, response.get_json()
+
+
+@pytest.mark.parametrize("value", ["2024-01-01T00:00:00+07:00", "2023-12-31T17:00:00+00:00", "2023-12-31T17:00:00Z",
+                                   "2024-01-01T00:00:00"])
+def test_times_are_normalized_to_naive_gmt7(app, value):
+    with app.test_request_context("/", query_string={"end": value}):
+        start, end = sfa.parse_time_range()
+    assert end == datetime(2024, 1, 1)
+    assert start.tzinfo is None
+
+
+def test_statistics_accept_an_offset_timestamp(app, monkeypatch):
+    monkeypatch.setattr(sfa, "statistics_cache", TTLCache())
+    code, body = statistics(app, start="2023-12-31T00:00:00+07:00", end="2024-01-01T00:00:00+07:00")
+    assert code == 200
+    assert body["end"] == "2024-01-01 00:00:00"
+    # Offset and naive spellings of the same range share a cache entry
+    assert statistics(app, start="2023-12-31T00:00:00", end="2024-01-01T00:00:00")[0] == 200
+    assert len(sfa.statistics_cache) == len(sfa.METRICS)
+
+
+def test_only_ranges_older_than_the_ingest_lag_are_cached(app, monkeypatch):
+    monkeypatch.setattr(sfa, "statistics_cache", TTLCache())
+    now = sfa.gmt7_now().replace(tzinfo=None, microsecond=0)
+    lag = timedelta(seconds=app.config['STATISTICS_CACHE_MIN_AGE'])
+
+    recent_end = now - lag / 2
+    statistics(app, start=(recent_end - timedelta(hours=1)).isoformat(), end=recent_end.isoformat())
+    assert len(sfa.statistics_cache) == 0
+
+    old_end = now - 2 * lag
+    statistics(app, start=(old_end - timedelta(hours=1)).isoformat(), end=old_end.isoformat())
+    assert len(sfa.statistics_cache) == len(sfa.METRICS)
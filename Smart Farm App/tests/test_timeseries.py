@@ -0,0 +1,37 @@
+import math
+
+from timeseries import resample
+
+
+def test_ffill_fills_empty_intervals_from_the_last_non_empty_one():
+    # Intervals ending at 10 and 20 hold readings; those ending at 30 and 40 are empty
+    out = resample([3, 8, 15], [1.0, 2.0, 5.0], [0, 10, 20, 30, 40], "ffill")
+    assert math.isnan(out[0])
+    assert out.tolist()[1:] == [2.0, 5.0, 5.0, 5.0]
+
+
+def test_ffill_stops_max_gap_after_the_reading_it_fills_from():
+    out = resample([10], [1.0], [10, 20, 30], "ffill", max_gap=10)
+    assert out.tolist()[:2] == [1.0, 1.0]
+    assert math.isnan(out[2])
+
+
+def test_every_method_puts_a_reading_at_the_same_grid_point():
+    # One reading inside each of the intervals ending at 10 and 30; the interval ending at 20 is empty
+    timestamps, values, grid = [4, 27], [1.0, 3.0], [0, 10, 20, 30]
+    ffill = resample(timestamps, values, grid, "ffill").tolist()
+    gaps = resample(timestamps, values, grid, "nan").tolist()
+    mean = resample(timestamps, values, grid, "mean").tolist()
+    assert ffill[1:] == [1.0, 1.0, 3.0]
+    assert math.isnan(gaps[2]) and math.isnan(mean[2])
+    for method_values in (gaps, mean):
+        assert math.isnan(method_values[0])
+        assert [method_values[1], method_values[3]] == [ffill[1], ffill[3]]
+
+
+def test_nan_leaves_gaps_and_mean_averages_each_interval():
+    timestamps, values, grid = [2, 8, 10, 25], [1.0, 2.0, 6.0, 4.0], [10, 20, 30]
+    gaps = resample(timestamps, values, grid, "nan")
+    assert gaps[0] == 6.0 and math.isnan(gaps[1]) and gaps[2] == 4.0
+    mean = resample(timestamps, values, grid, "mean")
+    assert mean[0] == 3.0 and math.isnan(mean[1]) and mean[2] == 4.0
@@ -0,0 +1,85 @@
+import time
+
+from sqlalchemy import text
+
+import smart_farm_app as sfa
+from cache import TTLCache
+
+
+def add_user(app, username="grower"):
+    with app.app_context():
+        user = sfa.User(username=username, password=sfa.bcrypt.generate_password_hash("password123").decode("utf-8"))
+        sfa.db.session.add(user)
+        sfa.db.session.commit()
+        return user.id
+
+
+def delete_without_orm(user_id):
+    """Delete the row behind the cache's back, as another worker's raw SQL would."""
+    sfa.db.session.execute(text("DELETE FROM user WHERE id = :id"), {"id": user_id})
+    sfa.db.session.commit()
+
+
+def test_lookups_are_served_from_the_cache(app):
+    user_id = add_user(app)
+    with app.app_context():
+        assert sfa.get_cached_user(user_id).username == "grower"
+        delete_without_orm(user_id)
+        # Still cached: no database query
+        assert sfa.get_cached_user(user_id).username == "grower"
+
+
+def test_cached_users_expire(app, monkeypatch):
+    user_id = add_user(app)
+    monkeypatch.setattr(sfa, "user_cache", TTLCache(ttl=0.05))
+    with app.app_context():
+        assert sfa.get_cached_user(user_id) is not None
+        delete_without_orm(user_id)
+        time.sleep(0.1)
+        assert sfa.get_cached_user(user_id) is None
+
+
+def test_updated_user_is_reloaded(app):
+    user_id = add_user(app)
+    with app.app_context():
+        assert sfa.get_cached_user(user_id).username == "grower"
+        sfa.db.session.get(sfa.User, user_id).username = "farmer"
+        sfa.db.session.commit()
+        assert sfa.get_cached_user(user_id).username == "farmer"
+
+
+def test_rolled_back_change_keeps_the_cache(app):
+    user_id = add_user(app)
+    with app.app_context():
+        sfa.get_cached_user(user_id)
+        version = sfa.read_state(sfa.USERS_VERSION_KEY, 0)
+        sfa.db.session.get(sfa.User, user_id).username = "farmer"
+        sfa.db.session.flush()
+        sfa.db.session.rollback()
+        sfa.db.session.commit()
+        assert sfa.read_state(sfa.USERS_VERSION_KEY, 0) == version
+
+
+def test_deleted_user_is_rejected_in_every_worker(app, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # /data_retrieval exports a JSON file
+    user_id = add_user(app)
+    client = app.test_client()
+    token = client.post("/login", json={"username": "grower", "password": "password123"}).get_json()["token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    assert client.get("/data_retrieval", headers=headers).status_code == 200
+
+    # Another worker deletes the user: this one only sees the version bump in the shared state
+    with app.app_context():
+        delete_without_orm(user_id)
+        sfa.users_changed()
+    assert client.get("/data_retrieval", headers=headers).status_code == 401
+
+    # Deleting through the ORM bumps the version itself
+    user_id = add_user(app, "farmer")
+    token = client.post("/login", json={"username": "farmer", "password": "password123"}).get_json()["token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    assert client.get("/data_retrieval", headers=headers).status_code == 200
+    with app.app_context():
+        sfa.db.session.delete(sfa.db.session.get(sfa.User, user_id))
+        sfa.db.session.commit()
+    assert client.get("/data_retrieval", headers=headers).status_code == 401
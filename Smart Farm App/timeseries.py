@@ -0,0 +1,132 @@
+"""Vectorized time-series helpers over columnar NumPy arrays (timestamps in Unix seconds)."""
+import numpy as np
+
+
+RESAMPLE_METHODS = ("ffill", "linear", "nan", "mean")
+
+
+def make_grid(start, end, interval):
+    """Regular grid of timestamps from start (inclusive) to end (exclusive)."""
+    if interval <= 0:
+        raise ValueError("interval must be positive")
+    return np.arange(start, end, interval, dtype=np.float64)
+
+
+def resample(timestamps, values, grid, method="ffill", max_gap=None):
+    """Resample irregular readings onto a regular grid.
+
+    timestamps must be sorted ascending; NaN values are treated as missing. Every method aligns the
+    same way: grid point i stands for the interval ending at it, (grid[i] - interval, grid[i]],
+    interval being the grid spacing.
+    - "ffill": latest reading of the interval; a point whose interval has no readings is filled
+      from the last non-empty interval before it, and points before the first reading are NaN
+    - "nan": latest reading of the interval, with empty intervals left as NaN
+    - "mean": mean of the readings in the interval, NaN for empty intervals
+    - "linear": linear interpolation at the grid point between the surrounding readings
+    With max_gap, a "ffill" point more than max_gap seconds after the reading it was filled from,
+    or a "linear" point between readings more than max_gap seconds apart, is NaN; "linear" is
+    also NaN outside the observed range.
+    """
+    if method not in RESAMPLE_METHODS:
+        raise ValueError(f"Unknown resample method: {method}")
+
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    grid = np.asarray(grid, dtype=np.float64)
+
+    present = ~np.isnan(values)
+    ts, vs = timestamps[present], values[present]
+    out = np.full(grid.size, np.nan)
+    if ts.size == 0 or grid.size == 0:
+        return out
+    interval = grid[1] - grid[0] if grid.size > 1 else np.inf
+
+    if method == "mean":
+        # Interval of each reading: the first grid point at or after it
+        bins = np.searchsorted(grid, ts, side="left")
+        inside = (bins < grid.size) & (ts > grid[0] - interval)
+        counts = np.bincount(bins[inside], minlength=grid.size)
+        sums = np.bincount(bins[inside], weights=vs[inside], minlength=grid.size)
+        filled = counts > 0
+        out[filled] = sums[filled] / counts[filled]
+        return out
+
+    # Index of the last reading at or before each grid point
+    before = np.searchsorted(ts, grid, side="right") - 1
+    has_before = before >= 0
+    before_clipped = np.clip(before, 0, ts.size - 1)
+
+    if method in ("ffill", "nan"):
+        out[has_before] = vs[before_clipped[has_before]]
+        if method == "nan":
+            out[has_before & (ts[before_clipped] <= grid - interval)] = np.nan
+        elif max_gap is not None:
+            out[has_before & (grid - ts[before_clipped] > max_gap)] = np.nan
+        return out
+
+    # Linear: only between two readings, never extrapolated
+    after = np.clip(before + 1, 0, ts.size - 1)
+    inside = has_before & (grid <= ts[-1])
+    out[inside] = np.interp(grid[inside], ts, vs)
+    if max_gap is not None:
+        gap = ts[after] - ts[before_clipped]
+        exact = ts[before_clipped] == grid
+        out[inside & ~exact & (gap > max_gap)] = np.nan
+    return out
+
+
+def time_above(timestamps, values, threshold, max_gap=None):
+    """Fraction of the observed time during which values were above threshold.
+
+    Each reading is taken to hold until the next one, for at most max_gap seconds.
+    """
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    present = ~np.isnan(values)
+    ts, vs = timestamps[present], values[present]
+    if ts.size < 2:
+        return None
+
+    durations = np.diff(ts)
+    if max_gap is not None:
+        durations = np.minimum(durations, max_gap)
+    total = durations.sum()
+    if total <= 0:
+        return None
+    return float(durations[vs[:-1] > threshold].sum() / total)
+
+
+def describe(timestamps, values, percentiles=(5, 50, 95), bins=20, thresholds=(), max_gap=None):
+    """Summary statistics of one metric: moments, percentiles, histogram and time above thresholds."""
+    values = np.asarray(values, dtype=np.float64)
+    present = values[~np.isnan(values)]
+    if present.size == 0:
+        return {"count": 0}
+
+    counts, edges = np.histogram(present, bins=bins)
+    return {
+        "count": int(present.size),
+        "mean": float(present.mean()),
+        "std": float(present.std()),
+        "min": float(present.min()),
+        "max": float(present.max()),
+        "percentiles": {
+            f"p{q:g}": float(value) for q, value in zip(percentiles, np.percentile(present, percentiles))
+        },
+        "histogram": {"edges": edges.tolist(), "counts": counts.tolist()},
+        "time_above": {
+            f"{threshold:g}": time_above(timestamps, values, threshold, max_gap) for threshold in thresholds
+        },
+    }
+
+
+def day_slices(timestamps, utc_offset=7 * 3600):
+    """Split sorted timestamps into local calendar days: [(day_start_ts, start_index, end_index)]."""
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    if timestamps.size == 0:
+        return []
+    days = np.floor((timestamps + utc_offset) / 86400)
+    boundaries = np.flatnonzero(np.diff(days)) + 1
+    starts = np.concatenate(([0], boundaries))
+    ends = np.concatenate((boundaries, [timestamps.size]))
+    return [(days[s] * 86400 - utc_offset, int(s), int(e)) for s, e in zip(starts, ends)]